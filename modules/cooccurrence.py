@@ -0,0 +1,206 @@
+# Dependencies
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import os
+
+# Local dependencies
+from modules.network import Network, get_cooccurrence, factorize_nodes
+
+# Constants
+NODE_BITS = 32  # Bits of each node code within an edge key
+MIN_PENDING = 1 << 16  # Minimum number of pending co-occurrences before they get merged
+
+
+# Running co-occurrence counts, updated by batches of entities
+class NetworkBuilder:
+    """
+    Edges are stored as sorted keys (pairs of node codes) and weights; each
+    batch adds its own (few) co-occurrences to a pending list, which is merged
+    into the stored edges only once it grows as large as them, or when the
+    graph is retrieved. Hence ingesting a batch costs its co-occurrences only.
+
+    Each tweet must be ingested (and retracted) with all its entities at
+    once, since co-occurrences are counted within each batch.
+    """
+
+    # Constructor
+    def __init__(self, node_columns=['entity_text'], path=None):
+        # Define columns defining a node
+        self.node_columns = list(node_columns)
+        # Define checkpoint file path (.npz format)
+        self.path = path
+        # Initialize empty state
+        self.reset()
+        # Load previously stored state, if any
+        if path is not None and os.path.isfile(path):
+            self.load()
+
+    # Reset builder to empty network
+    def reset(self):
+        # Initialize nodes labels and their codes (label: code)
+        self.labels, self.codes = [], dict()
+        # Initialize stored edges (sorted keys) and their weights
+        self.keys = np.empty(0, dtype=np.int64)
+        self.weights = np.empty(0, dtype=np.int64)
+        # Initialize pending edges keys and weights, not merged yet
+        self.pending, self.pending_size = [], 0
+
+    # Add co-occurrences of a batch of entities
+    def ingest(self, entities):
+        self.update(entities, sign=1)
+
+    # Remove co-occurrences of a batch of (previously ingested) entities
+    def retract(self, entities):
+        self.update(entities, sign=-1)
+
+    # Add or remove co-occurrences of a batch of entities
+    def update(self, entities, sign=1):
+        # Case batch is empty
+        df = entities.df
+        if df.empty:
+            return
+        # Encode batch nodes, then map them to builder codes (new nodes get new codes)
+        nodes, labels = factorize_nodes(df, self.node_columns)
+        codes = self.encode(labels)
+        # Count co-occurrences of batch nodes (upper triangle only)
+        counts = sparse.triu(get_cooccurrence(df.tweet_id.values, df.entity_index.values, nodes, len(labels)), format='coo')
+        # Define edge keys (lower node code first)
+        x, y = codes[counts.row], codes[counts.col]
+        keys = (np.minimum(x, y) << NODE_BITS) | np.maximum(x, y)
+        # Store batch co-occurrences as pending edges
+        self.pending.append((keys, sign * counts.data.astype(np.int64)))
+        self.pending_size += keys.shape[0]
+        # Case pending edges are as many as stored ones: merge them
+        if self.pending_size > max(self.keys.shape[0], MIN_PENDING):
+            self.merge()
+
+    # Map labels to nodes codes, adding new labels
+    def encode(self, labels):
+        # Loop through each label
+        codes = np.empty(len(labels), dtype=np.int64)
+        for i, label in enumerate(labels):
+            # Case new label: add it to nodes
+            code = self.codes.get(label)
+            if code is None:
+                code = self.codes[label] = len(self.labels)
+                self.labels.append(label)
+            codes[i] = code
+        return codes
+
+    # Merge pending edges into stored ones
+    def merge(self):
+        # Case there are no pending edges
+        if not self.pending:
+            return
+        # Sort keys (stored ones are already sorted, stable sort exploits it)
+        keys = np.concatenate([self.keys] + [keys for keys, _ in self.pending])
+        weights = np.concatenate([self.weights] + [weights for _, weights in self.pending])
+        order = np.argsort(keys, kind='stable')
+        keys, weights = keys[order], weights[order]
+        # Sum weights of equal keys
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if keys.shape[0] else order
+        keys, weights = keys[starts], np.add.reduceat(weights, starts) if starts.shape[0] else weights
+        # Check that only ingested co-occurrences have been retracted
+        if np.any(weights < 0):
+            raise ValueError('Retracted co-occurrences have not been ingested')
+        # Keep only edges still having a weight
+        keep = weights != 0
+        self.keys, self.weights = keys[keep], weights[keep]
+        self.pending, self.pending_size = [], 0
+
+    # Retrieve current weighted adjacency matrix and nodes labels
+    def get_weights(self, sort=True):
+        """
+        Input
+        1. sort: whether nodes get sorted by label, otherwise rows follow
+        nodes codes (faster, codes being kept across updates);
+
+        Output
+        1. symmetric CSR matrix of co-occurrences, as computed by get_weights
+        over all the ingested (and not retracted) entities (nodes without
+        edges are kept);
+        2. array of nodes labels, one per row;
+        """
+        # Merge pending edges
+        self.merge()
+        # Sort nodes by label, if required
+        labels = np.empty(len(self.labels), dtype=object)
+        labels[:] = self.labels
+        order = np.argsort(labels, kind='stable') if sort else np.arange(labels.shape[0])
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        # Decode edges into (sorted) nodes codes
+        x, y = rank[self.keys >> NODE_BITS], rank[self.keys & ((1 << NODE_BITS) - 1)]
+        # Define symmetric adjacency matrix (diagonal is stored once)
+        is_loop = x == y
+        weights = sparse.csr_matrix(
+            (np.concatenate([self.weights, self.weights[~is_loop]]), (np.concatenate([x, y[~is_loop]]), np.concatenate([y, x[~is_loop]]))),
+            shape=(order.shape[0], order.shape[0])
+        )
+        return weights, labels[order]
+
+    # Retrieve current network (nodes without edges are left out)
+    def get_network(self, backend=Network):
+        return backend.from_weights(*self.get_weights())
+
+    # Load state from disk (.npz file)
+    def load(self, path=None):
+        with np.load(path or self.path, allow_pickle=False) as state:
+            self.node_columns = state['node_columns'].tolist()
+            self.keys, self.weights = state['keys'], state['weights']
+            labels = state['labels']
+        # Restore labels (tuples for nodes defined by more than one column)
+        self.labels = labels.tolist() if labels.ndim == 1 else [*map(tuple, labels.tolist())]
+        self.codes = {label: code for code, label in enumerate(self.labels)}
+        self.pending, self.pending_size = [], 0
+
+    # Save state to disk (.npz file), atomically
+    def save(self, path=None):
+        # Merge pending edges
+        self.merge()
+        # Write to temporary file first
+        path = path or self.path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as out_file:
+            np.savez(
+                out_file, node_columns=np.array(self.node_columns, dtype=str),
+                labels=np.array(self.labels, dtype=str), keys=self.keys, weights=self.weights
+            )
+        # Replace previous state
+        os.replace(tmp_path, path)
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    import tempfile
+
+    # Define entities of a few tweets
+    df = pd.DataFrame({
+        'tweet_id': ['1', '1', '1', '2', '2', '3', '3', '3', '4', '4'],
+        'entity_index': [0, 1, 2, 0, 1, 0, 1, 2, 0, 1],
+        'entity_text': ['climate', 'change', 'climate', 'climate', 'ice', 'ice', 'melt', 'change', 'storm', 'ice'],
+        'entity_tag': ['N', 'N', 'N', 'N', 'N', 'N', 'V', 'N', 'N', 'N']
+    })
+    # Define a minimal entities table wrapper
+    class Batch:
+        def __init__(self, df):
+            self.df = df
+
+    # Ingest tweets in two batches, retract first tweet
+    builder = NetworkBuilder(node_columns=['entity_text', 'entity_tag'])
+    builder.ingest(Batch(df[df.tweet_id <= '2']))
+    builder.ingest(Batch(df[df.tweet_id > '2']))
+    builder.retract(Batch(df[df.tweet_id == '1']))
+    # Compare network with the one built from scratch
+    network = builder.get_network()
+    expected = Network.from_entities(Batch(df[df.tweet_id != '1']), node_columns=['entity_text', 'entity_tag'])
+    print('Edges:', sorted(network.net.edges(data='weight')))
+    print('Same network:', sorted(network.net.edges(data='weight')) == sorted(expected.net.edges(data='weight')))
+    # Save state, then restore it
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        builder.save(os.path.join(tmp_dir, 'builder.npz'))
+        restored = NetworkBuilder(path=os.path.join(tmp_dir, 'builder.npz'))
+        print('Restored network:', sorted(restored.get_network().net.edges(data='weight')) == sorted(network.net.edges(data='weight')))
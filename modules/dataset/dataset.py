@@ -1,18 +1,27 @@
 # Dependencies
 import numpy as np
 import pandas as pd
+import shutil
+import os
+
+# Constants
+# Columns used to partition on-disk columnar datasets
+PARTITION_COLUMNS = ['year', 'month']
 
 
 class Dataset:
 
     # Attributes
     columns = None  # DataFrame columns type
+    compact_columns = None  # DataFrame columns type, in compact representation
     df = None  # DataFrame object containing data
 
     # Construtcor
-    def __init__(self, df=None, columns={}):
+    def __init__(self, df=None, columns={}, compact_columns={}):
         # Define dataset columns
         self.columns = columns
+        # Define dataset columns in compact representation
+        self.compact_columns = compact_columns
         # Instantiate new data container
         self.df = pd.DataFrame(data=df, columns=self.columns)
 
@@ -20,9 +29,61 @@ class Dataset:
     def copy(self):
         copy = self.__class__()
         copy.columns = self.columns
+        copy.compact_columns = self.compact_columns
         copy.df = self.df.copy()
         return copy
 
+    # Convert inner DataFrame to compact representation (numeric ids, categorical strings)
+    def compact(self, categories={}):
+        # Initialize columns types
+        dtypes = {}
+        # Loop through each column which has a compact type
+        for column, dtype in self.compact_columns.items():
+            # Skip columns which are not in inner DataFrame
+            if column not in self.df.columns:
+                continue
+            # Case categorical column: encode values as codes into a vocabulary
+            if dtype == 'category':
+                # Define vocabulary as given one, extended with unseen values
+                dtype = pd.CategoricalDtype(categories=make_vocabulary(
+                    self.df[column], categories.get(column, None)
+                ))
+            # Store column type
+            dtypes[column] = dtype
+        # Cast inner DataFrame columns
+        self.df = self.df.astype(dtypes)
+
+    # Convert inner DataFrame back from compact representation
+    def expand(self):
+        # Loop through each column which has a compact type
+        for column in self.compact_columns:
+            # Skip columns which are not in inner DataFrame
+            if column not in self.df.columns:
+                continue
+            # Cast current column back to its original type
+            self.df[column] = self.df[column].astype(self.columns[column])
+
+    # States wether inner DataFrame is in compact representation
+    def is_compact(self):
+        # Initialize flag
+        is_compact = False
+        # Loop through each column which has a compact type
+        for column, dtype in self.compact_columns.items():
+            # Skip columns which are not in inner DataFrame
+            if column not in self.df.columns:
+                continue
+            # Case categorical column
+            if dtype == 'category':
+                is_compact = isinstance(self.df[column].dtype, pd.CategoricalDtype)
+            # Case numeric column
+            else:
+                is_compact = self.df[column].dtype == np.dtype(dtype)
+            # Case current column is not compact
+            if not is_compact:
+                return False
+        # Return flag
+        return is_compact
+
     # Load inner dataset from disk (.json file)
     def from_json(self, in_path, date_columns=[]):
         # Load entries into inner DataFrame
@@ -38,6 +99,40 @@ class Dataset:
         # Store pandas Dataframe as json object
         self.df.to_json(out_path, orient='records')
 
+    # Load inner dataset from disk (.parquet dataset partitioned by year/month)
+    def from_parquet(self, in_path, columns=None, years=None, months=None):
+        # Define partitions filter (only matching partitions are read)
+        filters = []
+        # Case only some years are requested
+        if years is not None:
+            filters.append(('year', 'in', [int(y) for y in years]))
+        # Case only some months are requested
+        if months is not None:
+            filters.append(('month', 'in', [int(m) for m in months]))
+        # Load only requested columns from matching partitions
+        df = pd.read_parquet(
+            in_path,
+            columns=list(columns) if columns is not None else None,
+            filters=filters if filters else None
+        )
+        # Drop partitioning columns, restore default index
+        self.df = df.drop(columns=PARTITION_COLUMNS, errors='ignore').reset_index(drop=True)
+
+    # Save inner dataset to disk (.parquet dataset partitioned by year/month)
+    def to_parquet(self, out_path, dates, overwrite=True, part=None):
+        # Case previously stored dataset must be removed
+        if overwrite and os.path.isdir(out_path):
+            shutil.rmtree(out_path)
+        # Add partitioning columns, according to given dates (aligned with rows)
+        df = self.df.assign(
+            year=np.asarray(dates.dt.year, dtype=np.int32),
+            month=np.asarray(dates.dt.month, dtype=np.int32)
+        )
+        # Name written files after given part, if any (random names otherwise)
+        kwargs = {'basename_template': part + '-{i}.parquet'} if part is not None else {}
+        # Store pandas DataFrame as partitioned parquet dataset
+        df.to_parquet(out_path, partition_cols=PARTITION_COLUMNS, index=False, **kwargs)
+
     def to_csv(self, out_path, sep=','):
         self.df.to_csv(out_path, sep=sep, header=True, index=False)
 
@@ -45,6 +140,21 @@ class Dataset:
         self.to_csv(out_path, sep='\t')
 
 
+# Make a vocabulary out of given values, extending an existing one
+def make_vocabulary(values, vocabulary=None):
+    # Case values are already categorical: use their categories
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.categories
+    # Get unique values, in order of appearance
+    values = pd.Index(pd.unique(np.asarray(values)))
+    # Case no previous vocabulary has been given
+    if vocabulary is None:
+        return values
+    # Append unseen values to previous vocabulary (previous codes do not change)
+    vocabulary = pd.Index(vocabulary)
+    return vocabulary.append(values.difference(vocabulary, sort=False))
+
+
 # Test
 if __name__ == '__main__':
     # Instantiate new empty dataset
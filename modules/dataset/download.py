@@ -0,0 +1,534 @@
+# Dependencies
+from modules.dataset.tweets import API_PRODUCT_30DAY
+from modules.dataset.tweets import write_json_list
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from datetime import datetime
+import threading
+import time
+import json
+import os
+
+# Constants
+MAX_RETRIES = 5  # Maximum number of retries for a rate limited request
+BACKOFF = 2.0  # Base waiting time (seconds) before retrying a request
+
+
+# Token bucket rate limiter, shared among download workers
+class TokenBucket:
+
+    # Constructor
+    def __init__(self, rate, capacity=1):
+        # Define tokens refill rate (tokens per second)
+        self.rate = rate
+        # Define maximum number of tokens (allowed burst)
+        self.capacity = capacity
+        # Bucket starts full
+        self.tokens = capacity
+        # Define last refill time
+        self.last = time.monotonic()
+        # Define lock (bucket is shared among threads)
+        self.lock = threading.Lock()
+
+    # Wait until a token is available, then consume it
+    def acquire(self):
+        # Loop until a token has been consumed
+        while True:
+            with self.lock:
+                # Refill tokens according to elapsed time
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                # Case a token is available: consume it
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # Compute time needed for next token to be available
+                wait = (1 - self.tokens) / self.rate
+            # Wait for next token (outside of the lock)
+            time.sleep(wait)
+
+
+# Single buffered writer for raw tweets json list (.jsonl) file
+class JsonlWriter:
+
+    # Constructor
+    def __init__(self, out_path, ids_path=None, buffering=1 << 20):
+        # Initialize set of already written tweet ids
+        self.seen = None
+        # Case duplicate tweets must be suppressed
+        if ids_path is not None:
+            self.seen = load_seen_ids(ids_path, out_path)
+        # Open output file once, in append mode
+        self.file = open(out_path, 'a', encoding='utf-8', buffering=buffering)
+        # Open persisted tweet ids file, in append mode
+        self.ids_file = open(ids_path, 'a', encoding='utf-8') if ids_path is not None else None
+        # Define lock (writer is shared among threads)
+        self.lock = threading.Lock()
+
+    # Write a batch of raw tweets, without interleaving with other batches
+    # Return number of written tweets (duplicates are not written)
+    def write(self, retrieved_tweets):
+        with self.lock:
+            # Case duplicate tweets must be suppressed
+            if self.seen is not None:
+                # Keep only tweets not written yet (even within current batch)
+                unseen = list()
+                for retrieved_tweet in retrieved_tweets:
+                    tweet_id = str(retrieved_tweet.get('id_str'))
+                    if tweet_id not in self.seen:
+                        self.seen.add(tweet_id)
+                        unseen.append(retrieved_tweet)
+                retrieved_tweets = unseen
+            # Write tweets
+            write_json_list(retrieved_tweets, self.file)
+            # Persist ids of written tweets, after tweets themselves (ids file must never get ahead)
+            if self.ids_file is not None:
+                self.file.flush()
+                self.ids_file.writelines(str(t.get('id_str')) + '\n' for t in retrieved_tweets)
+            # Return number of written tweets
+            return len(retrieved_tweets)
+
+    # Flush buffered tweets (then their ids) to disk
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            if self.ids_file is not None:
+                self.ids_file.flush()
+
+    # Close output file
+    def close(self):
+        with self.lock:
+            self.file.close()
+            if self.ids_file is not None:
+                self.ids_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Persistent record of download progress for each sampled window
+class DownloadManifest:
+
+    # Constructor
+    def __init__(self, path):
+        # Define manifest file path
+        self.path = path
+        # Initialize windows states, in the same order of windows
+        self.windows = list()
+        # Initialize requested date ranges, whose windows have been sampled
+        self.ranges = list()
+        # Define lock (manifest is shared among threads)
+        self.lock = threading.Lock()
+        # Load previously stored manifest, if any
+        if os.path.isfile(path):
+            self.load()
+
+    # Load manifest from disk (.json file)
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as in_file:
+            manifest = json.load(in_file)
+        # Retrieve windows and requested ranges (missing in older manifests)
+        self.windows, self.ranges = manifest['windows'], manifest.get('ranges', list())
+
+    # Save manifest to disk (.json file), atomically
+    def save(self):
+        # Write to temporary file first
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as out_file:
+            json.dump({'windows': self.windows, 'ranges': self.ranges}, out_file)
+        # Replace previous manifest
+        os.replace(tmp_path, self.path)
+
+    # Set windows to be downloaded, unless previous ones are being resumed
+    def set_windows(self, windows):
+        with self.lock:
+            # Case windows have already been set: keep them
+            if self.windows:
+                return
+            # Initialize state of each window
+            self.windows = [{
+                'from_date': ws.isoformat(), 'to_date': we.isoformat(),
+                'next': None, 'pages': 0, 'done': False
+            } for ws, we in windows]
+            # Persist windows
+            self.save()
+
+    # Check whether windows of given date range have already been sampled
+    def has_range(self, from_date, to_date):
+        with self.lock:
+            return {'from_date': from_date.isoformat(), 'to_date': to_date.isoformat()} in self.ranges
+
+    # Add windows sampled from given date range, on days not covered yet (as not done)
+    def add_windows(self, windows, from_date, to_date):
+        """
+        Input
+        1. windows: list of (start, end) datetime tuples, one per day;
+        2. from_date, to_date: date range windows have been sampled from;
+
+        Output
+        1. number of added windows (the others being already stored);
+        """
+        with self.lock:
+            # Retrieve days covered by stored windows
+            covered = {w['from_date'][:10] for w in self.windows}
+            # Add windows of other days, to be downloaded
+            added = [(ws, we) for ws, we in windows if ws.date().isoformat() not in covered]
+            self.windows.extend({
+                'from_date': ws.isoformat(), 'to_date': we.isoformat(),
+                'next': None, 'pages': 0, 'done': False
+            } for ws, we in added)
+            # Record requested range
+            requested = {'from_date': from_date.isoformat(), 'to_date': to_date.isoformat()}
+            if requested not in self.ranges:
+                self.ranges.append(requested)
+            # Persist windows
+            self.save()
+            return len(added)
+
+    # Retrieve windows as list of (start, end) datetime tuples
+    def get_windows(self):
+        return [
+            (datetime.fromisoformat(w['from_date']), datetime.fromisoformat(w['to_date']))
+            for w in self.windows
+        ]
+
+    # Retrieve state of i-th window
+    def get_state(self, i):
+        with self.lock:
+            return dict(self.windows[i])
+
+    # Update state of i-th window and persist it
+    def update(self, i, next_token, pages):
+        with self.lock:
+            self.windows[i].update({
+                'next': next_token, 'pages': pages, 'done': next_token is None
+            })
+            self.save()
+
+
+# Load set of already written tweet ids (rebuilt from .jsonl file if missing)
+def load_seen_ids(ids_path, jsonl_path=None):
+    """
+    The ids file holds one line per raw tweets file line, in the same order
+    (ids are written after their tweets). Hence, if a crash left tweets whose
+    ids have not been persisted, they are the lines after the ones covered by
+    the ids file: their ids are parsed and appended to it.
+
+    Input
+    1. ids_path: persisted tweet ids file path (created if missing);
+    2. jsonl_path: raw tweets file path (optional);
+
+    Output
+    1. set of already written tweet ids;
+    """
+    # Initialize set of tweet ids and number of covered raw tweets lines
+    seen, covered = set(), 0
+    # Case persisted ids file exists: load complete lines only
+    if os.path.isfile(ids_path):
+        with open(ids_path, 'rb') as ids_file:
+            lines = ids_file.read().split(b'\n')[:-1]
+        seen.update(line.decode('utf-8').strip() for line in lines)
+        covered = len(lines)
+        # Drop trailing incomplete line, if any
+        with open(ids_path, 'rb+') as ids_file:
+            ids_file.truncate(sum(len(line) + 1 for line in lines))
+    # Case raw tweets file exists: retrieve ids of lines not covered by ids file
+    missing = list()
+    if jsonl_path is not None and os.path.isfile(jsonl_path):
+        with open(jsonl_path, 'rb') as jsonl_file:
+            for i, line in enumerate(jsonl_file):
+                # Skip covered lines, and incomplete last line
+                if i < covered or not line.endswith(b'\n'):
+                    continue
+                # Keep one id per line (empty if line is broken)
+                try:
+                    missing.append(str(json.loads(line).get('id_str')))
+                except ValueError:
+                    missing.append('')
+    # Persist missing ids
+    with open(ids_path, 'a', encoding='utf-8') as ids_file:
+        ids_file.writelines(tweet_id + '\n' for tweet_id in missing)
+    seen.update(missing)
+    # Return set of ids (empty lines are not ids)
+    seen.discard('')
+    return seen
+
+
+# Minimal client for (premium) search endpoints, e.g. a local stand-in server
+class SearchApi:
+
+    # Constructor
+    def __init__(self, base_url, bearer_token=None, timeout=60):
+        # Define API base url (e.g. https://api.twitter.com/1.1)
+        self.base_url = base_url.rstrip('/')
+        # Define bearer token (application only authentication)
+        self.bearer_token = bearer_token
+        # Define request timeout (seconds)
+        self.timeout = timeout
+
+    # Execute request, mimicking TwitterAPI.request interface
+    def request(self, resource, params={}):
+        # Remove unset parameters
+        params = {k: v for k, v in params.items() if v is not None}
+        # Define request url (resource parameters are prefixed by ':')
+        url = '{0:s}/{1:s}.json?{2:s}'.format(
+            self.base_url, resource.replace(':', ''), urlencode(params)
+        )
+        # Define request headers
+        headers = {}
+        if self.bearer_token is not None:
+            headers['Authorization'] = 'Bearer {0:s}'.format(self.bearer_token)
+        # Execute request
+        try:
+            with urlopen(Request(url, headers=headers), timeout=self.timeout) as res:
+                return SearchResponse(res.status, json.loads(res.read().decode('utf-8')))
+        # Case request failed: forward status code
+        except HTTPError as err:
+            raise SearchError(err.code, err.read().decode('utf-8', 'replace'))
+
+
+# Response of a search request, iterable over retrieved tweets
+class SearchResponse:
+
+    # Constructor
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    # Return whole json content
+    def json(self):
+        return self.content
+
+    # Iterate over retrieved tweets
+    def __iter__(self):
+        return iter(self.content.get('results', []))
+
+
+# Error of a search request
+class SearchError(Exception):
+
+    # Constructor
+    def __init__(self, status_code, msg=''):
+        super().__init__('Request failed with status {0:d}: {1:s}'.format(status_code, msg))
+        self.status_code = status_code
+
+
+# Download tweets for each sampled window, concurrently
+def download_windows(tweets, windows, label, query=None, batch_size=100,
+                     product=API_PRODUCT_30DAY, writer=None, workers=4,
+                     limiter=None, manifest=None, max_pages=1, callback=None):
+    """
+    Request tweets for every window using a pool of <workers> threads, each
+    request being subject to a shared rate limiter. Raw tweets are written
+    through a single shared writer. If a manifest is given, windows already
+    downloaded are skipped and partially downloaded ones are resumed from
+    their last pagination token.
+
+    Input
+    1. tweets: authenticated Tweets object, used to make requests;
+    2. windows: list of (start, end) datetime tuples;
+    3. label, query, batch_size, product: search request parameters;
+    4. writer: JsonlWriter where raw tweets are written (optional);
+    5. workers: maximum number of in-flight requests;
+    6. limiter: TokenBucket shared by requests (optional);
+    7. manifest: DownloadManifest with windows' progress (optional);
+    8. max_pages: maximum number of pages retrieved for each window;
+    9. callback: function called as callback(i, window, n) once the i-th
+    window has been downloaded, with n number of new tweets (optional);
+
+    Output
+    1. total number of new tweets;
+    """
+    # Define function downloading a single window
+    def download(i, window):
+        # Get current window state
+        state = {'next': None, 'pages': 0, 'done': False}
+        state = manifest.get_state(i) if manifest is not None else state
+        # Case window has already been downloaded
+        if state['done'] or state['pages'] >= max_pages:
+            return 0
+        # Initialize number of new tweets, next token and retrieved pages
+        n, next_token, pages = 0, state['next'], state['pages']
+        # Loop through each page
+        while pages < max_pages:
+            # Retrieve raw tweets for current page
+            retrieved_tweets, next_token = request_window(
+                tweets, window, label=label, query=query, batch_size=batch_size,
+                product=product, limiter=limiter, next_token=next_token
+            )
+            pages += 1
+            # Write raw tweets through shared writer, then flush them
+            if writer is not None:
+                n += writer.write(retrieved_tweets)
+                writer.flush()
+            else:
+                n += len(retrieved_tweets)
+            # Persist progress, once tweets are on disk
+            if manifest is not None:
+                manifest.update(i, next_token=next_token, pages=pages)
+            # Case there are no more pages
+            if next_token is None:
+                break
+        # Notify caller
+        if callback is not None:
+            callback(i, window, n)
+        # Return number of new tweets
+        return n
+
+    # Execute downloads in a thread pool (requests are I/O bound)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Submit a job for each window
+        futures = [executor.submit(download, i, w) for i, w in enumerate(windows)]
+        # Wait for results (raises first error, if any)
+        return sum(future.result() for future in futures)
+
+
+# Request a page of tweets for a single window, retrying rate limited requests
+def request_window(tweets, window, label, query=None, batch_size=100,
+                   product=API_PRODUCT_30DAY, limiter=None, params={},
+                   next_token=None):
+    # Get window start and end
+    from_date, to_date = window
+    # Loop through each attempt
+    for attempt in range(MAX_RETRIES + 1):
+        # Wait for rate limiter
+        if limiter is not None:
+            limiter.acquire()
+        # Try executing request
+        try:
+            return tweets.request_tweets(
+                label=label, query=query, from_date=from_date, to_date=to_date,
+                batch_size=batch_size, params=params, product=product,
+                next_token=next_token
+            )
+        # Case request failed
+        except Exception as err:
+            # Case error is not due to rate limiting or no more retries available
+            if getattr(err, 'status_code', None) != 429 or attempt == MAX_RETRIES:
+                raise
+            # Wait before retrying (exponential backoff)
+            time.sleep(BACKOFF * 2 ** attempt)
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    from modules.dataset.tweets import Tweets
+    from datetime import datetime, date, timedelta
+    import tempfile
+    import os
+
+    # Define stand-in for the premium search endpoint
+    class SearchHandler(BaseHTTPRequestHandler):
+
+        # Handle search request: return <maxResults> fake tweets for window,
+        # split in three pages (second page repeats some tweets of the first)
+        def do_GET(self):
+            # Parse query parameters
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            # Get requested page
+            page = int(params.get('next', 0))
+            # Define fake tweets
+            results = [{
+                'id_str': '{0:s}{1:03d}'.format(params['fromDate'], page * 5 + i),
+                'created_at': 'Mon Jan 01 00:00:00 +0000 2018',
+                'text': 'tweet {0:d} for {1:s}'.format(i, params['query'])
+            } for i in range(int(params['maxResults']))]
+            # Define response, with next page token
+            content = {'results': results}
+            if page < 2:
+                content['next'] = str(page + 1)
+            # Write response
+            content = json.dumps(content).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        # Do not log requests
+        def log_message(self, *args):
+            pass
+
+    # Start stand-in server on a free local port
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Define tweets object using stand-in server
+    tweets = Tweets()
+    tweets.api = SearchApi('http://127.0.0.1:{0:d}/1.1'.format(server.server_port))
+    # Define windows
+    start = datetime(2018, 1, 1)
+    windows = [(start + timedelta(days=d), start + timedelta(days=d, hours=1)) for d in range(20)]
+
+    # Define output, ids and manifest files, in a temporary directory
+    out_dir = tempfile.mkdtemp()
+    out_path = os.path.join(out_dir, 'tweets.jsonl')
+    ids_path = os.path.join(out_dir, 'tweets.ids')
+    manifest = DownloadManifest(os.path.join(out_dir, 'manifest.json'))
+    manifest.set_windows(windows)
+
+    # Download first two pages of each window concurrently
+    with JsonlWriter(out_path, ids_path=ids_path) as writer:
+        start_time = time.monotonic()
+        n = download_windows(
+            tweets, windows, label='test', query='#climate', batch_size=10,
+            writer=writer, workers=4, limiter=TokenBucket(rate=50, capacity=5),
+            manifest=manifest, max_pages=2
+        )
+        end_time = time.monotonic()
+    # Check retrieved tweets (overlapping tweets are written once)
+    assert n == 20 * 15
+    print('Downloaded {0:d} tweets in {1:.2f} seconds'.format(n, end_time - start_time))
+
+    # Resume download from reloaded manifest, retrieving all pages
+    manifest = DownloadManifest(os.path.join(out_dir, 'manifest.json'))
+    with JsonlWriter(out_path, ids_path=ids_path) as writer:
+        n = download_windows(
+            tweets, manifest.get_windows(), label='test', query='#climate',
+            batch_size=10, writer=writer, workers=4, manifest=manifest,
+            max_pages=10
+        )
+    # Check only last page has been retrieved
+    assert n == 20 * 5
+    assert all(w['done'] and w['pages'] == 3 for w in manifest.windows)
+
+    # Check there are no duplicates
+    with open(out_path, 'r', encoding='utf-8') as in_file:
+        lines = in_file.readlines()
+    assert len(lines) == len(set(json.loads(line)['id_str'] for line in lines)) == 20 * 20
+    print('Resumed download, {0:d} tweets in total'.format(len(lines)))
+
+    # Simulate a crash after tweets have been written, but before (all of) their ids
+    with open(out_path, 'a', encoding='utf-8') as out_file:
+        write_json_list([{'id_str': 'crash{0:d}'.format(i)} for i in range(3)], out_file)
+    with open(ids_path, 'a', encoding='utf-8') as ids_file:
+        ids_file.write('crash0\ncras')
+    # Check that reloaded ids cover every written tweet, ids file being aligned again
+    with JsonlWriter(out_path, ids_path=ids_path) as writer:
+        assert writer.write([{'id_str': 'crash{0:d}'.format(i)} for i in range(4)]) == 1
+    with open(out_path, 'r', encoding='utf-8') as in_file, open(ids_path, 'r', encoding='utf-8') as ids_file:
+        assert [json.loads(line)['id_str'] for line in in_file] == [line.strip() for line in ids_file]
+    print('Recovered ids of tweets written before crash')
+
+    # Extend download to a later (overlapping) range: only days not covered yet are added
+    assert not manifest.has_range(date(2018, 1, 11), date(2018, 1, 31))
+    later = [(start + timedelta(days=d), start + timedelta(days=d, hours=1)) for d in range(10, 30)]
+    assert manifest.add_windows(later, date(2018, 1, 11), date(2018, 1, 31)) == 10
+    assert manifest.has_range(date(2018, 1, 11), date(2018, 1, 31))
+    # Check that added windows are not done, stored ones are kept
+    manifest = DownloadManifest(os.path.join(out_dir, 'manifest.json'))
+    assert [w['done'] for w in manifest.windows] == [True] * 20 + [False] * 10
+    print('Extended manifest to {0:d} windows'.format(len(manifest.windows)))
+
+    # Stop stand-in server
+    server.shutdown()
@@ -3,8 +3,10 @@ from resources.CMUTweetTagger import runtagger_parse
 from nltk.stem import WordNetLemmatizer
 from nltk.corpus import stopwords
 from modules.dataset.dataset import Dataset
+from functools import lru_cache
 import itertools as iter
 import unidecode as ud
+import pandas as pd
 import numpy as np
 import re
 
@@ -21,6 +23,16 @@ SET_PRONOUNS = set(['i', 'you', 'it', 'she', 'he', 'we', 'they', 'me', 'her',
                     'mine', 'its', 'our', 'ours', 'their', 'myself', 'yourself',
                     'himself', 'herself', 'itself', 'ourselves', 'yourselves',
                     'themselves', 'theirs'])
+# Define set of stopwords which are not pronouns (pronouns are kept)
+SET_STOPWORDS_NOT_PRONOUNS = SET_STOPWORDS - SET_PRONOUNS
+# Define tags which get lemmatized
+SET_LEMMA_TAGS = {'N', 'V', 'R', 'A'}
+# Compile patterns used in cleaning
+RE_SYMBOLS = re.compile(r'[^\w-]')  # Non-standard symbols, apart from -
+RE_LEADING_DASH = re.compile(r'^-')  # - symbol at the beginning of a word
+RE_TRAILING_DASH = re.compile(r'-$')  # - symbol at the end of a word
+# Maximum number of lemmas kept in memory
+LEMMA_CACHE_SIZE = 1 << 20
 
 
 class Entities(Dataset):
@@ -34,58 +46,131 @@ class Entities(Dataset):
             'entity_text': np.unicode_,
             'entity_tag': np.unicode_,
             'entity_conf': np.float
+        }, compact_columns={
+            'tweet_id': np.int64,
+            'entity_index': np.int16,
+            'entity_text': 'category',
+            'entity_tag': 'category',
+            'entity_conf': np.float32
         })
 
     # Define function for filling table by running ARK twitter parser
-    def from_tweets(self, tweets):
+    # A tagger (e.g. TaggerPool) can be given, otherwise a new one is started
+    def from_tweets(self, tweets, tagger=None):
         # Get list of tweet id
         tweet_ids = tweets.df.tweet_id.tolist()
         # Get tweet text
         tweet_text = tweets.df.tweet_text.tolist()
         tweet_text = [re.sub(r'[\n\r]', ' ', txt) for txt in tweet_text]
         tweet_text = [re.sub(r'[ ]+', ' ', txt) for txt in tweet_text]
-        # Tag tweets text
-        tweet_tags = runtagger_parse(tweet_text, run_tagger_cmd=TAG_RUN)
-        # Define new dataset content
-        entities = []
+        # Tag tweets text (tagged tweets are consumed as soon as they are available)
+        if tagger is not None:
+            tweet_tags = tagger.imap(tweet_text)
+        else:
+            tweet_tags = runtagger_parse(tweet_text, run_tagger_cmd=TAG_RUN)
+        # Define new dataset content, column by column
+        entities = {column: [] for column in self.columns}
         # Loop through each tagged tweet
-        for i, tweet_id in enumerate(tweet_ids):
+        for tweet_id, tweet_tags in zip(tweet_ids, tweet_tags):
             # Loop through each entity for current tweet
-            for j, tweet_tag in enumerate(tweet_tags[i]):
+            for j, tweet_tag in enumerate(tweet_tags):
                 # Get attributes for j-th tagged entity of i-th tweet
                 text, tag, conf = tweet_tag
                 # Append new entry to dataset
-                entities.append({
-                    'tweet_id': tweet_id,
-                    'entity_index': j,
-                    'entity_text': text,
-                    'entity_tag': tag,
-                    'entity_conf': conf
-                })
+                entities['tweet_id'].append(tweet_id)
+                entities['entity_index'].append(j)
+                entities['entity_text'].append(text)
+                entities['entity_tag'].append(tag)
+                entities['entity_conf'].append(conf)
         # Set new dataset content
-        self.df = self.df.append(entities, ignore_index=True)
+        self.df = self.df.append(pd.DataFrame(entities), ignore_index=True)
+
+    # Save inner dataset to disk (.parquet dataset), partitioned by tweet date
+    def to_parquet(self, out_path, tweets, overwrite=True, part=None):
+        # Map each entity to the date of the tweet it belongs to
+        dates = tweets.df.drop_duplicates(subset='tweet_id').set_index('tweet_id').tweet_date
+        dates = self.df.tweet_id.map(dates)
+        # Store entities alongside their tweet date partition
+        super().to_parquet(out_path, dates=dates, overwrite=overwrite, part=part)
+
+    # Convert to compact representation, sharing entities vocabulary
+    def compact(self, vocabulary=None):
+        super().compact(categories={'entity_text': vocabulary} if vocabulary is not None else {})
+
+    # Retrieve entities vocabulary (only for compact representation)
+    def get_vocabulary(self):
+        return self.df.entity_text.cat.categories
 
     # Define function for cleaning entities text
+    # Each unique (text, tag) pair is cleaned once, then mapped back to entries
     def clean_entities(self):
-        # Apply clean entity function to each row
-        self.df = self.df.apply(clean_entity, axis=1)
-        # Define entries which are either stopwords or contain symbols
-        are_stopwords = self.df.entity_text.apply(is_stopword)  # Stopwords
-        have_symbols = self.df.entity_text.apply(has_symbols)  # Symbols
+        # Encode entities text and tag as codes into their vocabularies
+        text_codes, text_vocabulary = encode_column(self.df.entity_text)
+        tag_codes, tag_vocabulary = encode_column(self.df.entity_tag)
+        # Define pronouns among text vocabulary, then map them to entries
+        are_pronouns = np.array([is_pronoun(t) for t in text_vocabulary], dtype=bool)
+        are_pronouns = are_pronouns[text_codes]
+        # Change tag to pronoun ('O') with full confidence
+        if 'O' not in tag_vocabulary:
+            tag_vocabulary = np.append(tag_vocabulary, np.array(['O'], dtype=object))
+        tag_codes = np.where(are_pronouns, tag_vocabulary.tolist().index('O'), tag_codes)
+        entity_conf = self.df.entity_conf.where(~are_pronouns, 1.0)
+        # Get unique (text, tag) codes pairs, as a single code
+        pairs = text_codes.astype(np.int64) * len(tag_vocabulary) + tag_codes
+        pairs, unique_pairs = pd.factorize(pairs)
+        unique_text, unique_tag = np.divmod(unique_pairs, len(tag_vocabulary))
+        # Clean each unique pair once
+        cleaned = [
+            clean_text(text_vocabulary[i], tag_vocabulary[j])
+            for i, j in zip(unique_text, unique_tag)
+        ]
+        # Encode cleaned text as codes into a new vocabulary
+        cleaned, vocabulary = pd.factorize(np.array(cleaned, dtype=object))
+        text_codes = cleaned[pairs]
+        # Define cleaned entries which are either stopwords or contain symbols
+        are_invalid = np.array([is_stopword(t) or has_symbols(t) for t in vocabulary], dtype=bool)
+        are_valid = ~are_invalid[text_codes]
+        # Case compact representation: keep categorical columns
+        if self.is_compact():
+            entity_text = pd.Categorical.from_codes(text_codes, categories=vocabulary)
+            entity_tag = pd.Categorical.from_codes(tag_codes, categories=tag_vocabulary)
+        # Otherwise, decode codes into plain values
+        else:
+            entity_text = np.asarray(vocabulary, dtype=object)[text_codes]
+            entity_tag = tag_vocabulary[tag_codes]
+        # Set cleaned columns
+        self.df = self.df.assign(entity_text=entity_text, entity_tag=entity_tag, entity_conf=entity_conf)
         # Subset dataset excluding invalid entries
-        self.df = self.df.loc[~are_stopwords & ~have_symbols]
+        self.df = self.df.loc[are_valid]
+        # Case compact representation: remove unused vocabulary entries
+        if self.is_compact():
+            self.df = self.df.assign(entity_text=self.df.entity_text.cat.remove_unused_categories())
+
+
+# Encode a column as codes into its unique values (categories, if categorical)
+def encode_column(column):
+    # Case categorical column: use its codes directly
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.values.astype(np.int64), np.asarray(column.cat.categories, dtype=object)
+    # Otherwise, encode values
+    codes, uniques = pd.factorize(column)
+    return codes.astype(np.int64), np.asarray(uniques, dtype=object)
 
 
+# Retrieve word lemmatizer (instantiated once)
+@lru_cache(maxsize=None)
+def get_lemmatizer():
+    return WordNetLemmatizer()
+
 # Lemmatizing a word, given text and pos tag
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
 def lemmatize(text, tag):
-    # Instantiate a word lemmatizer instance
-    wnl = WordNetLemmatizer()
     # Pronouns don't need lemmatization
-    if tag not in {'N', 'V', 'R', 'A'}:
+    if tag not in SET_LEMMA_TAGS:
         # Return plain text
         return text
     # Return lemmatized word
-    return wnl.lemmatize(text, tag.lower())
+    return get_lemmatizer().lemmatize(text, tag.lower())
 
 # Remove accets from text
 def remove_accents(text):
@@ -95,26 +180,31 @@ def remove_accents(text):
 
 # States wether a text contains non-standard symbols apart from -
 def has_symbols(text):
-    return len(re.findall(r'[^\w-]', text)) != 0
+    return RE_SYMBOLS.search(text) is not None
 
 # States wether it is a stopword
 def is_stopword(text):
-    return bool(text.lower() in set(SET_STOPWORDS) - set(SET_PRONOUNS))
+    return text.lower() in SET_STOPWORDS_NOT_PRONOUNS
 
 # States wether it is a pronoun
 def is_pronoun(text):
-    return bool(text.lower() in set(SET_PRONOUNS))
+    return text.lower() in SET_PRONOUNS
 
 # Clean an entry, applying various
 def clean_entity(row):
     # Change tag if is pronoun
     if is_pronoun(row.entity_text):
         row.entity_tag, row.entity_conf = 'O', 1.0
+    # Clean text according to tag
+    row.entity_text = clean_text(row.entity_text, row.entity_tag)
+    return row
+
+# Clean an entity text, given its pos tag
+def clean_text(text, tag):
     # Remove - symbol at the beginning and at the end of a word
-    row.entity_text = re.sub(r'^-', '', row.entity_text)
-    row.entity_text = re.sub(r'-$', '', row.entity_text)
+    text = RE_LEADING_DASH.sub('', text)
+    text = RE_TRAILING_DASH.sub('', text)
     # Convert the entry in lowercase
-    row.entity_text = row.entity_text.lower()
+    text = text.lower()
     # Lemmatize
-    row.entity_text = lemmatize(row.entity_text, row.entity_tag)
-    return row
+    return lemmatize(text, tag)
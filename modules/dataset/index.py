@@ -0,0 +1,320 @@
+# Dependencies
+from datetime import date, datetime
+import pandas as pd
+import numpy as np
+import hashlib
+import uuid
+import mmap
+import json
+import os
+
+# Local dependencies (date format and fastest available JSON decoder)
+from modules.dataset.tweets import DATETIME_FORMAT, orjson
+
+# Constants
+INDEX_SUFFIX = '.idx.npz'  # Side-car index file suffix
+WATERMARK_SUFFIX = '.watermark.json'  # Watermark file suffix
+COMMITS_SUFFIX = '.commits'  # Committed parts log file suffix
+PART_PREFIX = 'part-'  # Prefix of .parquet files written as parts of an incremental run
+HEAD_SIZE = 4096  # Number of leading bytes identifying a .jsonl file
+CHUNK_SIZE = 100000  # Number of lines whose dates are parsed at once
+EPOCH = date(1970, 1, 1)  # Day buckets are expressed as days from epoch
+
+
+# Byte-offset index over a raw tweets json list (.jsonl) file
+class JsonlIndex:
+
+    # Constructor
+    def __init__(self, jsonl_path, index_path=None):
+        # Define indexed file path
+        self.jsonl_path = jsonl_path
+        # Define side-car index file path
+        self.index_path = index_path or jsonl_path + INDEX_SUFFIX
+        # Initialize empty index
+        self.reset()
+        # Load previously stored index, if any
+        if os.path.isfile(self.index_path):
+            self.load()
+
+    # Reset index to empty one
+    def reset(self):
+        # Initialize number of indexed bytes (file prefix already indexed)
+        self.size = 0
+        # Initialize indexed records: tweet id, byte offset, byte length, day
+        self.ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.days = np.empty(0, dtype=np.int32)
+        # Initialize records order, sorted by tweet id
+        self.order = None
+
+    # Load index from disk (.npz file)
+    def load(self):
+        with np.load(self.index_path) as index:
+            self.size = int(index['size'])
+            self.ids = index['ids']
+            self.offsets = index['offsets']
+            self.lengths = index['lengths']
+            self.days = index['days']
+        # Reset records order
+        self.order = None
+
+    # Save index to disk (.npz file), atomically
+    def save(self):
+        # Write to temporary file first
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as out_file:
+            np.savez(
+                out_file, size=np.int64(self.size), ids=self.ids,
+                offsets=self.offsets, lengths=self.lengths, days=self.days
+            )
+        # Replace previous index
+        os.replace(tmp_path, self.index_path)
+
+    # Index records appended to .jsonl file since last update
+    def update(self, save=True):
+        # Case indexed file shrunk (e.g. it has been overwritten): rebuild index
+        if os.path.getsize(self.jsonl_path) < self.size:
+            self.reset()
+        # Choose fastest available json decoder
+        loads = orjson.loads if orjson is not None else json.loads
+        # Initialize new records
+        ids, offsets, lengths, dates = [], [], [], []
+        # Initialize new records days (parsed chunk by chunk)
+        days = []
+        # Open indexed file, starting from first non indexed byte
+        with open(self.jsonl_path, 'rb') as in_file:
+            in_file.seek(self.size)
+            # Initialize offset of current line
+            offset = self.size
+            # Loop through each line
+            for line in in_file:
+                # Case line is incomplete (file is still being written): stop
+                if not line.endswith(b'\n'):
+                    break
+                # Try to decode current line
+                try:
+                    retrieved_tweet = loads(line)
+                    # Retrieve record fields first (a missing one must not leave others appended)
+                    tweet_id, created_at = int(retrieved_tweet['id_str']), retrieved_tweet['created_at']
+                    # Store record
+                    ids.append(tweet_id)
+                    dates.append(created_at)
+                    offsets.append(offset)
+                    lengths.append(len(line))
+                # Skip empty and broken lines
+                except (ValueError, KeyError, TypeError):
+                    pass
+                # Update offset
+                offset += len(line)
+                # Case dates chunk is full: parse it
+                if len(dates) >= CHUNK_SIZE:
+                    days.append(to_days(dates))
+                    dates = []
+        # Parse last dates chunk
+        days.append(to_days(dates))
+        # Append new records to index
+        self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+        self.offsets = np.concatenate([self.offsets, np.array(offsets, dtype=np.int64)])
+        self.lengths = np.concatenate([self.lengths, np.array(lengths, dtype=np.int64)])
+        self.days = np.concatenate([self.days, *days])
+        # Update indexed size
+        self.size = offset
+        # Reset records order
+        self.order = None
+        # Store updated index
+        if save:
+            self.save()
+
+    # Find records (positions in index) of given tweet ids
+    def find_ids(self, tweet_ids):
+        # Sort records by id (lazily)
+        if self.order is None:
+            self.order = np.argsort(self.ids, kind='stable')
+        # Case index is empty
+        if self.ids.shape[0] == 0:
+            return np.empty(0, dtype=np.int64)
+        # Search given ids among sorted ids
+        tweet_ids = np.asarray([int(i) for i in tweet_ids], dtype=np.int64)
+        sorted_ids = self.ids[self.order]
+        found = np.searchsorted(sorted_ids, tweet_ids)
+        found = np.minimum(found, len(sorted_ids) - 1)
+        # Keep only ids actually in index
+        is_found = sorted_ids[found] == tweet_ids
+        return self.order[found[is_found]]
+
+    # Find records (positions in index) between given dates (end excluded)
+    def find_dates(self, from_date=None, to_date=None):
+        # Initialize mask of selected records
+        mask = np.ones(self.days.shape, dtype=bool)
+        # Filter start date
+        if from_date is not None:
+            mask &= self.days >= to_day(from_date)
+        # Filter end date
+        if to_date is not None:
+            mask &= self.days < to_day(to_date)
+        # Return records positions
+        return np.flatnonzero(mask)
+
+    # Retrieve raw records (bytes) at given positions, through memory mapping
+    def read(self, positions):
+        # Case there is nothing to read
+        if len(positions) == 0:
+            return []
+        # Map indexed file into memory
+        with open(self.jsonl_path, 'rb') as in_file:
+            with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Slice each requested record
+                return [
+                    mm[o:o + n] for o, n
+                    in zip(self.offsets[positions], self.lengths[positions])
+                ]
+
+
+# Byte offset up to which a raw tweets json list (.jsonl) file has been processed
+class Watermark:
+
+    # Constructor
+    def __init__(self, path):
+        # Define watermark file path
+        self.path = path
+        # Initialize watermark: processed file, its leading bytes hash, processed bytes
+        self.state = {'jsonl_path': None, 'head': None, 'offset': 0}
+        # Load previously stored watermark, if any
+        if os.path.isfile(self.path):
+            self.load()
+
+    # Load watermark from disk (.json file)
+    def load(self):
+        with open(self.path, 'r') as in_file:
+            self.state = json.load(in_file)
+
+    # Save watermark to disk (.json file), atomically
+    def save(self):
+        # Write to temporary file first
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as out_file:
+            json.dump(self.state, out_file)
+        # Replace previous watermark
+        os.replace(tmp_path, self.path)
+
+    # Retrieve offset of the first byte not processed yet in given file
+    def get_offset(self, jsonl_path):
+        # Case watermark refers to another file
+        if self.state['jsonl_path'] != os.path.abspath(jsonl_path):
+            return 0
+        # Case file shrunk or has been rewritten (e.g. overwritten by download)
+        offset = self.state['offset']
+        if os.path.getsize(jsonl_path) < offset or hash_head(jsonl_path, offset) != self.state['head']:
+            return 0
+        # Return first byte not processed yet
+        return offset
+
+    # Move watermark to given offset of given file
+    def update(self, jsonl_path, offset, save=True):
+        # Update state
+        self.state = {
+            'jsonl_path': os.path.abspath(jsonl_path),
+            'head': hash_head(jsonl_path, offset),
+            'offset': int(offset)
+        }
+        # Store updated watermark
+        if save:
+            self.save()
+
+
+# Log of .parquet parts whose writing completed (parts of interrupted runs are removed)
+# Each appended chunk writes its files into every dataset (e.g. hashtags, words, tweets)
+# under the same part name, then commits that name: files of parts not committed are left
+# by a run which died while writing them. Files not written as parts are never removed.
+class PartsLog:
+
+    # Constructor
+    def __init__(self, path):
+        # Define log file path
+        self.path = path
+
+    # Generate name of a new part
+    @staticmethod
+    def new_part():
+        return PART_PREFIX + uuid.uuid4().hex
+
+    # Load names of committed parts
+    def load(self):
+        # Case log has not been written yet
+        if not os.path.isfile(self.path):
+            return set()
+        # Read complete lines only (a partial last one has not been committed)
+        with open(self.path, 'r') as in_file:
+            return {line[:-1] for line in in_file if line.endswith('\n')}
+
+    # Mark part as committed, once all its files have been written
+    def commit(self, part):
+        with open(self.path, 'a') as out_file:
+            out_file.write(part + '\n')
+            # Make sure commit is on disk before going on
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+    # Remove files of parts not committed from given partitioned datasets, return their number
+    def clean(self, out_paths):
+        # Load committed parts
+        committed, removed = self.load(), 0
+        # Loop through each file of each dataset
+        for out_path in out_paths:
+            for root, _, names in os.walk(out_path):
+                for name in names:
+                    # Case file belongs to a part which has not been committed
+                    part = name.rsplit('-', 1)[0]
+                    if name.startswith(PART_PREFIX) and part not in committed:
+                        os.remove(os.path.join(root, name))
+                        removed += 1
+        return removed
+
+
+# Find byte offset right after the last complete line of a file
+def find_lines_end(in_path, block_size=1 << 16):
+    # Open file, starting from its end
+    with open(in_path, 'rb') as in_file:
+        end = in_file.seek(0, os.SEEK_END)
+        # Read blocks backwards, until a newline is found
+        while end > 0:
+            start = max(0, end - block_size)
+            in_file.seek(start)
+            block = in_file.read(end - start)
+            # Case block contains a newline: last complete line ends right after it
+            i = block.rfind(b'\n')
+            if i >= 0:
+                return start + i + 1
+            end = start
+    # Case there is no complete line
+    return 0
+
+
+# Compute hash of leading bytes of a file, up to given offset (identifies an append only file)
+def hash_head(in_path, offset):
+    with open(in_path, 'rb') as in_file:
+        return hashlib.sha1(in_file.read(min(int(offset), HEAD_SIZE))).hexdigest()
+
+
+# Convert list of Twitter dates to days from epoch
+def to_days(dates, datetime_format=DATETIME_FORMAT):
+    # Case there are no dates
+    if not dates:
+        return np.empty(0, dtype=np.int32)
+    # Parse whole dates list at once
+    dates = pd.to_datetime(dates, format=datetime_format, utc=True)
+    # Truncate to days
+    return (dates.values.astype('datetime64[D]').astype(np.int64)).astype(np.int32)
+
+
+# Convert a date (or datetime) to days from epoch
+def to_day(value):
+    # Case datetime: keep only date
+    if isinstance(value, datetime):
+        value = value.date()
+    # Case string: parse iso format
+    elif isinstance(value, str):
+        value = date.fromisoformat(value)
+    # Return days from epoch
+    return (value - EPOCH).days
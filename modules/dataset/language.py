@@ -0,0 +1,133 @@
+# Dependencies
+from modules.dataset.tagger import hash_text
+from concurrent.futures import ProcessPoolExecutor
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+import pandas as pd
+import numpy as np
+import os
+
+# Constants
+CHUNK_SIZE = 1000  # Default number of texts sent to a detection process at once
+CACHE_SIZE = 1000000  # Default maximum number of detected texts kept in cache
+SEED = 0  # Language detection seed (detection is random, unless seeded)
+UNDEFINED = 'und'  # Twitter's language for tweets whose language is unknown
+
+
+# Pool of processes detecting texts language, caching results by text hash
+class LanguageDetector:
+
+    # Constructor
+    def __init__(self, workers=None, chunk_size=CHUNK_SIZE, cache_size=CACHE_SIZE, seed=SEED):
+        # Define number of detection processes (default: one per core)
+        self.workers = workers or os.cpu_count() or 1
+        # Define number of texts sent to a detection process at once
+        self.chunk_size = chunk_size
+        # Define cache of detected languages (text hash: language)
+        self.cache, self.cache_size = dict(), cache_size
+        # Start detection processes, each one seeded
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=set_seed, initargs=(seed,)
+        )
+        # Start processes now, before other threads (e.g. pipeline stages) get forked too
+        self.executor.submit(set_seed, seed).result()
+
+    # Detect language of each text
+    def detect(self, texts, langs=None):
+        """
+        Each distinct text is detected once, either within given texts (e.g.
+        retweets) or among the ones detected in previous calls. Texts whose
+        language has already been set by Twitter are not detected at all.
+
+        Input
+        1. texts: list of texts;
+        2. langs: list of Twitter's languages (<lang> field) aligned with
+        texts, missing and undefined ones are detected (no fast path if None);
+
+        Output
+        1. array of languages (None where language could not be detected);
+        """
+        # Initialize detected languages
+        texts = np.asarray(texts, dtype=object)
+        detected = np.empty(texts.shape[0], dtype=object)
+        # Define texts whose language has already been set by Twitter
+        is_set = np.zeros(texts.shape[0], dtype=bool)
+        if langs is not None:
+            langs = np.asarray(langs, dtype=object)
+            is_set = pd.notnull(langs) & (langs != UNDEFINED)
+            detected[is_set] = langs[is_set]
+        # Encode remaining texts as codes into unique texts
+        codes, uniques = pd.factorize(texts[~is_set])
+        keys = [hash_text(text) for text in uniques]
+        # Define unique texts missing from cache
+        missing = [i for i, key in enumerate(keys) if key not in self.cache]
+        # Case cache would exceed its maximum size: reset it
+        if len(self.cache) + len(missing) > self.cache_size:
+            self.cache = dict()
+            missing = [*range(len(keys))]
+        # Split missing texts into chunks (at least one per process), detect them in parallel
+        chunk_size = max(1, min(self.chunk_size, -(-len(missing) // self.workers)))
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        results = self.executor.map(detect_texts, [uniques[chunk] for chunk in chunks])
+        # Store detected languages into cache
+        for chunk, result in zip(chunks, results):
+            self.cache.update({keys[i]: lang for i, lang in zip(chunk, result)})
+        # Map languages of unique texts back to each text (missing texts have code -1)
+        detected[~is_set] = np.array([self.cache[key] for key in keys] + [None], dtype=object)[codes]
+        # Return detected languages
+        return detected
+
+    # Terminate detection processes
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Set language detection seed (run once by each detection process)
+def set_seed(seed=SEED):
+    DetectorFactory.seed = seed
+
+
+# Detect language of each text (None if it cannot be detected, e.g. empty text)
+def detect_texts(texts):
+    # Initialize detected languages
+    langs = list()
+    # Loop through each text
+    for text in texts:
+        try:
+            langs.append(detect(text))
+        except LangDetectException:
+            langs.append(None)
+    # Return detected languages
+    return langs
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    from datetime import datetime
+
+    # Define texts, with repeated ones (e.g. retweets)
+    texts = [
+        'We need to act on climate change now',
+        'Il cambiamento climatico è una realtà',
+        'We need to act on climate change now',
+        '',
+        'El cambio climático es real'
+    ]
+    # Detect texts language, trusting Twitter's language when set
+    with LanguageDetector(workers=2) as detector:
+        start_time = datetime.now()
+        print(detector.detect(texts, langs=[None, 'it', None, 'und', None]))
+        print('Detected languages in', datetime.now() - start_time)
+        # Detect again, using cached languages only
+        start_time = datetime.now()
+        print(detector.detect(texts))
+        print('Detected cached languages in', datetime.now() - start_time)
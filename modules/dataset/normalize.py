@@ -0,0 +1,82 @@
+# Dependencies
+import pandas as pd
+import re
+
+# Constants
+# Text normalization levels, each one replacing runs of removed characters with a single whitespace
+LEVELS = {
+    # Control characters (tabs and newlines)
+    1: re.compile(r'[\t\n\r ]+'),
+    # Control characters and non ascii symbols (e.g. emoticons)
+    2: re.compile(r'(?:[\t\n\r ]|[^\x00-\x7F])+'),
+    # Everything which is not alphanumeric or punctuation
+    3: re.compile(r'[^a-zA-Z0-9\-\,\.\!\?\"\'\;\:\_]+')
+}
+# Default number of tweets normalized and written at once
+CHUNK_SIZE = 100000
+
+
+# Normalize texts at given level
+def normalize(texts, level):
+    """
+    Each level is applied in a single pass, being equivalent to the previous
+    chain of substitutions (e.g. removing non ascii symbols, then collapsing
+    whitespaces). Higher levels include lower ones.
+
+    Input
+    1. texts: Series of texts;
+    2. level: normalization level (see LEVELS);
+
+    Output
+    1. Series of normalized texts, aligned with <texts>;
+    """
+    return texts.str.replace(LEVELS[level], ' ', regex=True)
+
+
+# Normalize texts at each given level
+def normalize_levels(texts, levels=(1, 2, 3)):
+    # Initialize normalized texts (level: Series of texts)
+    normalized = dict()
+    # Loop through each level, in increasing order
+    for level in sorted(levels):
+        # Normalize output of previous level (shorter than raw texts)
+        normalized[level] = normalize(texts, level)
+        texts = normalized[level]
+    # Return normalized texts
+    return normalized
+
+
+# Write tweets normalized at each given level to their own .tsv file, at once
+def write_levels(tweets, out_paths, chunk_size=CHUNK_SIZE):
+    """
+    Input
+    1. tweets: Tweets whose text must be normalized;
+    2. out_paths: dictionary (level: output .tsv file path);
+    3. chunk_size: number of tweets normalized and written at once;
+    """
+    # Loop through each chunk of tweets
+    for i in range(0, max(tweets.df.shape[0], 1), chunk_size):
+        # Define current chunk
+        chunk = tweets.df.iloc[i:i + chunk_size]
+        # Normalize chunk at each level
+        normalized = normalize_levels(chunk.tweet_text, levels=out_paths.keys())
+        # Append chunk to each level's file (header is written with first chunk only)
+        for level, out_path in out_paths.items():
+            chunk.assign(tweet_text=normalized[level]).to_csv(
+                out_path, sep='\t', header=(i == 0), index=False,
+                mode='w' if i == 0 else 'a'
+            )
+
+
+# Test
+if __name__ == '__main__':
+
+    # Define texts
+    texts = pd.Series([
+        'Climate\tchange\r\n is  real 🌍🔥 #ClimateAction',
+        'Température: +2°C   by 2100?!',
+        ''
+    ])
+    # Normalize texts at each level
+    for level, normalized in normalize_levels(texts).items():
+        print('Level {0:d}:'.format(level), normalized.tolist())
@@ -0,0 +1,357 @@
+# Dependencies
+from modules.dataset.tweets import Tweets, read_json_list, split_hashtags
+from modules.dataset.tweets import CHUNK_SIZE
+from modules.dataset.entities import Entities
+from modules.dataset.substitutions import as_substitutions
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import threading
+import queue
+
+# Constants
+QUEUE_SIZE = 2  # Default maximum number of items waiting between two stages
+_DONE = object()  # Marks the end of the items flowing through a queue
+
+
+# Single pipeline stage, applying a function to each item
+class Stage:
+
+    # Constructor
+    def __init__(self, name, function, workers=1, processes=False):
+        # Define stage name
+        self.name = name
+        # Define function applied to each item (returning None drops the item)
+        self.function = function
+        # Define number of items processed concurrently
+        self.workers = workers
+        # Define whether function runs in a pool of processes (it must be picklable)
+        self.processes = processes
+
+
+# Chain of stages connected by bounded queues, each one running its own workers
+class Pipeline:
+
+    # Constructor
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        # Define stages, in order
+        self.stages = stages
+        # Define maximum number of items waiting between two stages
+        self.queue_size = queue_size
+
+    # Run pipeline over given items, yielding items out of last stage
+    def run(self, items):
+        """
+        Items are read lazily: each stage blocks when the queue towards the
+        next one is full, hence at most a few items per stage are in memory
+        at any time. Stages with more than one worker may reorder items.
+
+        Input
+        1. items: iterable of items fed to the first stage;
+
+        Output
+        1. generator of items returned by the last stage;
+        """
+        # Define queues: one before each stage, plus the output one
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        # Define stop flag (set on errors) and first raised error
+        self.stop, self.error = threading.Event(), None
+        # Define process pools, for stages requiring them
+        executors = [
+            ProcessPoolExecutor(max_workers=stage.workers) if stage.processes else None
+            for stage in self.stages
+        ]
+        # Start processes now, before pipeline threads get forked too
+        for executor in executors:
+            if executor is not None:
+                executor.submit(int).result()
+        # Start feeding thread
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0]), daemon=True)]
+        # Start workers threads of each stage
+        for i, stage in enumerate(self.stages):
+            # Define number of workers still running (the last one closes the output queue)
+            running = [stage.workers, threading.Lock()]
+            # Start workers threads
+            threads += [
+                threading.Thread(
+                    target=self.work, args=(stage, executors[i], queues[i], queues[i + 1], running),
+                    daemon=True
+                )
+                for _ in range(stage.workers)
+            ]
+        for thread in threads:
+            thread.start()
+        # Initialize whether all items went through the pipeline
+        done = False
+        # Yield items out of last stage
+        try:
+            while True:
+                item = queues[-1].get()
+                # Case there are no more items
+                if item is _DONE:
+                    done = True
+                    break
+                # Case pipeline is not stopping
+                if not self.stop.is_set():
+                    yield item
+        # Case pipeline is over (either consumed or interrupted)
+        finally:
+            # Stop reading items, drain the remaining ones
+            self.stop.set()
+            while not done:
+                done = queues[-1].get() is _DONE
+            # Wait for threads and processes
+            for thread in threads:
+                thread.join()
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+        # Case a stage failed: raise its error
+        if self.error is not None:
+            raise self.error
+
+    # Feed items to first stage
+    def feed(self, items, q_out):
+        # Loop through each item, until pipeline stops
+        try:
+            for item in items:
+                if self.stop.is_set():
+                    break
+                q_out.put(item)
+        # Case items could not be read: stop pipeline
+        except Exception as error:
+            self.fail(error)
+        # Mark the end of the items
+        finally:
+            q_out.put(_DONE)
+
+    # Process items through a stage (run by each worker thread)
+    def work(self, stage, executor, q_in, q_out, running):
+        # Loop through each input item
+        while True:
+            item = q_in.get()
+            # Case there are no more items
+            if item is _DONE:
+                # Let other workers of the same stage stop too
+                q_in.put(_DONE)
+                # Case last running worker: mark the end of the output items
+                with running[1]:
+                    running[0] -= 1
+                    if running[0] == 0:
+                        q_out.put(_DONE)
+                return
+            # Case pipeline is stopping: drain item
+            if self.stop.is_set():
+                continue
+            # Apply stage function, either in this thread or in a process
+            try:
+                if executor is not None:
+                    item = executor.submit(stage.function, item).result()
+                else:
+                    item = stage.function(item)
+            # Case stage failed: stop pipeline
+            except Exception as error:
+                self.fail(error)
+                continue
+            # Case item has not been dropped: move it to next stage
+            if item is not None:
+                q_out.put(item)
+
+    # Stop pipeline, storing the first raised error
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stop.set()
+
+
+# Stream raw tweets .jsonl file as items, i.e. dictionaries holding tables of a chunk
+def read_items(in_path, chunk_size=CHUNK_SIZE, offset=0, end=None, lang=False):
+    # Loop through each parsed chunk (only given bytes range, if any)
+    for chunk in read_json_list(in_path, chunk_size=chunk_size, offset=offset, end=end, lang=lang):
+        # Wrap chunk into tweets table
+        tweets = Tweets()
+        tweets.df = chunk
+        yield {'tweets': tweets}
+
+
+# Define stages retrieving hashtags and words tables from each chunk of tweets
+def get_entities_stages(
+    tagger, subs={}, text_filter=None, language=None, detector=None,
+    clean=False, tag_workers=1, clean_workers=1
+):
+    """
+    Input
+    1. tagger: tagger shared by tagging stages (e.g. TaggerPool), it must be
+    thread safe;
+    2. subs: either Substitutions or dictionary (cleaned entity text:
+    substitution), compiled once for all chunks;
+    3. text_filter: function returning a boolean mask of tweets to keep,
+    given a tweets DataFrame (no filter if None);
+    4. language: language of tweets to keep (no filter if None);
+    5. detector: LanguageDetector used to filter tweets language;
+    6. clean: whether words get cleaned (see Entities.clean_entities);
+    7. tag_workers: number of chunks tagged concurrently by each tagging stage;
+    8. clean_workers: number of processes cleaning words;
+
+    Output
+    1. list of stages, turning {'tweets'} items into {'tweets', 'hashtags',
+    'words'} ones, as Tweets.get_entities does;
+    """
+    # Compile substitutions once, rather than for each chunk
+    subs = as_substitutions(subs)
+    return [
+        Stage('filter', partial(filter_item, text_filter=text_filter, language=language, detector=detector)),
+        Stage('tag', partial(tag_item, tagger=tagger), workers=tag_workers),
+        Stage('substitute', partial(substitute_item, subs=subs)),
+        Stage('retag', partial(retag_item, tagger=tagger), workers=tag_workers),
+        *([Stage('clean', clean_item, workers=clean_workers, processes=True)] if clean else [])
+    ]
+
+
+# Filter tweets in item (items without tweets are dropped)
+def filter_item(item, text_filter=None, language=None, detector=None):
+    # Case filter is set: keep only selected tweets
+    tweets = item['tweets']
+    if text_filter is not None:
+        tweets.df = tweets.df.loc[text_filter(tweets.df)]
+    # Case language is set: keep only tweets in given language
+    if language is not None:
+        tweets.filter_language(language, detector=detector)
+    # Drop items without tweets
+    return item if not item['tweets'].df.empty else None
+
+
+# Tag tweets in item for the first time
+def tag_item(item, tagger):
+    # Tag entities (either words and hashtags)
+    entities = Entities()
+    entities.from_tweets(item['tweets'], tagger=tagger)
+    entities.df.sort_values(by=['tweet_id', 'entity_index'], ascending=True, inplace=True)
+    # Store entities into item
+    item['entities'] = entities
+    return item
+
+
+# Split hashtags and rebuild tweets sentences in item
+def substitute_item(item, subs={}):
+    # Split hashtags from entities used to rebuild sentences
+    item['hashtags'], entities = split_hashtags(item.pop('entities'))
+    # Rebuild each tweet's sentence, removing tweets composed of only hashtags
+    item['rebuilt'] = item['tweets'].rebuild_tweets(entities, subs=subs)
+    return item
+
+
+# Tag rebuilt tweets in item, retrieving words
+def retag_item(item, tagger):
+    # Tag rebuilt tweets
+    words = Entities()
+    words.from_tweets(item.pop('rebuilt'), tagger=tagger)
+    words.df.sort_values(by=['tweet_id', 'entity_index'], ascending=True, inplace=True)
+    # Store words into item
+    item['words'] = words
+    return item
+
+
+# Clean words in item (run in a separate process)
+def clean_item(item):
+    item['words'].clean_entities()
+    return item
+
+
+# Append tables in item to partitioned parquet datasets
+# If parts log is set, files of all tables are written as one part, committed at the end
+def append_item(item, out_tweets, out_hashtags, out_words, log=None):
+    # Define name of written files (random if there is no parts log)
+    part = log.new_part() if log is not None else None
+    # Append hashtags and words tables (empty ones would not be partitioned)
+    for out_path, entities in [(out_hashtags, item['hashtags']), (out_words, item['words'])]:
+        if not entities.df.empty:
+            entities.to_parquet(out_path=out_path, tweets=item['tweets'], overwrite=False, part=part)
+    # Append tweets table last (stored tweet ids mark them as processed)
+    item['tweets'].to_parquet(out_path=out_tweets, overwrite=False, part=part)
+    # Commit part: its files are not removed when cleaning up interrupted runs
+    if log is not None:
+        log.commit(part)
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    from datetime import datetime
+    import operator
+    import time
+
+    # Define stages doubling numbers, keeping multiples of 4, negating them in processes
+    stages = [
+        Stage('double', lambda x: 2 * x, workers=2),
+        Stage('filter', lambda x: x if x % 4 == 0 else None),
+        Stage('negate', operator.neg, workers=2, processes=True)
+    ]
+    # Run pipeline over numbers, slowly generated
+    start_time = datetime.now()
+    numbers = (time.sleep(0.001) or i for i in range(100))
+    print(sorted(Pipeline(stages).run(numbers))[:10])
+    print('Pipeline took', datetime.now() - start_time)
+
+    # Run pipeline whose stage fails
+    try:
+        [*Pipeline([Stage('fail', lambda x: 1 / (x - 50))]).run(range(100))]
+    except ZeroDivisionError as error:
+        print('Pipeline failed with', repr(error))
+
+    # Dependencies
+    from modules.dataset.tweets import make_stored_filter
+    from modules.dataset.index import PartsLog
+    import pandas as pd
+    import numpy as np
+    import tempfile
+    import os
+
+    # Define tables of a chunk of tweets, as out of the last stage
+    def make_item(ids):
+        tweets, hashtags, words = Tweets(), Entities(), Entities()
+        tweets.df = pd.DataFrame({
+            'tweet_id': [str(i) for i in ids],
+            'tweet_date': pd.to_datetime(['2019-{:02d}-01'.format(1 + i % 3) for i in ids], utc=True),
+            'tweet_text': ['text {:d}'.format(i) for i in ids]
+        })
+        for entities, prefix in [(hashtags, '#h'), (words, 'w')]:
+            entities.df = pd.DataFrame({
+                'tweet_id': np.repeat(tweets.df.tweet_id.values, 2),
+                'entity_index': np.tile(np.arange(2), len(ids)),
+                'entity_text': [prefix + str(i) for i in range(2 * len(ids))]
+            })
+        return {'tweets': tweets, 'hashtags': hashtags, 'words': words}
+
+    # Define crash after entities have been written, before tweets
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt('killed')
+
+    # Append chunks to temporary tables, through the parts log
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_paths = [os.path.join(out_dir, name) for name in ['tweets', 'hashtags', 'words']]
+        log = PartsLog(out_paths[0] + '.commits')
+        # Store first chunk, then get killed while storing the second one
+        append_item(make_item(range(0, 10)), *out_paths, log=log)
+        item = make_item(range(5, 20))
+        item['tweets'].to_parquet = crash
+        try:
+            append_item(item, *out_paths, log=log)
+        except KeyboardInterrupt:
+            print('Run killed between entities and tweets')
+        # Rerun: remove parts of killed run, append only tweets not stored yet
+        print('Removed {:d} files of killed run'.format(log.clean(out_paths)))
+        item, is_new = make_item(range(5, 20)), make_stored_filter(out_paths[0])
+        item['tweets'].df = item['tweets'].df.loc[is_new(item['tweets'].df)]
+        for name in ['hashtags', 'words']:
+            item[name].df = item[name].df[item[name].df.tweet_id.isin(item['tweets'].df.tweet_id)]
+        append_item(item, *out_paths, log=log)
+        # Check that each tweet and entity has been stored exactly once
+        tweets, hashtags, words = Tweets(), Entities(), Entities()
+        for table, out_path in zip([tweets, hashtags, words], out_paths):
+            table.from_parquet(out_path)
+        assert tweets.df.tweet_id.astype(int).sort_values().tolist() == [*range(20)]
+        for entities in [hashtags, words]:
+            assert not entities.df.duplicated(['tweet_id', 'entity_index']).any()
+            assert entities.df.shape[0] == 2 * 20
+        print('Rerun stored no duplicate tweets nor entities')
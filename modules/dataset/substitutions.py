@@ -0,0 +1,219 @@
+# Dependencies
+import pandas as pd
+import numpy as np
+import pickle
+import json
+import re
+
+
+# Substitutions dictionary (e.g. hashtag splits, contracted forms) compiled
+# for bulk application either to tokens or to raw text
+class Substitutions:
+
+    # Constructor
+    def __init__(self, subs={}):
+        # Define substitutions dictionary (token: substitution)
+        self.subs = dict()
+        # Define trie of substituted tokens (character: sub-trie, '' marks a token end)
+        self.trie = dict()
+        # Define compiled raw text pattern (lazily built from trie)
+        self.pattern = None
+        # Add given substitutions
+        self.update(subs)
+
+    # Add (or replace) substitutions, updating compiled structures incrementally
+    def update(self, subs):
+        # Loop through each new substitution
+        for token, substitution in subs.items():
+            # Case substitution is empty: it would not be applied
+            if not substitution:
+                # Remove previous substitution for same token, if any
+                self.remove(token)
+                continue
+            # Store substitution
+            self.subs[token] = substitution
+            # Insert token into trie
+            node = self.trie
+            for char in token:
+                node = node.setdefault(char, dict())
+            node[''] = True
+        # Invalidate compiled raw text pattern
+        self.pattern = None
+
+    # Remove substitution for given token
+    def remove(self, token):
+        # Case token is not substituted
+        if self.subs.pop(token, None) is None:
+            return
+        # Remove token end from trie (empty branches are pruned)
+        _trie_remove(self.trie, token)
+        # Invalidate compiled raw text pattern
+        self.pattern = None
+
+    # Dictionary-like access (substitutions can be used in place of a dict)
+    def get(self, token, default=None):
+        return self.subs.get(token, default)
+
+    def __contains__(self, token):
+        return token in self.subs
+
+    def __len__(self):
+        return len(self.subs)
+
+    # Substitute tokens in bulk, tokens without substitution are kept
+    def apply_tokens(self, tokens):
+        # Encode tokens as codes into unique values
+        codes, uniques = pd.factorize(np.asarray(tokens, dtype=object))
+        # Substitute each unique token once
+        substituted = np.array([self.subs.get(t, t) for t in uniques], dtype=object)
+        # Map substitutions back to each token
+        return substituted[codes]
+
+    # Substitute whitespace delimited tokens inside raw text(s)
+    def apply_text(self, texts):
+        # Compile raw text pattern (only if substitutions changed)
+        pattern = self.get_pattern()
+        # Define replacement function
+        replace = lambda match: self.subs[match.group(0)]
+        # Case single text
+        if isinstance(texts, str):
+            return pattern.sub(replace, texts)
+        # Case multiple texts
+        return [pattern.sub(replace, text) for text in texts]
+
+    # Retrieve compiled raw text pattern, matching only whole tokens
+    def get_pattern(self):
+        # Case pattern must be compiled
+        if self.pattern is None:
+            # Case there are no substitutions: pattern never matches
+            if not self.subs:
+                self.pattern = re.compile(r'(?!)')
+            # Otherwise, compile trie into a single alternation
+            else:
+                self.pattern = re.compile(r'(?<!\S)' + _trie_regex(self.trie) + r'(?!\S)')
+        # Return compiled pattern
+        return self.pattern
+
+    # Load substitutions from one or more dictionaries (.json files), in order
+    def from_json(self, *in_paths):
+        # Loop through each substitutions dictionary file
+        for in_path in in_paths:
+            with open(in_path, 'r') as in_file:
+                self.update(json.load(in_file))
+
+    # Save substitutions dictionary to disk (.json file)
+    def to_json(self, out_path):
+        with open(out_path, 'w') as out_file:
+            json.dump(self.subs, out_file)
+
+    # Load compiled substitutions from disk (.pkl file)
+    @staticmethod
+    def load(in_path):
+        with open(in_path, 'rb') as in_file:
+            # Load stored state
+            state = pickle.load(in_file)
+        # Restore compiled structures without rebuilding them
+        substitutions = Substitutions()
+        substitutions.subs = state['subs']
+        substitutions.trie = state['trie']
+        substitutions.pattern = re.compile(state['pattern']) if state['pattern'] else None
+        return substitutions
+
+    # Save compiled substitutions to disk (.pkl file)
+    def save(self, out_path):
+        with open(out_path, 'wb') as out_file:
+            pickle.dump({
+                'subs': self.subs,
+                'trie': self.trie,
+                'pattern': self.get_pattern().pattern
+            }, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Load substitutions from either dictionaries (.json) or compiled (.pkl) files
+def load_substitutions(in_paths):
+    # Initialize empty substitutions
+    substitutions = Substitutions()
+    # Loop through each file, in order
+    for in_path in in_paths:
+        # Case compiled substitutions
+        if in_path.endswith('.pkl'):
+            # Case no previous substitutions: use compiled ones as they are
+            if not len(substitutions):
+                substitutions = Substitutions.load(in_path)
+            # Otherwise, merge them into previous ones
+            else:
+                substitutions.update(Substitutions.load(in_path).subs)
+        # Case substitutions dictionary
+        else:
+            substitutions.from_json(in_path)
+    # Return substitutions
+    return substitutions
+
+
+# Compile substitutions dictionary (token: substitution), unless already compiled
+def as_substitutions(subs):
+    return subs if isinstance(subs, Substitutions) else Substitutions(subs)
+
+
+# Turn a trie into an equivalent regular expression
+def _trie_regex(trie):
+    # Define whether a token ends at current node
+    is_end = '' in trie
+    # Define alternatives for each following character
+    branches = [re.escape(char) + _trie_regex(sub) for char, sub in sorted(trie.items()) if char]
+    # Case there is nothing after current node
+    if not branches:
+        return ''
+    # Case single following character: avoid grouping
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+    # Group alternatives (current node being a token end makes them optional)
+    return '(?:' + '|'.join(branches) + ')' + ('?' if is_end else '')
+
+
+# Remove a token from a trie, pruning empty branches
+def _trie_remove(trie, token):
+    # Case token is over: remove its end mark
+    if not token:
+        trie.pop('', None)
+        return
+    # Get sub-trie of first character
+    sub = trie.get(token[0])
+    if sub is None:
+        return
+    # Remove rest of the token from sub-trie
+    _trie_remove(sub, token[1:])
+    # Prune empty sub-trie
+    if not sub:
+        del trie[token[0]]
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    from datetime import datetime
+    import tempfile
+    import os
+
+    # Load substitution dictionaries
+    start_time = datetime.now()
+    subs = Substitutions()
+    subs.from_json('data/hashtag_subs.json', 'data/contract_forms.json')
+    subs.get_pattern()
+    print('Compiled {0:d} substitutions in'.format(len(subs)), datetime.now() - start_time)
+
+    # Store and reload compiled substitutions
+    out_path = os.path.join(tempfile.mkdtemp(), 'subs.pkl')
+    subs.save(out_path)
+    start_time = datetime.now()
+    subs = Substitutions.load(out_path)
+    print('Loaded compiled substitutions in', datetime.now() - start_time)
+
+    # Apply substitutions to tokens and to raw text
+    print(subs.apply_tokens(['#climatechange', "don't", 'panic', '#climatechange']))
+    print(subs.apply_text("we don't care about #climatechange#climate #greennewdeal"))
+
+    # Add new substitution incrementally
+    subs.update({'#panic': 'panic'})
+    print(subs.apply_text('#panic #climate'))
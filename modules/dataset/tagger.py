@@ -0,0 +1,324 @@
+# Dependencies
+from resources.CMUTweetTagger import _split_results, runtagger_parse
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import subprocess
+import threading
+import hashlib
+import sqlite3
+import queue
+import shlex
+import json
+import os
+
+# Constants
+# Path to tagger executable
+TAG_RUN = 'java -XX:ParallelGCThreads=2 -Xmx500m -jar resources/ark-tweet-nlp-0.3.2/ark-tweet-nlp-0.3.2.jar'
+# Default number of tweets sent to a tagger process at once
+CHUNK_SIZE = 1000
+# Default maximum number of tagged texts stored in cache
+CACHE_SIZE = 5000000
+# Default number of tweets looked up in cache at once
+LOOKUP_SIZE = 10000
+
+
+# Single long-lived ARK tagger process, reading tweets from stdin
+class TaggerWorker:
+
+    # Constructor
+    def __init__(self, run_tagger_cmd=TAG_RUN):
+        # Build tagger command: plain text input, conll output (one token per line)
+        args = shlex.split(run_tagger_cmd)
+        args += ['--input-format', 'text', '--output-format', 'conll']
+        # Start tagger process (JVM startup is paid once)
+        self.process = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    # Tag a chunk of tweets, return list of tagged tweets
+    def tag(self, texts):
+        # Define function writing tweets to tagger input, one tweet per line
+        def write():
+            # Loop through each tweet (newlines would split it into more tweets)
+            for text in texts:
+                line = text.replace('\n', ' ').replace('\r', ' ') + '\n'
+                self.process.stdin.write(line.encode('utf-8'))
+            # Send buffered tweets
+            self.process.stdin.flush()
+
+        # Write tweets in a separate thread, while reading tagged ones
+        # (pipes are bounded: tagger blocks until its output gets read)
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+        # Initialize tagged tweets
+        tagged = list()
+        # Initialize lines of current tweet
+        lines = list()
+        # Read tagged tweets, until all the given ones have been read
+        while len(tagged) < len(texts):
+            # Read next output line
+            line = self.process.stdout.readline()
+            # Case tagger terminated unexpectedly
+            if not line:
+                raise RuntimeError('Tagger process terminated unexpectedly')
+            # Decode line
+            line = line.decode('utf-8').rstrip('\n')
+            # Case current tweet is not over: store line
+            if line.strip():
+                lines.append(line)
+                continue
+            # Case current tweet is over (blank line): parse it
+            tagged.append([*_split_results(lines)])
+            lines = list()
+        # Wait for writer to be done
+        writer.join()
+        # Return tagged tweets
+        return tagged
+
+    # Terminate tagger process (killing it if it is stuck or broken)
+    def close(self, kill=False):
+        # Case process must be stopped at once
+        if kill:
+            self.process.kill()
+        # Close tagger input (buffered tweets are lost if process is dead), then wait for it
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+
+
+# Pool of long-lived ARK tagger processes, tagging chunks of tweets in parallel
+class TaggerPool:
+
+    # Constructor
+    def __init__(self, workers=None, run_tagger_cmd=TAG_RUN, chunk_size=CHUNK_SIZE):
+        # Define number of tagger processes (default: one per core)
+        self.workers = workers or os.cpu_count() or 1
+        # Define number of tweets sent to a tagger process at once
+        self.chunk_size = chunk_size
+        # Define tagger command (failed processes get restarted)
+        self.run_tagger_cmd = run_tagger_cmd
+        # Start tagger processes, all of them available
+        self.idle = queue.Queue()
+        for _ in range(self.workers):
+            self.idle.put(TaggerWorker(run_tagger_cmd))
+        # Define threads driving tagger processes
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    # Tag a chunk of tweets using the first available tagger process
+    def tag_chunk(self, texts):
+        # Wait for a tagger process to be available
+        worker = self.idle.get()
+        # Tag tweets, then release tagger process
+        try:
+            return worker.tag(texts)
+        # Case tagger process failed (e.g. JVM died): its pipes are unusable, replace it
+        except Exception:
+            worker.close(kill=True)
+            worker = TaggerWorker(self.run_tagger_cmd)
+            raise
+        finally:
+            self.idle.put(worker)
+
+    # Tag tweets, yielding tagged tweets in the same order of input ones
+    def imap(self, texts):
+        """
+        Split tweets into chunks and tag them in parallel. At most two chunks
+        per tagger process are in flight at any time, hence input tweets are
+        consumed lazily and only tagged chunks not yet yielded are kept in
+        memory.
+
+        Input
+        1. texts: iterable of tweet texts;
+
+        Output
+        1. generator of tagged tweets, each one being a list of (token, tag,
+        confidence) tuples;
+        """
+        # Initialize in flight chunks (futures), in input order
+        pending = deque()
+        # Initialize current chunk
+        chunk = list()
+        # Loop through each tweet
+        for text in texts:
+            # Add tweet to current chunk
+            chunk.append(text)
+            # Case current chunk is not full
+            if len(chunk) < self.chunk_size:
+                continue
+            # Submit current chunk
+            pending.append(self.executor.submit(self.tag_chunk, chunk))
+            chunk = list()
+            # Case too many chunks in flight: wait for the oldest one
+            while len(pending) >= 2 * self.workers:
+                yield from pending.popleft().result()
+        # Submit last (partial) chunk
+        if chunk:
+            pending.append(self.executor.submit(self.tag_chunk, chunk))
+        # Yield remaining chunks
+        while pending:
+            yield from pending.popleft().result()
+
+    # Tag tweets, return list of tagged tweets (as runtagger_parse)
+    def parse(self, texts):
+        return [*self.imap(texts)]
+
+    # Terminate tagger processes
+    def close(self):
+        # Wait for in flight chunks
+        self.executor.shutdown(wait=True)
+        # Terminate each tagger process
+        for _ in range(self.workers):
+            self.idle.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# On-disk cache of tagged texts, keyed by hash of whitespace normalized text
+class TagCache:
+
+    # Constructor
+    def __init__(self, path, max_size=CACHE_SIZE):
+        # Define maximum number of cached texts
+        self.max_size = max_size
+        # Open (or create) cache database, shared among threads (e.g. pipeline stages)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # Define lock serializing access to cache database
+        self.lock = threading.Lock()
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tags ('
+            'key TEXT PRIMARY KEY, tags TEXT NOT NULL, used INTEGER NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tags_used ON tags (used)')
+        self.conn.commit()
+        # Define usage counter (last used entries are evicted last)
+        self.used = self.conn.execute('SELECT COALESCE(MAX(used), 0) FROM tags').fetchone()[0]
+
+    # Retrieve cached tags for given keys, as dictionary (key: tagged tweet)
+    def get(self, keys):
+        with self.lock:
+            return self._get(keys)
+
+    # Store tags for given keys, evicting least recently used entries if needed
+    def put(self, items):
+        with self.lock:
+            self._put(items)
+
+    # Retrieve cached tags (cache database must be locked)
+    def _get(self, keys):
+        # Initialize retrieved tags
+        found = dict()
+        # Loop through keys batches (SQLite limits number of parameters)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.conn.execute(
+                'SELECT key, tags FROM tags WHERE key IN ({0:s})'.format(','.join('?' * len(batch))),
+                batch
+            )
+            found.update({key: [tuple(t) for t in json.loads(tags)] for key, tags in rows})
+        # Mark retrieved entries as just used
+        self.used += 1
+        self.conn.executemany('UPDATE tags SET used = ? WHERE key = ?', [(self.used, k) for k in found])
+        # Return retrieved tags
+        return found
+
+    # Store tags (cache database must be locked)
+    def _put(self, items):
+        # Insert (or replace) entries
+        self.used += 1
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO tags (key, tags, used) VALUES (?, ?, ?)',
+            [(key, json.dumps(tags), self.used) for key, tags in items.items()]
+        )
+        # Evict least recently used entries exceeding maximum size
+        size = self.conn.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+        if size > self.max_size:
+            self.conn.execute(
+                'DELETE FROM tags WHERE key IN (SELECT key FROM tags ORDER BY used LIMIT ?)',
+                (size - self.max_size,)
+            )
+        # Persist changes
+        self.conn.commit()
+
+    # Close cache database
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+# Tagger which tags only texts missing from cache
+class CachedTagger:
+
+    # Constructor
+    def __init__(self, cache, tagger=None, run_tagger_cmd=TAG_RUN, lookup_size=LOOKUP_SIZE):
+        # Define tags cache
+        self.cache = cache
+        # Define underlying tagger (e.g. TaggerPool), if any
+        self.tagger = tagger
+        # Define command used when no underlying tagger is given
+        self.run_tagger_cmd = run_tagger_cmd
+        # Define number of tweets looked up in cache at once
+        self.lookup_size = lookup_size
+
+    # Tag given texts through underlying tagger
+    def tag(self, texts):
+        # Case underlying tagger is set
+        if self.tagger is not None:
+            return self.tagger.parse(texts)
+        # Otherwise, run tagger once on given texts
+        return runtagger_parse(texts, run_tagger_cmd=self.run_tagger_cmd)
+
+    # Tag tweets, yielding tagged tweets in the same order of input ones
+    def imap(self, texts):
+        # Initialize current chunk
+        chunk = list()
+        # Loop through each tweet
+        for text in texts:
+            # Add tweet to current chunk
+            chunk.append(text)
+            # Case current chunk is full: tag it
+            if len(chunk) >= self.lookup_size:
+                yield from self.tag_chunk(chunk)
+                chunk = list()
+        # Tag last (partial) chunk
+        if chunk:
+            yield from self.tag_chunk(chunk)
+
+    # Tag tweets, return list of tagged tweets (as runtagger_parse)
+    def parse(self, texts):
+        return [*self.imap(texts)]
+
+    # Tag a chunk of tweets, tagging only the ones missing from cache
+    def tag_chunk(self, texts):
+        # Normalize texts and compute their keys
+        texts = [normalize_text(text) for text in texts]
+        keys = [hash_text(text) for text in texts]
+        # Retrieve cached tags
+        found = self.cache.get(list(set(keys)))
+        # Define missing texts (each distinct text is tagged once)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        # Case some texts are missing: tag and cache them
+        if missing:
+            tagged = dict(zip(missing.keys(), self.tag(list(missing.values()))))
+            self.cache.put(tagged)
+            found.update(tagged)
+        # Return tagged tweets, in input order
+        return [found[key] for key in keys]
+
+
+# Normalize text whitespaces (the tagger splits tokens on whitespaces)
+def normalize_text(text):
+    return ' '.join(text.split())
+
+
+# Compute content address of a (normalized) text
+def hash_text(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
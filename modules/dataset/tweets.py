@@ -1,19 +1,34 @@
 # Dependencies
 from modules.dataset.dataset import Dataset
 from modules.dataset.entities import Entities, remove_accents
+from modules.dataset.substitutions import as_substitutions
+from modules.dataset.language import LanguageDetector
+from modules.dataset.normalize import normalize
 from TwitterAPI import TwitterAPI
 from datetime import datetime
 import pandas as pd
 import numpy as np
-import json_lines
 import json
 import re
+import os
+
+# Optional dependencies
+try:
+    # Faster JSON decoder, used when available
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # Constants
 API_PRODUCT_30DAY = '30day'
 API_PRODUCT_FULL = 'fullarchive'
 
+# Date format used by Twitter's APIs
+DATETIME_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+# Default number of raw tweets parsed at once from .jsonl files
+CHUNK_SIZE = 10000
+
 TAG_RUN = 'java -XX:ParallelGCThreads=2 -Xmx500m -jar resources/ark-tweet-nlp-0.3.2/ark-tweet-nlp-0.3.2.jar'
 
 
@@ -29,6 +44,8 @@ class Tweets(Dataset):
             'tweet_id': np.unicode_,
             'tweet_date': np.datetime64,
             'tweet_text': np.unicode_
+        }, compact_columns={
+            'tweet_id': np.int64
         })
 
     # Authentication: allows to query Twitter's web APIs
@@ -52,12 +69,30 @@ class Tweets(Dataset):
     # Search tweet through APIs and fill inner dataset
     def search_tweets(self, label, query=None, from_date=None, to_date=None,
                       batch_size=100, params={}, product=API_PRODUCT_30DAY,
-                      jsonl_path=None):
-        # Initialize retrieved tweets list
-        tweets = list()
+                      jsonl_path=None, writer=None):
+        # Retrieve raw tweets through Twitter's web API (first page only)
+        retrieved_tweets, _ = self.request_tweets(
+            label=label, query=query, from_date=from_date, to_date=to_date,
+            batch_size=batch_size, params=params, product=product
+        )
+        # Case raw output must be written through a shared writer
+        if writer is not None:
+            writer.write(retrieved_tweets)
+        # Case raw output file is requested: open it once for all tweets
+        elif jsonl_path:
+            with open(jsonl_path, 'a', encoding='utf-8') as jsonl_file:
+                write_json_list(retrieved_tweets, jsonl_file)
+        # Parse tweets and add them to inner DataFrame
+        self.df = self.df.append([parse_tweet(t) for t in retrieved_tweets])
+
+    # Request a page of tweets to Twitter's web API, return raw retrieved
+    # tweets and the token of next page (None if there is no next page)
+    def request_tweets(self, label, query=None, from_date=None, to_date=None,
+                       batch_size=100, params={}, product=API_PRODUCT_30DAY,
+                       next_token=None):
         # Parse from and to dates
         from_date = from_date.strftime('%Y%m%d%H%M') if from_date is not None else None
-        to_date = to_date.strftime('%Y%m%d%H%M') if from_date is not None else None
+        to_date = to_date.strftime('%Y%m%d%H%M') if to_date is not None else None
         # Execute request to Twitter's web API
         res = self.api.request('tweets/search/{0:}/:{1:}'.format(product, label), {
             # Free parameters, will be overwritten by specific ones
@@ -67,70 +102,81 @@ class Tweets(Dataset):
                 'query': query,
                 'fromDate': from_date,
                 'toDate': to_date,
-                'maxResults': batch_size
+                'maxResults': batch_size,
+                'next': next_token
             }
         })
-        # Parse tweets and fill retrieved tweets list
-        for retrieved_tweet in res:
-            # Parse tweet and append it to retrieved tweets list
-            tweets.append(parse_tweet(retrieved_tweet))
-            # Case json no raw output file is requested
-            if not jsonl_path:
-                continue  # Go to next iteration
-            # Write output to file
-            with open(jsonl_path, 'a', encoding='utf-8') as jsonl_file:
-                json.dump(retrieved_tweet, jsonl_file)
-                jsonl_file.write('\n')
-        # Add parsed tweets to inner DataFrame
-        self.df = self.df.append(tweets)
+        # Return retrieved tweets as list and next page token
+        return [*res], res.json().get('next', None)
 
     # Retrieve hashtags and words dataset from tweets
-    def get_entities(self, subs={}):
+    # A tagger (e.g. TaggerPool) can be given, otherwise a new one is started twice
+    def get_entities(self, subs={}, tagger=None):
         # Create a copy of current Tweets object
         tweets = Tweets()
         tweets.df = self.df.copy()
         # Create new Pandas dataframe containing entities (either words and hashtags)
         entities = Entities()
-        entities.from_tweets(tweets)  # Tag entities for the first time
+        entities.from_tweets(tweets, tagger=tagger)  # Tag entities for the first time
         entities.df.sort_values(by=['tweet_id', 'entity_index'], ascending=True, inplace=True)
-        # Create separate hashtags dataset from entities dataset
-        hashtags = Entities()
-        is_hashtag = entities.df.entity_text.apply(lambda txt: bool(re.match(r'^#', txt)))
-        is_empty = entities.df.entity_text.apply(lambda txt: bool(re.match(r'^[# ]+$', txt)))
-        hashtags.df = entities.df.loc[is_hashtag & ~is_empty]
-        # Filter out stand alone hashtags (tagged #)
-        entities.df = entities.df.loc[entities.df.entity_tag != '#']
-        # Loop through each tweet
-        for i, tweet in tweets.df.iterrows():
-            # Get entities for current tweet
-            tweet_entities = entities.df.loc[entities.df.tweet_id == tweet.tweet_id]
-            # Reinitialize tweet text
-            tweet_text = ''
-            # Rebuild the sentence using words tagged
-            for j, entity in tweet_entities.iterrows():
-                # Keep the original text lowercased
-                entity_text = entity.entity_text.lower()
-                # Convert the punctuation to the standard one
-                entity_text = remove_accents(entity_text)
-                # Check if there is a substitution available
-                if subs.get(entity_text, None):
-                    # Substitute complex hashtags with splitted ones
-                    entity_text = subs.get(entity_text)
-                # Reset tweet text
-                tweet_text = ' '.join([tweet_text, entity_text])
-            # Overwrite current tweet text
-            tweets.df.at[i, 'tweet_text'] = tweet_text
-        # Get id of tweets which have at least one word (not only hashtags)
-        not_empty = tweets.df.tweet_text.apply(lambda x: x.strip() != '')
-        # Remove tweets which are composed of only hashtags
-        tweets.df = tweets.df.loc[not_empty]
+        # Split hashtags from entities used to rebuild sentences
+        hashtags, entities = split_hashtags(entities)
+        # Rebuild each tweet's sentence, removing tweets composed of only hashtags
+        tweets = tweets.rebuild_tweets(entities, subs=subs)
         # Launch tagger again
         words = Entities()
-        words.from_tweets(tweets)
+        words.from_tweets(tweets, tagger=tagger)
         words.df.sort_values(by=['tweet_id', 'entity_index'], inplace=True, ascending=True)
         # Return retrieved hashtags and words datasets
         return hashtags, words
 
+    # Rebuild each tweet's sentence using words tagged (tweets without words are removed)
+    def rebuild_tweets(self, entities, subs={}):
+        # Create a copy of current Tweets object
+        tweets = Tweets()
+        tweets.df = self.df.copy()
+        # Rebuild each tweet's sentence using words tagged
+        tweets.df['tweet_text'] = rebuild_text(tweets.df.tweet_id, entities.df, subs=as_substitutions(subs))
+        # Get id of tweets which have at least one word (not only hashtags)
+        not_empty = tweets.df.tweet_text.apply(lambda x: x.strip() != '')
+        # Remove tweets which are composed of only hashtags
+        tweets.df = tweets.df.loc[not_empty]
+        # Return rebuilt tweets
+        return tweets
+
+    # Keep only tweets in given language
+    def filter_language(self, language='en', detector=None):
+        """
+        Detect tweets language in parallel, trusting Twitter's language in
+        tweet_lang column, if any (see read_json_list). Such column is
+        consumed, i.e. it is removed from inner DataFrame.
+
+        Input
+        1. language: language of tweets to keep;
+        2. detector: LanguageDetector (e.g. shared among chunks), otherwise
+        a new one is started;
+        """
+        # Define Twitter's languages, if any
+        langs = self.df.tweet_lang.values if 'tweet_lang' in self.df.columns else None
+        # Case no detector is given: use a new one
+        if detector is None:
+            with LanguageDetector() as detector:
+                detected = detector.detect(self.df.tweet_text.values, langs=langs)
+        # Otherwise, use given one
+        else:
+            detected = detector.detect(self.df.tweet_text.values, langs=langs)
+        # Keep only tweets in given language, remove Twitter's language column
+        self.df = self.df.loc[detected == language].drop(columns='tweet_lang', errors='ignore')
+
+    # Retrieve tweets whose text is normalized at given level (see normalize.LEVELS)
+    def normalized(self, level):
+        # Create a copy of current Tweets object
+        tweets = Tweets()
+        tweets.df = self.df.copy()
+        # Normalize text, stored one is left untouched
+        tweets.df['tweet_text'] = normalize(tweets.df.tweet_text, level)
+        return tweets
+
     # Retrieve hashtag counts
     def get_hashtag_counts(self, mask):
         # Initialize hashtags dictionary (hashtag: counts)
@@ -153,24 +199,54 @@ class Tweets(Dataset):
         # Load entries into inner DataFrame
         super().from_json(in_path, date_columns=['tweet_date'])
 
+    # Save inner dataset to disk (.parquet dataset), partitioned by tweet date
+    def to_parquet(self, out_path, overwrite=True, part=None):
+        super().to_parquet(out_path, dates=self.df.tweet_date, overwrite=overwrite, part=part)
+
     # Load inner dataset from unparsed json list (.jsonl file)
-    def from_json_list(self, in_path):
-        # Initialize tweets container
-        tweets = list()
-        # Load input file
-        with open(in_path, 'rb') as in_file:
-            # Loop through each line in input .jsonl formatted file
-            for retrieved_tweet in json_lines.reader(in_file, broken=True):
-                # Format retrieved tweet according to inner DataFrame
-                parsed_tweet = parse_tweet(retrieved_tweet)
-                # Append parsed tweet to tweets list
-                tweets.append(parsed_tweet)
-        # Append list of retrieved tweets to inner Dataframe
-        self.df = self.df.append(tweets, ignore_index=True)
+    def from_json_list(self, in_path, chunk_size=CHUNK_SIZE, offset=0, end=None, lang=False):
+        # Parse input file chunk by chunk (only given bytes range, if any)
+        chunks = [*read_json_list(in_path, chunk_size=chunk_size, offset=offset, end=end, lang=lang)]
+        # Case no tweet has been parsed
+        if not chunks:
+            return
+        # Case inner DataFrame is empty: avoid casting parsed columns
+        if self.df.empty:
+            self.df = pd.concat(chunks, ignore_index=True)
+        # Case inner DataFrame already contains tweets
+        else:
+            self.df = pd.concat([self.df, *chunks], ignore_index=True)
+
+    # Load only some raw tweets from .jsonl file, through its byte-offset index
+    def from_json_index(self, in_path, tweet_ids=None, from_date=None, to_date=None):
+        # Load side-car index, index tweets appended since last update
+        # (imported here, since index module takes date format and decoder from this one)
+        from modules.dataset.index import JsonlIndex
+        index = JsonlIndex(in_path)
+        index.update()
+        # Initialize selected records
+        positions = np.arange(index.ids.shape[0])
+        # Case tweet ids are given: select their records
+        if tweet_ids is not None:
+            positions = index.find_ids(tweet_ids)
+        # Case dates are given: select records in [from_date, to_date)
+        if from_date is not None or to_date is not None:
+            positions = np.intersect1d(positions, index.find_dates(from_date, to_date))
+        # Choose fastest available json decoder
+        loads = orjson.loads if orjson is not None else json.loads
+        # Read and parse only selected records
+        retrieved_tweets = [loads(record) for record in index.read(positions)]
+        # Set inner DataFrame
+        self.df = _make_chunk(
+            ids=[str(t.get('id_str')) for t in retrieved_tweets],
+            dates=[t.get('created_at') for t in retrieved_tweets],
+            texts=[get_tweet_text(t) for t in retrieved_tweets],
+            start=0
+        )
 
 
 # Parse retrieved tweets fo fill into internal DataFrame
-def parse_tweet(retrieved_tweet, datetime_format='%a %b %d %H:%M:%S %z %Y'):
+def parse_tweet(retrieved_tweet, datetime_format=DATETIME_FORMAT):
     # Initialize parsed tweet object
     parsed_tweet = dict()
     # Get tweet id
@@ -180,22 +256,197 @@ def parse_tweet(retrieved_tweet, datetime_format='%a %b %d %H:%M:%S %z %Y'):
         retrieved_tweet.get('created_at'),
         datetime_format
     )
-    # Initialize parsed tweet text
-    tweet_text = ''
+    # Store tweet text
+    parsed_tweet['tweet_text'] = get_tweet_text(retrieved_tweet)
+    # Return tweet
+    return parsed_tweet
+
+
+# Split tagged entities into hashtags and entities used to rebuild sentences
+def split_hashtags(entities):
+    # Create separate hashtags dataset from entities dataset
+    hashtags = Entities()
+    is_hashtag = entities.df.entity_text.apply(lambda txt: bool(re.match(r'^#', txt)))
+    is_empty = entities.df.entity_text.apply(lambda txt: bool(re.match(r'^[# ]+$', txt)))
+    hashtags.df = entities.df.loc[is_hashtag & ~is_empty]
+    # Filter out stand alone hashtags (tagged #)
+    words = Entities()
+    words.df = entities.df.loc[entities.df.entity_tag != '#']
+    # Return hashtags and remaining entities
+    return hashtags, words
+
+
+# Rebuild tweets text by joining their (sorted) entities, after cleaning them
+def rebuild_text(tweet_ids, entities, subs=None):
+    """
+    Input
+    1. tweet_ids: Series of tweet ids whose text must be rebuilt;
+    2. entities: DataFrame of entities, sorted by tweet id and entity index;
+    3. subs: Substitutions of cleaned entities text (none if None), compiled
+    once by callers (see as_substitutions);
+
+    Output
+    1. Series of rebuilt texts, aligned with <tweet_ids>;
+    """
+    # Encode entities text as codes into unique values
+    codes, uniques = pd.factorize(entities.entity_text)
+    # Clean each unique entity text once
+    cleaned = np.empty(len(uniques), dtype=object)
+    for i, entity_text in enumerate(uniques):
+        # Keep the original text lowercased
+        entity_text = entity_text.lower()
+        # Convert the punctuation to the standard one
+        cleaned[i] = remove_accents(entity_text)
+    # Substitute complex hashtags with splitted ones (if available)
+    if subs is not None:
+        cleaned = subs.apply_tokens(cleaned)
+    # Join cleaned entities of each tweet (entities order is preserved)
+    texts = pd.Series(cleaned[codes], index=entities.index)
+    texts = texts.groupby(entities.tweet_id.values, sort=False).agg(' '.join)
+    # Each word is preceded by a whitespace, tweets without words are empty
+    texts = ' ' + texts
+    return tweet_ids.map(texts).fillna('')
+
+
+# Write raw tweets to an opened json list (.jsonl) file
+def write_json_list(retrieved_tweets, jsonl_file):
+    # Loop through each raw tweet
+    for retrieved_tweet in retrieved_tweets:
+        # Write one tweet per line
+        json.dump(retrieved_tweet, jsonl_file)
+        jsonl_file.write('\n')
+
+
+# Retrieve full text of a retrieved tweet (either retweeted and extended)
+def get_tweet_text(retrieved_tweet):
     # Case tweet is a retweet
-    if 'retweeted_status' in set(retrieved_tweet.keys()):
+    if 'retweeted_status' in retrieved_tweet:
         # Get inner tweet
         retrieved_tweet = retrieved_tweet['retweeted_status']
     # Check if current tweet is an extended tweet
-    if 'extended_tweet' in set(retrieved_tweet.keys()):
-        tweet_text = retrieved_tweet['extended_tweet']['full_text']
+    if 'extended_tweet' in retrieved_tweet:
+        return retrieved_tweet['extended_tweet']['full_text']
     # Case current tweet is not an extended one
-    else:
-        tweet_text = retrieved_tweet['text']
-    # Store tweet text
-    parsed_tweet['tweet_text'] = tweet_text
-    # Return tweet
-    return parsed_tweet
+    return retrieved_tweet['text']
+
+
+# Retrieve Twitter's language of a retrieved tweet (the one whose text is used)
+def get_tweet_lang(retrieved_tweet):
+    # Case tweet is a retweet
+    if 'retweeted_status' in retrieved_tweet:
+        # Get inner tweet
+        retrieved_tweet = retrieved_tweet['retweeted_status']
+    # Return language, if any
+    return retrieved_tweet.get('lang', None)
+
+
+# Stream unparsed json list (.jsonl file) as a generator of DataFrame chunks
+def read_json_list(in_path, chunk_size=CHUNK_SIZE, datetime_format=DATETIME_FORMAT, offset=0, end=None, lang=False):
+    """
+    Parse a raw tweets .jsonl file in chunks of at most <chunk_size> tweets,
+    keeping in memory only the extracted columns of the current chunk.
+
+    Input
+    1. in_path: path to .jsonl file, one raw tweet per line;
+    2. chunk_size: maximum number of tweets in each yielded chunk;
+    3. datetime_format: format of tweets' <created_at> field;
+    4. offset: byte offset of the first line to parse (it must be a line start);
+    5. end: byte offset where parsing stops (whole file if None);
+    6. lang: whether Twitter's language of each tweet is extracted too;
+
+    Output
+    1. generator of DataFrame objects with tweet_id, tweet_date and
+    tweet_text columns (plus tweet_lang one, if required), indexed by
+    tweet position in parsed lines;
+    """
+    # Choose fastest available json decoder
+    loads = orjson.loads if orjson is not None else json.loads
+    # Initialize index of the first tweet in current chunk
+    start = 0
+    # Initialize columns of current chunk
+    ids, dates, texts, langs = [], [], [], []
+    # Open input file in binary mode (decoding is left to json decoder)
+    with open(in_path, 'rb') as in_file:
+        # Move to first line to parse
+        in_file.seek(offset)
+        # Loop through each line in input file
+        for line in in_file:
+            # Case end has been reached: stop
+            if end is not None and offset >= end:
+                break
+            # Update offset of next line
+            offset += len(line)
+            # Try to decode current line
+            try:
+                retrieved_tweet = loads(line)
+            # Skip empty and broken lines
+            except ValueError:
+                continue
+            # Extract only the required fields
+            ids.append(str(retrieved_tweet.get('id_str')))
+            dates.append(retrieved_tweet.get('created_at'))
+            texts.append(get_tweet_text(retrieved_tweet))
+            if lang:
+                langs.append(get_tweet_lang(retrieved_tweet))
+            # Case current chunk is full
+            if len(ids) >= chunk_size:
+                # Return current chunk
+                yield _make_chunk(ids, dates, texts, start, datetime_format, langs if lang else None)
+                # Reset chunk
+                start, ids, dates, texts, langs = start + len(ids), [], [], [], []
+    # Return last (partial) chunk
+    if ids:
+        yield _make_chunk(ids, dates, texts, start, datetime_format, langs if lang else None)
+
+
+# Define filter of tweets whose id has not been seen yet (given seen ids get updated)
+def make_ids_filter(seen_ids):
+    # Define function returning mask of new tweets, given a tweets DataFrame
+    def is_new(df):
+        # Select tweets neither seen before nor repeated
+        is_new = ~df.tweet_id.isin(seen_ids) & ~df.tweet_id.duplicated()
+        # Mark selected tweets as seen
+        seen_ids.update(df.tweet_id[is_new])
+        return is_new.values
+    # Return filter function
+    return is_new
+
+
+# Define filter of tweets not stored in given partitioned .parquet tweets dataset yet
+# Stored ids are loaded lazily, only from the year/month partitions of filtered tweets
+def make_stored_filter(in_path):
+    # Initialize ids seen so far, (year, month) partitions already loaded
+    seen_ids, loaded = set(), set()
+    is_new = make_ids_filter(seen_ids)
+    # Define function returning mask of new tweets, given a tweets DataFrame
+    def is_stored_new(df):
+        # Loop through each partition of given tweets, not loaded yet
+        dates = df.tweet_date.dropna()
+        for year, month in sorted({*zip(dates.dt.year, dates.dt.month)} - loaded):
+            # Case partition is stored: load only its tweet ids
+            if os.path.isdir(os.path.join(in_path, 'year={:d}'.format(year), 'month={:d}'.format(month))):
+                stored = Tweets()
+                stored.from_parquet(in_path, columns=['tweet_id'], years=[year], months=[month])
+                seen_ids.update(stored.df.tweet_id.astype(str))
+            loaded.add((year, month))
+        # Select tweets neither stored nor seen before
+        return is_new(df)
+    # Return filter function
+    return is_stored_new
+
+
+# Make a tweets DataFrame chunk out of extracted columns
+def _make_chunk(ids, dates, texts, start, datetime_format=DATETIME_FORMAT, langs=None):
+    chunk = pd.DataFrame({
+        'tweet_id': np.array(ids, dtype=object),
+        # Parse the whole dates column at once
+        'tweet_date': pd.to_datetime(dates, format=datetime_format, utc=True),
+        'tweet_text': np.array(texts, dtype=object)
+    }, index=pd.RangeIndex(start, start + len(ids)))
+    # Case languages have been extracted
+    if langs is not None:
+        chunk['tweet_lang'] = np.array(langs, dtype=object)
+    return chunk
 
 
 # Test
@@ -0,0 +1,268 @@
+# Dependencies
+import os
+import numpy as np
+from scipy.special import zeta
+from concurrent.futures import ProcessPoolExecutor
+
+# Constants
+MIN_TAIL = 10  # Minimum number of nodes in the tail of a power law fit
+GAMMA_BOUNDS = (1.0 + 1e-6, 20.0)  # Search interval of power law exponent
+GOLDEN_ITER = 64  # Number of golden section steps fitting the exponent
+N_SAMPLES = 1000  # Default number of goodness-of-fit bootstrap samples
+SEED = 0  # Default bootstrap seed
+
+
+# Compute weighted and unweighted degree of each node from (symmetric) adjacency matrix
+def get_degrees(weights):
+    """
+    Self loops count twice, as in networkx.
+
+    Input:
+        - weights : scipy.sparse.csr_matrix of dimension [n_nodes, n_nodes] -- adjacency matrix
+    Output:
+        - numpy.ndarray - weighted degree of each node
+        - numpy.ndarray - unweighted degree (number of neighbours) of each node
+    """
+    # Retrieve self loops weights
+    loops = weights.diagonal()
+    # Sum rows weights, count rows entries
+    weighted = np.asarray(weights.sum(axis=1)).ravel() + loops
+    unweighted = np.diff(weights.indptr) + (loops != 0)
+    return weighted, unweighted
+
+
+# Compute degree distribution
+def get_distribution(degree):
+    """
+    Input:
+        - degree : numpy.ndarray -- degree of each node
+    Output:
+        - numpy.ndarray - distinct degree values, sorted
+        - numpy.ndarray - number of nodes with each degree
+        - numpy.ndarray - fraction of nodes with each degree (PDF)
+        - numpy.ndarray - fraction of nodes with a greater degree (complementary CDF)
+    """
+    # Get degree counts
+    k, count = np.unique(degree, return_counts=True)
+    # Compute PDF
+    pdf = count / np.sum(count)
+    # Compute CDF (last one is exactly 0)
+    cdf = np.append(1 - np.cumsum(pdf)[:-1], 0.0)[:k.shape[0]]
+    return k, count, pdf, cdf
+
+
+# Fit a discrete power law to the tail of the degree distribution
+def fit_power_law(degree, k_min=None, min_tail=MIN_TAIL):
+    """
+    The exponent is the discrete maximum likelihood estimate, given k_min.
+    If k_min is not given, it is the distinct degree value minimizing the
+    Kolmogorov-Smirnov distance between the fitted tail and the data, among
+    the ones leaving at least <min_tail> nodes in the tail.
+
+    Input:
+        - degree   : numpy.ndarray -- degree of each node (integer values, zeros are ignored)
+        - k_min    : int -- lower bound of the tail, rounded up (selected automatically if None)
+        - min_tail : int -- minimum number of nodes in the tail, when selecting k_min
+    Output:
+        - dict with keys 'k_min', 'gamma' (exponent, p(k) ~ k^-gamma), 'n_tail' (nodes
+          in the tail), 'n' (nodes with positive degree) and 'ks' (KS distance)
+    """
+    # Retrieve positive integer degrees
+    degree = np.asarray(degree)
+    degree = degree[degree > 0]
+    if np.any(degree != np.floor(degree)):
+        raise ValueError('Discrete power law requires integer degrees')
+    # Get degree counts
+    k, count = np.unique(degree.astype(np.int64), return_counts=True)
+    # Define number of nodes and sum of log-degree in the tail starting at each distinct degree
+    n_tail = np.cumsum(count[::-1])[::-1]
+    log_tail = np.cumsum((count * np.log(k))[::-1])[::-1]
+
+    # Define candidate tails (either given one or the long enough ones) and their lower bound
+    if k_min is not None:
+        # Tail of integer degrees starts at the first integer not below k_min
+        k_min = int(np.ceil(k_min))
+        candidates = np.flatnonzero(k >= k_min)[:1]
+        k_mins = np.full(candidates.shape[0], k_min)
+    else:
+        candidates = np.flatnonzero(n_tail >= min(min_tail, degree.shape[0]))
+        k_mins = k[candidates]
+    if not candidates.shape[0]:
+        raise ValueError('No degree in the tail of the distribution')
+    # Fit exponent of every candidate tail at once
+    gamma = fit_exponent(k_mins, n_tail[candidates], log_tail[candidates])
+    # Compute KS distance of every candidate tail
+    ks = np.array([
+        ks_distance(k[i:], count[i:], k_min_i, gamma_i)
+        for i, k_min_i, gamma_i in zip(candidates, k_mins, gamma)
+    ])
+
+    # Select tail with minimum KS distance (the first one, on ties)
+    best = np.argmin(ks)
+    i = candidates[best]
+    return {
+        'k_min': int(k_mins[best]),
+        'gamma': float(gamma[best]),
+        'n_tail': int(n_tail[i]),
+        'n': int(degree.shape[0]),
+        'ks': float(ks[best])
+    }
+
+
+# Compute maximum likelihood exponent of discrete power law tails
+def fit_exponent(k_min, n_tail, log_tail):
+    """
+    Log-likelihood -n log(zeta(gamma, k_min)) - gamma sum(log(k)) is concave in
+    gamma, hence it is maximized by golden section search, on every tail at once.
+
+    Input:
+        - k_min    : numpy.ndarray -- lower bound of each tail
+        - n_tail   : numpy.ndarray -- number of nodes in each tail
+        - log_tail : numpy.ndarray -- sum of log-degree in each tail
+    Output:
+        - numpy.ndarray - exponent of each tail
+    """
+    # Define negative log-likelihood of each tail
+    def loss(gamma):
+        return n_tail * np.log(zeta(gamma, k_min)) + gamma * log_tail
+
+    # Initialize search intervals
+    ratio = (np.sqrt(5) - 1) / 2
+    a = np.full(k_min.shape[0], GAMMA_BOUNDS[0])
+    b = np.full(k_min.shape[0], GAMMA_BOUNDS[1])
+    x, y = b - ratio * (b - a), a + ratio * (b - a)
+    f_x, f_y = loss(x), loss(y)
+    # Shrink intervals towards minima
+    for _ in range(GOLDEN_ITER):
+        # Case minimum is left of y: interval becomes [a, y], otherwise [x, b]
+        left = f_x < f_y
+        a, b = np.where(left, a, x), np.where(left, y, b)
+        # Evaluate a new inner point, the other one is kept
+        z = np.where(left, b - ratio * (b - a), a + ratio * (b - a))
+        f_z = loss(z)
+        x, f_x, y, f_y = (
+            np.where(left, z, y), np.where(left, f_z, f_y),
+            np.where(left, x, z), np.where(left, f_x, f_z)
+        )
+    return (a + b) / 2
+
+
+# Compute KS distance between a tail of degrees and a discrete power law
+def ks_distance(k, count, k_min, gamma):
+    """
+    Input:
+        - k     : numpy.ndarray -- distinct degree values of the tail, sorted
+        - count : numpy.ndarray -- number of nodes with each degree
+        - k_min : int -- lower bound of the tail
+        - gamma : float -- power law exponent
+    Output:
+        - float - maximum distance between empirical and fitted CDF
+    """
+    # Compute empirical CDF
+    empirical = np.cumsum(count) / np.sum(count)
+    # Compute power law CDF, P(K <= k) = 1 - zeta(gamma, k + 1) / zeta(gamma, k_min)
+    fitted = 1 - zeta(gamma, k + 1) / zeta(gamma, k_min)
+    return np.max(np.absolute(empirical - fitted))
+
+
+# Sample degrees from fitted distribution: body resampled from data, tail from power law
+def sample_degrees(body, n, n_tail, k_min, gamma, rng):
+    """
+    Input:
+        - body   : numpy.ndarray -- positive degrees below k_min
+        - n      : int -- number of degrees to sample
+        - n_tail : int -- number of degrees in the tail of the data
+        - k_min  : int -- lower bound of the tail
+        - gamma  : float -- power law exponent
+        - rng    : numpy.random.Generator
+    Output:
+        - numpy.ndarray - sampled degrees
+    """
+    # Define number of sampled tail degrees
+    m = rng.binomial(n, n_tail / n)
+    # Sample tail degrees (continuous approximation of the discrete power law, rounded)
+    r = rng.random(m)
+    tail = np.floor((k_min - 0.5) * (1 - r) ** (-1 / (gamma - 1)) + 0.5)
+    # Resample body degrees
+    body = rng.choice(body, size=n - m, replace=True) if body.shape[0] else np.empty(0)
+    return np.concatenate([body, np.minimum(tail, np.iinfo(np.int64).max / 2)])
+
+
+# Compute KS distance of power laws fitted to sampled degrees (run by each bootstrap process)
+def bootstrap_ks(body, n, n_tail, k_min, gamma, seeds, min_tail=MIN_TAIL):
+    # Initialize KS distances
+    ks = []
+    # Loop through each sample seed
+    for seed in seeds:
+        # Sample degrees
+        degree = sample_degrees(body, n, n_tail, k_min, gamma, np.random.default_rng(seed))
+        # Fit power law to sampled degrees, as done with data
+        ks.append(fit_power_law(degree, min_tail=min_tail)['ks'])
+    return ks
+
+
+# Test goodness of a power law fit by bootstrap, in parallel
+def test_power_law(degree, fit=None, n_samples=N_SAMPLES, workers=None, executor=None, seed=SEED, min_tail=MIN_TAIL):
+    """
+    Synthetic degree sequences are drawn from the fitted model (power law tail,
+    body resampled from data), then fitted the same way as data: the p-value
+    is the fraction of them whose KS distance is at least the observed one.
+    Samples are seeded independently, hence results do not depend on workers.
+
+    Input:
+        - degree    : numpy.ndarray -- degree of each node
+        - fit       : dict -- power law fitted to degree (see fit_power_law), fitted if None
+        - n_samples : int -- number of synthetic degree sequences
+        - workers   : int -- number of processes (default: one per core)
+        - executor  : concurrent.futures.Executor -- pool to run samples in, e.g. shared by many
+                      networks (a new one is started if None)
+        - seed      : int -- bootstrap seed
+        - min_tail  : int -- minimum number of nodes in the tail, when selecting k_min
+    Output:
+        - dict - fit, with key 'p_value' added
+    """
+    # Fit power law to data, if needed (k_min is selected automatically)
+    fit = dict(fit if fit is not None else fit_power_law(degree, min_tail=min_tail))
+    # Retrieve body of the distribution
+    degree = np.asarray(degree)
+    degree = degree[degree > 0]
+    body = degree[degree < fit['k_min']]
+    # Split seeds of each sample into chunks, one per process
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).spawn(n_samples)
+    chunks = [seeds[i::workers] for i in range(workers) if seeds[i::workers]]
+    # Fit sampled degrees in parallel
+    args = (body, fit['n'], fit['n_tail'], fit['k_min'], fit['gamma'])
+    pool = executor or ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(bootstrap_ks, *args, chunk, min_tail) for chunk in chunks]
+        ks = np.concatenate([future.result() for future in futures])
+    # Case pool has been started here: terminate it
+    finally:
+        if executor is None:
+            pool.shutdown(wait=True)
+    # Compute p-value
+    fit['p_value'] = float(np.mean(ks >= fit['ks']))
+    return fit
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    from datetime import datetime
+
+    # Sample degrees from a known distribution (power law tail from degree 5, exponent 2.5)
+    rng = np.random.default_rng(SEED)
+    degree = sample_degrees(np.arange(1, 5), 5000, 2000, 5, 2.5, rng)
+    # Compute degree distribution
+    k, count, pdf, cdf = get_distribution(degree)
+    print('Distinct degrees:', k.shape[0], 'PDF sum:', pdf.sum())
+    # Fit power law, selecting k_min
+    start_time = datetime.now()
+    print(fit_power_law(degree))
+    print('Fitted in', datetime.now() - start_time)
+    # Test fit goodness
+    start_time = datetime.now()
+    print(test_power_law(degree, n_samples=100, workers=2))
+    print('Tested in', datetime.now() - start_time)
@@ -0,0 +1,254 @@
+# Dependencies
+import os
+import shutil
+import numpy as np
+from scipy import sparse
+
+# Constants
+NODE_PREFIX = 'node_'  # File name prefix of nodes attributes
+EDGE_PREFIX = 'edge_'  # File name prefix of edges attributes
+
+
+# Store a graph as a directory of binary .npy files
+def save_graph(out_path, weights, labels, node_attributes=None, edge_attributes=None):
+    """
+    The directory holds CSR arrays (indptr.npy, indices.npy, data.npy), the
+    label table (labels.npy, one row per node, one column per label value for
+    tuple labels) and one file per attribute. Nodes attributes are aligned
+    with labels, edges attributes with CSR entries (both directions of an edge
+    hold the same value). Attributes must be numeric, boolean or strings.
+    The previous graph at the same path, if any, is replaced atomically.
+
+    Input:
+        - out_path        : str -- output directory
+        - weights         : scipy.sparse.csr_matrix of dimension [n_nodes, n_nodes] -- adjacency matrix
+        - labels          : numpy.ndarray -- node label (either a value or a tuple of values) of each row
+        - node_attributes : dict -- (name: numpy.ndarray of one value per node)
+        - edge_attributes : dict -- (name: numpy.ndarray of one value per CSR entry)
+    """
+    # Sort column indices of each row (loaded matrices may be read only)
+    weights = sparse.csr_matrix(weights)
+    if not weights.has_sorted_indices:
+        weights = weights.sorted_indices()
+    # Define arrays to store (labels and strings as fixed width unicode)
+    arrays = {
+        'indptr': weights.indptr, 'indices': weights.indices, 'data': weights.data,
+        'labels': to_fixed(labels, len(labels))
+    }
+    arrays.update({NODE_PREFIX + name: to_fixed(values, weights.shape[0]) for name, values in (node_attributes or {}).items()})
+    arrays.update({EDGE_PREFIX + name: to_fixed(values, weights.nnz) for name, values in (edge_attributes or {}).items()})
+    # Check that there is a label for each node
+    if arrays['labels'].shape[0] != weights.shape[0]:
+        raise ValueError('Labels do not match adjacency matrix rows')
+
+    # Write to temporary directory first
+    out_path = os.path.normpath(out_path)
+    tmp_path = out_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), values, allow_pickle=False)
+    # Replace previous graph (removing the one left by an interrupted save, if any)
+    shutil.rmtree(out_path + '.old', ignore_errors=True)
+    if os.path.isdir(out_path):
+        os.replace(out_path, out_path + '.old')
+    os.replace(tmp_path, out_path)
+    shutil.rmtree(out_path + '.old', ignore_errors=True)
+
+
+# Load a graph stored by save_graph, memory mapping its arrays
+def load_graph(in_path, mmap=True):
+    """
+    Arrays are mapped copy-on-write: they are read from disk only when
+    accessed, and changing them does not change the stored graph.
+
+    Input:
+        - in_path : str -- input directory
+        - mmap    : bool -- whether arrays are memory mapped, otherwise they are read at once
+    Output:
+        - scipy.sparse.csr_matrix - adjacency matrix
+        - numpy.ndarray - node label (either a value or a tuple of values) of each row
+        - dict - nodes attributes (name: numpy.ndarray)
+        - dict - edges attributes (name: numpy.ndarray)
+    """
+    # Define arrays loader
+    def load(name):
+        return np.load(os.path.join(in_path, name), mmap_mode='c' if mmap else None, allow_pickle=False)
+
+    # Load CSR arrays (indices are already sorted)
+    indptr, indices, data = load('indptr.npy'), load('indices.npy'), load('data.npy')
+    weights = sparse.csr_matrix((data, indices, indptr), shape=(indptr.shape[0] - 1, ) * 2, copy=False)
+    weights.has_sorted_indices = True
+    # Load labels (tuples for nodes defined by more than one column)
+    table = load('labels.npy')
+    labels = np.empty(table.shape[0], dtype=object)
+    labels[:] = table.tolist() if table.ndim == 1 else [*map(tuple, table.tolist())]
+    # Load attributes
+    node_attributes, edge_attributes = dict(), dict()
+    for name in sorted(os.listdir(in_path)):
+        if name.startswith(NODE_PREFIX):
+            node_attributes[name[len(NODE_PREFIX):-len('.npy')]] = load(name)
+        elif name.startswith(EDGE_PREFIX):
+            edge_attributes[name[len(EDGE_PREFIX):-len('.npy')]] = load(name)
+    return weights, labels, node_attributes, edge_attributes
+
+
+# Turn values into an array with no python objects (strings become fixed width unicode)
+def to_fixed(values, n):
+    # Case labels are tuples: one column per value
+    values = np.asarray(list(values) if len(values) and isinstance(values[0], tuple) else values)
+    if values.dtype == object:
+        values = values.astype(str)
+    # Check that there is a value per node (or edge)
+    if values.shape[0] != n:
+        raise ValueError('Expected {:d} values, found {:d}'.format(n, values.shape[0]))
+    return values
+
+
+# Map each CSR entry of an adjacency matrix to the upper triangle entry of its edge
+def get_edge_positions(weights):
+    """
+    Input:
+        - weights : scipy.sparse.csr_matrix of dimension [n_nodes, n_nodes] -- adjacency matrix
+    Output:
+        - numpy.ndarray - source node of each edge (upper triangle, row by row)
+        - numpy.ndarray - target node of each edge
+        - numpy.ndarray - CSR entry of each edge
+    """
+    # Number CSR entries (from 1, since zeros are not stored)
+    positions = sparse.csr_matrix((np.arange(1, weights.nnz + 1), weights.indices, weights.indptr), shape=weights.shape)
+    # Keep only upper triangle
+    upper = sparse.triu(positions, format='coo')
+    return upper.row, upper.col, upper.data - 1
+
+
+# Retrieve nodes and edges attributes of a NetworkX graph, aligned with its adjacency matrix
+def get_networkx_attributes(net, labels, weights):
+    """
+    GEXF bookkeeping attributes (node 'label', edge 'id' and 'weight') are left out.
+
+    Input:
+        - net     : networkx.Graph
+        - labels  : numpy.ndarray -- node label of each adjacency matrix row
+        - weights : scipy.sparse.csr_matrix of dimension [n_nodes, n_nodes] -- adjacency matrix of net
+    Output:
+        - dict - nodes attributes (name: numpy.ndarray of one value per node)
+        - dict - edges attributes (name: numpy.ndarray of one value per CSR entry)
+    """
+    # Retrieve nodes attributes, in labels order
+    names = {name for _, data in net.nodes(data=True) for name in data} - {'label'}
+    node_attributes = {name: np.array([net.nodes[label].get(name) for label in labels]) for name in sorted(names)}
+    # Retrieve edges attributes, in upper triangle order
+    names = {name for _, _, data in net.edges(data=True) for name in data} - {'id', 'weight'}
+    node_x, node_y, positions = get_edge_positions(weights)
+    edges = [net.edges[labels[x], labels[y]] for x, y in zip(node_x, node_y)]
+    # Spread them over CSR entries (both directions)
+    mirrored = transpose_positions(weights)[positions]
+    edge_attributes = dict()
+    for name in sorted(names):
+        values = np.array([data.get(name) for data in edges])
+        edge_attributes[name] = np.empty(weights.nnz, dtype=values.dtype)
+        edge_attributes[name][positions] = values
+        edge_attributes[name][mirrored] = values
+    return node_attributes, edge_attributes
+
+
+# Map each CSR entry of a (symmetric, sorted) adjacency matrix to the entry of the same edge in the opposite direction
+def transpose_positions(weights):
+    # Number CSR entries (from 1, since zeros are not stored), then read them through the transposed matrix
+    positions = sparse.csr_matrix((np.arange(1, weights.nnz + 1), weights.indices, weights.indptr), shape=weights.shape)
+    transposed = positions.T.tocsr()
+    transposed.sort_indices()
+    return transposed.data - 1
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    import tempfile
+    from glob import glob
+    from datetime import datetime
+    import networkx as nx
+    from modules.network import Network, CSRNetwork, louvain
+
+    # Check that two graphs (adjacency matrix, labels and attributes) are the same
+    def same_graph(x, y):
+        (weights_x, labels_x, nodes_x, edges_x), (weights_y, labels_y, nodes_y, edges_y) = x, y
+        return (
+            weights_x.shape == weights_y.shape and (weights_x != weights_y).nnz == 0
+            and np.array_equal(weights_x.indices, weights_y.indices) and labels_x.tolist() == labels_y.tolist()
+            and nodes_x.keys() == nodes_y.keys() and all(np.array_equal(nodes_x[k], nodes_y[k]) for k in nodes_x)
+            and edges_x.keys() == edges_y.keys() and all(np.array_equal(edges_x[k], edges_y[k]) for k in edges_x)
+        )
+
+    # Define a random weighted graph, with communities and a boolean edge attribute
+    rng = np.random.default_rng(0)
+    n_nodes, n_edges = 20000, 100000
+    x, y = rng.integers(0, n_nodes, n_edges), rng.integers(0, n_nodes, n_edges)
+    weights = sparse.csr_matrix((np.ones(2 * n_edges, dtype=np.int64), (np.append(x, y), np.append(y, x))), shape=(n_nodes, n_nodes))
+    weights.sort_indices()
+    labels = np.empty(n_nodes, dtype=object)
+    labels[:] = ['#h{:d}'.format(i) for i in range(n_nodes)]
+    network = CSRNetwork(weights, labels)
+    communities, _ = louvain(weights)
+    node_attributes = {'community': communities}
+    edge_attributes = {'internal': communities[np.repeat(np.arange(n_nodes), np.diff(weights.indptr))] == communities[weights.indices]}
+    graph = (weights, labels, node_attributes, edge_attributes)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Store graph in binary format, then load it (memory mapped)
+        start_time = datetime.now()
+        network.to_npy(os.path.join(tmp_dir, 'graph'), node_attributes, edge_attributes)
+        print('Binary stored in', datetime.now() - start_time)
+        start_time = datetime.now()
+        loaded = CSRNetwork()
+        loaded_attributes = loaded.from_npy(os.path.join(tmp_dir, 'graph'))
+        print('Binary loaded in', datetime.now() - start_time)
+        print('Binary round trip is lossless:', same_graph(graph, (loaded.weights, loaded.labels, *loaded_attributes)))
+        # Export loaded graph to .gexf, then load it back
+        start_time = datetime.now()
+        loaded.to_gexf(os.path.join(tmp_dir, 'graph.gexf'), *loaded_attributes)
+        print('GEXF stored in', datetime.now() - start_time)
+        start_time = datetime.now()
+        exported = CSRNetwork()
+        exported_attributes = exported.from_gexf(os.path.join(tmp_dir, 'graph.gexf'))
+        print('GEXF loaded in', datetime.now() - start_time)
+        print('GEXF round trip is lossless:', same_graph(graph, (exported.weights, exported.labels, *exported_attributes)))
+        # Compare storage size
+        size = sum(os.path.getsize(path) for path in glob(os.path.join(tmp_dir, 'graph', '*')))
+        print('Binary size: {:d} bytes, GEXF size: {:d} bytes'.format(size, os.path.getsize(os.path.join(tmp_dir, 'graph.gexf'))))
+
+        # Define a NetworkX backed graph, with an isolated node and attributes
+        net = nx.Graph()
+        net.add_nodes_from([('z', {'community': 1}), ('a', {'community': 0}), ('iso', {'community': 2}), ('b', {'community': 0})])
+        net.add_edges_from([('z', 'a', {'weight': 2, 'internal': False}), ('a', 'b', {'weight': 1, 'internal': True})])
+        # Store it in binary format (over the directory left by an interrupted save), then load it
+        os.makedirs(os.path.join(tmp_dir, 'small.old'))
+        Network(net).to_npy(os.path.join(tmp_dir, 'small'))
+        small = Network()
+        small.from_npy(os.path.join(tmp_dir, 'small'))
+        print('NetworkX binary round trip is lossless:', list(small.net.nodes(data=True)) == list(net.nodes(data=True)) and sorted(
+            (*sorted((x, y)), sorted(data.items())) for x, y, data in small.net.edges(data=True)
+        ) == sorted((*sorted((x, y)), sorted(data.items())) for x, y, data in net.edges(data=True)))
+        # Export it to .gexf, load it back, then compare stored graphs
+        small.to_gexf(os.path.join(tmp_dir, 'small.gexf'))
+        exported = Network()
+        exported.from_gexf(os.path.join(tmp_dir, 'small.gexf'))
+        exported.to_npy(os.path.join(tmp_dir, 'small_gexf'))
+        print('NetworkX GEXF round trip is lossless:', same_graph(
+            load_graph(os.path.join(tmp_dir, 'small')), load_graph(os.path.join(tmp_dir, 'small_gexf'))
+        ))
+
+        # Convert stored communities networks, check they survive .gexf -> binary -> .gexf
+        for in_path in sorted(glob('data/communities/*.gexf')):
+            network = CSRNetwork()
+            network.from_gexf(in_path)
+            network.to_npy(os.path.join(tmp_dir, 'communities'))
+            network.from_npy(os.path.join(tmp_dir, 'communities'))
+            network.to_gexf(os.path.join(tmp_dir, 'communities.gexf'))
+            restored = CSRNetwork()
+            restored.from_gexf(os.path.join(tmp_dir, 'communities.gexf'))
+            print(in_path, 'round trip is lossless:', same_graph(
+                (network.weights, network.labels, dict(), dict()), (restored.weights, restored.labels, dict(), dict())
+            ))
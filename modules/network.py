@@ -2,6 +2,13 @@
 import numpy as np
 import pandas as pd
 import networkx as nx
+from scipy import sparse
+from scipy.sparse import csgraph
+from concurrent.futures import ProcessPoolExecutor
+
+# Local dependencies
+from modules.degree import get_degrees, get_distribution, fit_power_law, test_power_law
+from modules.graph_store import save_graph, load_graph, get_edge_positions, get_networkx_attributes
 
 
 class Network:
@@ -13,33 +20,47 @@ class Network:
 
     # Generate inner networkx instance from Entities table
     @staticmethod
-    def from_entities(entities, node_getter):
-        # Create a copy of input entities
-        entities = entities.copy()
-
-        # Create nodes column containing nodes
-        # Set nodes as entity text
-        entities.df['node'] = entities.df.apply(
-            node_getter,
-            axis=1
-        )
+    def from_entities(entities, node_getter=None, node_columns=None):
+        """
+        Two nodes are linked if they appear in the same tweet, the edge
+        weight being the number of (ordered) pairs of distinct entities in
+        the same tweet matching them, as with a self-join on tweet ids.
 
-        # Create edges (new, detached DataFrame)
-        edges = pd.merge(entities.df, entities.df, on='tweet_id')
-        # Remove self loops
-        edges = edges[edges.entity_index_x != edges.entity_index_y]
-
-        # Count how many times the same word matches have been found
-        edges = edges.groupby(['node_x', 'node_y']).size()
-        edges = edges.reset_index(name='weight')
-
-        # Create inner NetworkX object from edges DataFrame
-        return Network(nx.from_pandas_edgelist(
-            df=edges,
-            source='node_x',
-            target='node_y',
-            edge_attr=['weight']
-        ))
+        Input
+        1. entities: Entities table;
+        2. node_getter: function returning the node of an entity (row);
+        3. node_columns: list of columns defining a node (faster than getter);
+
+        Output
+        1. Network whose nodes are the ones having at least one edge;
+        """
+        # Compute weighted adjacency matrix of nodes, and their labels
+        weights, labels = get_weights(entities, node_getter=node_getter, node_columns=node_columns)
+        return Network.from_weights(weights, labels)
+
+    # Generate inner networkx instance from (symmetric) weighted adjacency matrix and nodes labels
+    @staticmethod
+    def from_weights(weights, labels):
+        # Keep only upper triangle: it defines the same undirected graph, nodes
+        # and edges being added in the same order of the full (sorted) edge list
+        weights = sparse.triu(weights, format='csr')
+        weights.sort_indices()
+        # Retrieve edges, sorted by source and target codes
+        node_x = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+        node_y, weight = weights.indices, weights.data
+        # Create inner NetworkX object from edges, mapping integer codes back to nodes labels
+        net = nx.Graph()
+        net.add_weighted_edges_from(zip(labels[node_x], labels[node_y], weight))
+        return Network(net)
+
+    # Wrap given NetworkX object
+    @staticmethod
+    def from_networkx(net):
+        return Network(net)
+
+    # Retrieve inner NetworkX object
+    def to_networkx(self):
+        return self.net
 
     # Load inner NetworkX object from .gexf file
     def from_gexf(self, in_path):
@@ -49,6 +70,25 @@ class Network:
     def to_gexf(self, out_path):
         nx.write_gexf(self.net, out_path)
 
+    # Load inner NetworkX object from binary graph directory (see modules.graph_store), return attributes
+    def from_npy(self, in_path, mmap=True):
+        weights, labels, node_attributes, edge_attributes = load_graph(in_path, mmap=mmap)
+        # Keep all nodes (even isolated ones) in stored order, attach attributes to them and to edges
+        self.net = CSRNetwork(weights, labels).to_networkx(node_attributes, edge_attributes)
+        return node_attributes, edge_attributes
+
+    # Store adjacency matrix and nodes labels in binary graph directory (see modules.graph_store)
+    def to_npy(self, out_path, node_attributes=None, edge_attributes=None):
+        # Retrieve adjacency matrix and nodes labels, in nodes order
+        weights = self.get_adjacency()
+        weights.sort_indices()
+        labels = np.empty(self.net.number_of_nodes(), dtype=object)
+        labels[:] = self.get_nodes()
+        # Case no attributes are given: store the ones of inner NetworkX object
+        if node_attributes is None and edge_attributes is None:
+            node_attributes, edge_attributes = get_networkx_attributes(self.net, labels, weights)
+        save_graph(out_path, weights, labels, node_attributes, edge_attributes)
+
     # Compute degree and return it as Pandas Series
     def get_degree(self):
         return pd.Series({
@@ -58,18 +98,21 @@ class Network:
             )
         })
 
+    # Retrieve weighted adjacency matrix (rows and columns follow nodes order)
+    def get_adjacency(self):
+        # Case empty graph (networkx has no adjacency matrix for it)
+        if self.net.number_of_nodes() == 0:
+            return sparse.csr_matrix((0, 0), dtype=np.int64)
+        return sparse.csr_matrix(nx.to_scipy_sparse_array(self.net, weight='weight'))
+
+    # Compute weighted and unweighted degree at once, as Pandas DataFrame
+    def get_degrees(self):
+        weighted, unweighted = get_degrees(self.get_adjacency())
+        return pd.DataFrame({'weighted': weighted, 'unweighted': unweighted}, index=make_index(self.net.nodes))
+
     # Compute and retrieve degree statistics (degree, count, pdf, cdf)
     def get_degree_stats(self):
-        # Retrieve degree
-        degree = self.get_degree()
-        # Get degree counts
-        degree, count = np.unique(degree.values, return_counts=True)
-        # Compute PDF
-        pdf = count / np.sum(count)
-        # Compute CDF
-        cdf = list(1 - np.cumsum(pdf))[:-1] + [0]
-        # Return degree, degree count, degree PDF and degree CDF
-        return degree, count, pdf, cdf
+        return get_distribution(self.get_degree().values)
 
     # Compute and retrieve power law parameter
     def power_law(self, k_sat):
@@ -79,15 +122,26 @@ class Network:
         k, count = np.unique(degree, return_counts=True)
         # Define minumum and maximum k (degree)
         k_min, k_max = np.min(k), np.max(k)
-        # Estimate parameters
-        n = degree[k_sat:].shape[0]
-        gamma = 1 + n / np.sum(np.log(degree[k_sat:] / k_sat))
+        # Estimate parameters on degrees above saturation one
+        tail = degree.values[degree.values >= k_sat]
+        n = tail.shape[0]
+        gamma = 1 + n / np.sum(np.log(tail / k_sat))
         c = (gamma - 1) * k_sat ** (gamma - 1)
         # Compute cutoff
         cutoff = k_sat * n ** (1 / (gamma - 1))
         # Return power law parameters
         return k_min, k_max, gamma, c, cutoff
 
+    # Fit discrete power law to degrees, selecting k_min if not given (see modules.degree)
+    def fit_power_law(self, k_min=None, weighted=True):
+        degrees = self.get_degrees()
+        return fit_power_law(degrees['weighted' if weighted else 'unweighted'].values, k_min=k_min)
+
+    # Fit discrete power law to degrees and test its goodness by bootstrap (see modules.degree)
+    def test_power_law(self, weighted=True, **kwargs):
+        degrees = self.get_degrees()
+        return test_power_law(degrees['weighted' if weighted else 'unweighted'].values, **kwargs)
+
     # Find connected components
     def get_connected_components(self):
         # Compute connected components and sort them
@@ -106,6 +160,15 @@ class Network:
     def project_component(self, component):
         return Network(self.net.subgraph(component))
 
+    # Label each node (in nodes order) with its connected component, the largest being 0
+    def get_component_labels(self):
+        return label_components(self.get_adjacency())
+
+    # Project the subgraph of the largest connected component
+    def project_giant_component(self):
+        components, _ = self.get_component_labels()
+        return Network(self.net.subgraph([node for node, c in zip(self.net.nodes, components) if c == 0]))
+
     # Compute page rank as Pandas Series
     def get_page_rank(self):
         return pd.Series({
@@ -115,6 +178,36 @@ class Network:
             ).items()
         })
 
+    # Retrieve nodes labels, in adjacency matrix order
+    def get_nodes(self):
+        return list(self.net.nodes)
+
+    # Detect communities (see louvain), return community of each node as Pandas Series
+    def get_communities(self, resolution=1.0, seed=0):
+        partition, _ = louvain(self.get_adjacency(), resolution=resolution, seed=seed)
+        return pd.Series(partition, index=make_index(self.get_nodes()))
+
+    # Detect communities for each resolution and seed, in parallel (see sweep_communities)
+    def sweep_communities(self, resolutions, seeds=(0, ), threshold=0, workers=None):
+        """
+        Input
+        1. resolutions: list of modularity resolutions;
+        2. seeds: list of random seeds, each one run with each resolution;
+        3. threshold: communities with more nodes are counted as selected;
+        4. workers: number of processes (default: one per core);
+
+        Output
+        1. DataFrame of modularity and communities size statistics, indexed
+        by resolution and seed;
+        2. dictionary ((resolution, seed): Series of community of each node);
+        """
+        stats, partitions = sweep_communities(
+            self.get_adjacency(), resolutions, seeds=seeds, threshold=threshold, workers=workers
+        )
+        # Map nodes to their labels
+        index = make_index(self.get_nodes())
+        return stats, {key: pd.Series(partition, index=index) for key, partition in partitions.items()}
+
     # get pandas dataframe with degree and page rank for each node
     def get_metrics_df(self):
         # compute metrics
@@ -127,26 +220,543 @@ class Network:
         return df
 
 
+# Network stored as (symmetric) CSR adjacency matrix, plus nodes labels
+class CSRNetwork(Network):
+
+    # Constructor
+    def __init__(self, weights=None, labels=None):
+        # Call parent constructor (no inner NetworkX instance)
+        super().__init__(net=None)
+        # Define adjacency matrix (self loops are stored once, as in networkx)
+        self.weights = weights if weights is not None else sparse.csr_matrix((0, 0), dtype=np.int64)
+        # Define node label (either a value or a tuple of values) for each row
+        self.labels = labels if labels is not None else np.empty(0, dtype=object)
+
+    # Generate adjacency matrix from Entities table (see Network.from_entities)
+    @staticmethod
+    def from_entities(entities, node_getter=None, node_columns=None):
+        # Compute weighted adjacency matrix of nodes, and their labels
+        weights, labels = get_weights(entities, node_getter=node_getter, node_columns=node_columns)
+        return CSRNetwork.from_weights(weights, labels)
+
+    # Generate adjacency matrix from (symmetric) weighted adjacency matrix and nodes labels
+    @staticmethod
+    def from_weights(weights, labels):
+        # Retrieve edges, sorted by source and target codes (upper triangle only)
+        upper = sparse.triu(weights, format='coo')
+        order = np.lexsort((upper.col, upper.row))
+        # Keep only nodes having edges, in the same order of Network.from_entities
+        nodes = pd.unique(np.column_stack([upper.row[order], upper.col[order]]).ravel())
+        return CSRNetwork(weights[nodes][:, nodes].tocsr(), labels[nodes])
+
+    # Generate adjacency matrix from NetworkX object
+    @staticmethod
+    def from_networkx(net):
+        # Define nodes labels, in the same order of NetworkX nodes
+        labels = np.empty(net.number_of_nodes(), dtype=object)
+        labels[:] = list(net.nodes)
+        # Retrieve weighted adjacency matrix
+        weights = sparse.csr_matrix(nx.to_scipy_sparse_array(net, nodelist=list(net.nodes), weight='weight'))
+        weights.sort_indices()
+        return CSRNetwork(weights, labels)
+
+    # Generate NetworkX object from adjacency matrix, with given nodes and edges attributes (see modules.graph_store)
+    def to_networkx(self, node_attributes=None, edge_attributes=None):
+        # Add nodes, in order, with their attributes
+        net = nx.Graph()
+        net.add_nodes_from(self.labels)
+        for name, values in (node_attributes or {}).items():
+            nx.set_node_attributes(net, dict(zip(self.labels, np.asarray(values).tolist())), name)
+        # Add edges, once each (upper triangle only), with their attributes
+        node_x, node_y, positions = get_edge_positions(self.weights)
+        attributes = {'weight': self.weights.data, **(edge_attributes or {})}
+        attributes = {name: np.asarray(values)[positions].tolist() for name, values in attributes.items()}
+        net.add_edges_from(zip(
+            self.labels[node_x], self.labels[node_y],
+            [dict(zip(attributes, values)) for values in zip(*attributes.values())]
+        ))
+        return net
+
+    # Load adjacency matrix from .gexf file, return nodes and edges attributes (see modules.graph_store)
+    def from_gexf(self, in_path):
+        net = nx.read_gexf(in_path)
+        network = CSRNetwork.from_networkx(net)
+        self.weights, self.labels = network.weights, network.labels
+        return get_networkx_attributes(net, self.labels, self.weights)
+
+    # Store adjacency matrix in .gexf file, with given nodes and edges attributes (export for Gephi)
+    def to_gexf(self, out_path, node_attributes=None, edge_attributes=None):
+        nx.write_gexf(self.to_networkx(node_attributes, edge_attributes), out_path)
+
+    # Load adjacency matrix from binary graph directory, memory mapped (see modules.graph_store), return attributes
+    def from_npy(self, in_path, mmap=True):
+        self.weights, self.labels, node_attributes, edge_attributes = load_graph(in_path, mmap=mmap)
+        return node_attributes, edge_attributes
+
+    # Store adjacency matrix in binary graph directory (see modules.graph_store)
+    def to_npy(self, out_path, node_attributes=None, edge_attributes=None):
+        save_graph(out_path, self.weights, self.labels, node_attributes, edge_attributes)
+
+    # Compute degree and return it as Pandas Series (self loops count twice, as in networkx)
+    def get_degree(self):
+        weighted, _ = get_degrees(self.weights)
+        return pd.Series(weighted, index=make_index(self.labels))
+
+    # Retrieve weighted adjacency matrix (rows and columns follow labels order)
+    def get_adjacency(self):
+        return self.weights
+
+    # Retrieve nodes labels, in adjacency matrix order
+    def get_nodes(self):
+        return self.labels
+
+    # Compute weighted and unweighted degree at once, as Pandas DataFrame
+    def get_degrees(self):
+        weighted, unweighted = get_degrees(self.weights)
+        return pd.DataFrame({'weighted': weighted, 'unweighted': unweighted}, index=make_index(self.labels))
+
+    # Find connected components
+    def get_connected_components(self):
+        # Label nodes with their component (sorted by size)
+        components, sizes = self.get_component_labels()
+        # Group nodes labels by component
+        nodes = np.argsort(components, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        # Parse connected components as array of dictionaries (component: len)
+        return [
+            {'component': set(self.labels[nodes[bounds[i]:bounds[i + 1]]]), 'size': int(sizes[i])}
+            for i in range(len(sizes))
+        ]
+
+    # Label each node with its connected component, the largest being 0
+    def get_component_labels(self):
+        return label_components(self.weights)
+
+    # Project a subgraph given a component (set of nodes labels)
+    def project_component(self, component):
+        # Retrieve nodes positions, keeping nodes order
+        nodes = np.flatnonzero([label in component for label in self.labels])
+        return CSRNetwork(self.weights[nodes][:, nodes].tocsr(), self.labels[nodes])
+
+    # Project the subgraph of the largest connected component, re-indexing its nodes
+    def project_giant_component(self):
+        # Label nodes with their component
+        components, _ = self.get_component_labels()
+        # Case graph is connected: share adjacency matrix and labels
+        is_giant = components == 0
+        if is_giant.all():
+            return CSRNetwork(self.weights, self.labels)
+        # Otherwise, retrieve component nodes (no edge leaves them)
+        return CSRNetwork(project_closed(self.weights, is_giant), self.labels[is_giant])
+
+    # Compute page rank as Pandas Series
+    def get_page_rank(self, alpha=0.85, max_iter=100, tol=1e-6):
+        scores = page_rank(self.weights, alpha=alpha, max_iter=max_iter, tol=tol)
+        return pd.Series(scores, index=make_index(self.labels))
+
+
 class WordsNet(Network):
 
     @staticmethod
-    def from_entities(entities):
-        return Network.from_entities(
+    def from_entities(entities, backend=Network):
+        return backend.from_entities(
             entities=entities,
-            node_getter=lambda row: (row['entity_text'], row['entity_tag'])
+            node_columns=['entity_text', 'entity_tag']
         )
 
 
 class HashNet(Network):
 
     @staticmethod
-    def from_entities(entities):
-        return Network.from_entities(
+    def from_entities(entities, backend=Network):
+        return backend.from_entities(
             entities=entities,
-            node_getter=lambda row: row['entity_text']
+            node_columns=['entity_text']
         )
 
 
+# Compute nodes co-occurrence matrix and nodes labels from Entities table
+def get_weights(entities, node_getter=None, node_columns=None):
+    # Case nodes are defined by entities columns: work on integer codes
+    if node_columns is not None:
+        nodes, labels = factorize_nodes(entities.df, node_columns)
+    # Case nodes are defined by a getter function: encode nodes as sorted codes
+    else:
+        nodes, labels = pd.factorize(entities.df.apply(node_getter, axis=1), sort=True)
+        labels = np.asarray(labels, dtype=object)
+    # Compute weighted adjacency matrix of nodes
+    weights = get_cooccurrence(entities.df.tweet_id.values, entities.df.entity_index.values, nodes, len(labels))
+    return weights, labels
+
+
+# Compute nodes co-occurrence matrix, given the node of each entity
+def get_cooccurrence(tweet_ids, entity_index, nodes, n_nodes):
+    """
+    Co-occurrences are computed as B'B - D'D, where B is the (sparse) tweet
+    by node incidence matrix and D is the (tweet, entity index) by node one:
+    the latter removes pairs made of an entity and itself.
+
+    Input
+    1. tweet_ids: array of tweet ids, one per entity;
+    2. entity_index: array of entity indices, one per entity;
+    3. nodes: array of node codes, one per entity;
+    4. n_nodes: number of nodes;
+
+    Output
+    1. symmetric CSR matrix of co-occurrences (explicit zeros removed);
+    """
+    # Encode tweets and (tweet, entity index) pairs as contiguous codes
+    tweets, _ = pd.factorize(tweet_ids)
+    entity_index = np.asarray(entity_index, dtype=np.int64)
+    positions, _ = pd.factorize(tweets.astype(np.int64) * (int(np.max(entity_index, initial=0)) + 1) + entity_index)
+    # Define incidence matrices (repeated entries get summed)
+    ones = np.ones(len(nodes), dtype=np.int64)
+    b = sparse.csr_matrix((ones, (tweets, nodes)), shape=(tweets.max(initial=-1) + 1, n_nodes))
+    d = sparse.csr_matrix((ones, (positions, nodes)), shape=(positions.max(initial=-1) + 1, n_nodes))
+    # Count pairs of entities in the same tweet, minus pairs of an entity with itself
+    weights = (b.T @ b - d.T @ d).tocsr()
+    weights.eliminate_zeros()
+    return weights
+
+
+# Compute page rank of a weighted adjacency matrix (as networkx.pagerank_scipy)
+def page_rank(weights, alpha=0.85, max_iter=100, tol=1e-6, x=None):
+    """
+    Input
+    1. weights: (symmetric) sparse adjacency matrix;
+    2. alpha: damping factor;
+    3. max_iter: maximum number of power iterations;
+    4. tol: error tolerance (l1 norm), scaled by number of nodes;
+    5. x: starting scores (uniform if None);
+
+    Output
+    1. array of scores, aligned with adjacency matrix rows;
+    """
+    # Case network is empty
+    n = weights.shape[0]
+    if n == 0:
+        return np.empty(0, dtype=float)
+    # Compute inverse of rows strength (dangling nodes have none)
+    strength = np.asarray(weights.sum(axis=1), dtype=float).ravel()
+    is_dangling = strength == 0
+    inverse = np.divide(1.0, strength, out=np.zeros(n), where=~is_dangling)
+    # Define transposed adjacency matrix (x @ A = A' @ x)
+    transposed = sparse.csr_matrix(weights.T, dtype=float)
+    # Initialize scores
+    x = np.repeat(1.0 / n, n) if x is None else np.asarray(x, dtype=float) / np.sum(x)
+    # Power iteration: make up to max_iter iterations
+    for _ in range(max_iter):
+        x_last = x
+        x = alpha * (transposed @ (x * inverse) + x[is_dangling].sum() / n) + (1 - alpha) / n
+        # Check convergence, l1 norm
+        if np.absolute(x - x_last).sum() < n * tol:
+            return x
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+# Label each node with its connected component
+def label_components(weights):
+    """
+    Input:
+        - weights : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- (symmetric) adjacency matrix
+    Output:
+        - numpy.ndarray - component of each node, components being numbered by decreasing size
+          (ties keep the order of their first node)
+        - numpy.ndarray - size of each component
+    """
+    # Label nodes with their component (components are numbered in nodes order)
+    _, components = csgraph.connected_components(weights, directed=False)
+    # Renumber components by decreasing size
+    return sort_labels(components)
+
+
+# Renumber groups (e.g. components, communities) by decreasing size
+def sort_labels(labels):
+    """
+    Input:
+        - labels : numpy.ndarray -- group of each node, numbered from 0, in order of their first node
+    Output:
+        - numpy.ndarray - group of each node, groups being numbered by decreasing size
+          (ties keep groups order)
+        - numpy.ndarray - size of each group
+    """
+    # Sort groups by size (ties keep groups order)
+    sizes = np.bincount(labels)
+    order = np.argsort(-sizes, kind='stable')
+    # Renumber groups by rank
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.shape[0])
+    return rank[labels], sizes[order]
+
+
+# Project adjacency matrix on a closed set of nodes (e.g. a component), keeping their order
+def project_closed(weights, mask):
+    """
+    Since no edge leaves the kept nodes, only their rows are gathered, their
+    columns being re-indexed in place of a second (column) selection.
+
+    Input:
+        - weights : scipy.sparse.csr_matrix of dimension [n_nodes, n_nodes] -- adjacency matrix
+        - mask    : numpy.ndarray of dimension [n_nodes] -- boolean mask of kept nodes
+    Output:
+        - scipy.sparse.csr_matrix of dimension [n_kept, n_kept] -- projected adjacency matrix
+    """
+    # Retrieve rows of kept nodes
+    nodes = np.flatnonzero(mask)
+    rows = weights[nodes]
+    # Map columns to new nodes indices (order is kept, hence indices stay sorted)
+    index = np.cumsum(mask) - 1
+    indices = index[rows.indices].astype(rows.indices.dtype)
+    return sparse.csr_matrix((rows.data, indices, rows.indptr), shape=(nodes.shape[0], nodes.shape[0]), copy=False)
+
+
+# Detect communities maximizing modularity with Louvain method, on adjacency matrix arrays
+def louvain(weights, resolution=1.0, seed=0, tol=1e-7, min_fraction=1/16):
+    """
+    Each level moves nodes to the neighbouring community with best modularity
+    gain, all nodes at once: moves are applied to a random subset of candidate
+    nodes (halved whenever modularity would not increase), so that nodes
+    do not keep swapping communities. Communities are then merged into the
+    nodes of the next level, until no node moves.
+
+    Input:
+        - weights      : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- (symmetric) adjacency matrix
+        - resolution   : float -- modularity resolution (lower values give larger communities)
+        - seed         : int -- random seed
+        - tol          : float -- minimum modularity increase of each step
+        - min_fraction : float -- moves stop once fewer candidate nodes would be moved at once
+    Output:
+        - numpy.ndarray - community of each node, communities being numbered by decreasing size
+        - float - modularity of the partition
+    """
+    # Define random number generator
+    rng = np.random.default_rng(seed)
+    # Define modularity matrix of first level (self loops are counted twice, as in degree)
+    weights = sparse.csr_matrix(weights, dtype=float)
+    level = sparse.csr_matrix(weights + sparse.diags(weights.diagonal()))
+    # Initialize community of each node (each node on its own)
+    partition = np.arange(weights.shape[0])
+    # Loop through each level
+    while level.shape[0] > 0:
+        # Move nodes of current level
+        communities = move_nodes(level, resolution, rng, tol, min_fraction)
+        # Case no node moved: partition is final
+        if communities.max() + 1 == level.shape[0]:
+            break
+        # Merge nodes into their communities
+        partition = communities[partition]
+        membership = sparse.csr_matrix(
+            (np.ones(level.shape[0]), (np.arange(level.shape[0]), communities)),
+            shape=(level.shape[0], communities.max() + 1)
+        )
+        level = sparse.csr_matrix(membership.T @ level @ membership)
+    # Renumber communities by decreasing size
+    partition, _ = sort_labels(partition)
+    return partition, modularity(weights, partition, resolution)
+
+
+# Move nodes of a Louvain level to neighbouring communities, until modularity stops increasing
+def move_nodes(level, resolution, rng, tol=1e-7, min_fraction=1/16):
+    """
+    Input:
+        - level        : scipy.sparse.csr_matrix -- modularity matrix (diagonal holds twice self loops)
+        - resolution   : float -- modularity resolution
+        - rng          : numpy.random.Generator
+        - tol          : float -- minimum modularity increase of each step
+        - min_fraction : float -- moves stop once fewer candidate nodes would be moved at once
+    Output:
+        - numpy.ndarray - community of each node, numbered from 0 in order of their first node
+    """
+    # Compute strength of each node and total weight (twice the edges weights)
+    n = level.shape[0]
+    strength = np.asarray(level.sum(axis=1)).ravel()
+    total = strength.sum()
+    # Retrieve edges between distinct nodes
+    rows = np.repeat(np.arange(n), np.diff(level.indptr))
+    is_edge = rows != level.indices
+    rows, cols, data = rows[is_edge], level.indices[is_edge], level.data[is_edge]
+    # Initialize communities (each node on its own)
+    communities = np.arange(n)
+    score = level_modularity(level, communities, strength, total, resolution)
+    # Define fraction of candidate nodes moved at once
+    fraction = 1.0
+
+    while total > 0 and fraction >= min_fraction:
+        # Compute strength and size of each community
+        tot = np.bincount(communities, weights=strength, minlength=n)
+        size = np.bincount(communities, minlength=n)
+        # Compute weight from each node to each neighbouring community
+        links = sparse.csr_matrix((data, (rows, communities[cols])), shape=(n, n))
+        node = np.repeat(np.arange(n), np.diff(links.indptr))
+        target, link = links.indices, links.data
+        # Compute gain (up to a constant) of each node joining each neighbouring community
+        is_own = target == communities[node]
+        gain = link - resolution * strength[node] * (tot[target] - np.where(is_own, strength[node], 0)) / total
+        # Compute gain of each node staying in its own community (also without links to it)
+        stay = -resolution * strength * (tot[communities] - strength) / total
+        stay[node[is_own]] = gain[is_own]
+        # Select best other community of each node (ties select lowest community)
+        gain = np.where(is_own, -np.inf, gain)
+        best = np.full(n, -np.inf)
+        has_links = np.diff(links.indptr) > 0
+        best[has_links] = np.maximum.reduceat(gain, links.indptr[:-1][has_links])
+        first = np.flatnonzero((gain == best[node]) & ~is_own)
+        first = first[np.concatenate([[True], node[first][1:] != node[first][:-1]])] if first.shape[0] else first
+        node, target, gain = node[first], target[first], gain[first] - stay[node[first]]
+        # Define candidate moves: improving ones, singletons joining singletons only towards lower communities
+        is_move = (gain > 0) & ~((size[communities[node]] == 1) & (size[target] == 1) & (target > communities[node]))
+        node, target = node[is_move], target[is_move]
+        # Case no node moves: communities are final
+        if not node.shape[0]:
+            break
+        # Move a random subset of candidate nodes
+        moved = rng.random(node.shape[0]) < fraction
+        candidate = communities.copy()
+        candidate[node[moved]] = target[moved]
+        candidate_score = level_modularity(level, candidate, strength, total, resolution)
+        # Case modularity increased: keep moves, otherwise move fewer nodes at once
+        if candidate_score > score + tol:
+            communities, score = candidate, candidate_score
+        else:
+            fraction /= 2
+    # Number communities from 0
+    return pd.factorize(communities)[0]
+
+
+# Compute modularity of a partition of a Louvain level
+def level_modularity(level, communities, strength, total, resolution):
+    # Case graph has no edges
+    if total == 0:
+        return 0.0
+    # Sum weights within each community
+    rows = np.repeat(np.arange(level.shape[0]), np.diff(level.indptr))
+    inner = level.data[communities[rows] == communities[level.indices]].sum()
+    # Sum strength of each community
+    tot = np.bincount(communities, weights=strength)
+    return inner / total - resolution * np.sum((tot / total) ** 2)
+
+
+# Compute modularity of a partition
+def modularity(weights, partition, resolution=1.0):
+    """
+    Input:
+        - weights    : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- (symmetric) adjacency matrix
+        - partition  : numpy.ndarray -- community of each node
+        - resolution : float -- modularity resolution
+    Output:
+        - float - modularity, as in networkx (self loops are counted twice)
+    """
+    # Define modularity matrix
+    weights = sparse.csr_matrix(weights, dtype=float)
+    level = sparse.csr_matrix(weights + sparse.diags(weights.diagonal()))
+    strength = np.asarray(level.sum(axis=1)).ravel()
+    return level_modularity(level, np.asarray(partition), strength, strength.sum(), resolution)
+
+
+# Adjacency matrix shared by sweep processes
+_sweep_weights = None
+
+
+# Store adjacency matrix in sweep process (run once by each process)
+def set_sweep_weights(weights):
+    global _sweep_weights
+    _sweep_weights = weights
+
+
+# Detect communities on shared adjacency matrix (run by each sweep process)
+def sweep_louvain(resolution, seed):
+    return louvain(_sweep_weights, resolution=resolution, seed=seed)
+
+
+# Detect communities for each resolution and seed, in parallel
+def sweep_communities(weights, resolutions, seeds=(0, ), threshold=0, workers=None):
+    """
+    Input:
+        - weights     : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- (symmetric) adjacency matrix
+        - resolutions : list of floats -- modularity resolutions
+        - seeds       : list of ints -- random seeds, each one run with each resolution
+        - threshold   : int -- communities with more nodes are counted as selected
+        - workers     : int -- number of processes (default: one per core)
+    Output:
+        - pandas.DataFrame - modularity and communities size statistics, indexed by
+          resolution and seed
+        - dict - community of each node (numpy.ndarray) for each (resolution, seed)
+    """
+    # Run each resolution and seed in a pool of processes, sharing adjacency matrix once
+    keys = [(resolution, seed) for resolution in resolutions for seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_sweep_weights, initargs=(weights, )) as executor:
+        results = list(executor.map(sweep_louvain, *zip(*keys))) if keys else []
+    # Compute statistics of each partition
+    stats, partitions = [], {}
+    for key, (partition, score) in zip(keys, results):
+        sizes = np.bincount(partition)
+        selected = sizes[sizes > threshold]
+        stats.append({
+            'resolution': key[0],
+            'seed': key[1],
+            'modularity': score,
+            'n_communities': sizes.shape[0],
+            'max_size': sizes.max(initial=0),
+            'median_size': np.median(sizes) if sizes.shape[0] else 0,
+            'n_selected': selected.shape[0],
+            'selected_share': selected.sum() / max(partition.shape[0], 1)
+        })
+        partitions[key] = partition
+    stats = pd.DataFrame(stats, columns=[
+        'resolution', 'seed', 'modularity', 'n_communities',
+        'max_size', 'median_size', 'n_selected', 'selected_share'
+    ])
+    return stats.set_index(['resolution', 'seed']), partitions
+
+
+# Make pandas index out of nodes labels (tuples define a MultiIndex)
+def make_index(labels):
+    return pd.Index(list(labels))
+
+
+# Encode nodes, defined by one or more columns, as integer codes
+def factorize_nodes(df, columns):
+    """
+    Input:
+        - df      : pandas.DataFrame containing nodes columns
+        - columns : list of columns names defining a node (either one or more)
+    Output:
+        - numpy.ndarray - integer code of the node in each row
+        - numpy.ndarray - node label (either a value or a tuple of values) for each code
+    """
+    # Initialize codes and vocabularies of each column
+    codes, vocabularies = [], []
+    # Loop through each node column
+    for column in columns:
+        # Case categorical column: use its codes directly
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            codes.append(df[column].cat.codes.values.astype(np.int64))
+            vocabularies.append(np.asarray(df[column].cat.categories, dtype=object))
+        # Case plain column: encode values as sorted codes
+        else:
+            column_codes, vocabulary = pd.factorize(df[column], sort=True)
+            codes.append(column_codes.astype(np.int64))
+            vocabularies.append(np.asarray(vocabulary, dtype=object))
+    # Combine columns codes into a single code
+    combined = np.zeros(df.shape[0], dtype=np.int64)
+    for column_codes, vocabulary in zip(codes, vocabularies):
+        combined = combined * len(vocabulary) + column_codes
+    # Encode combined codes as contiguous node codes
+    nodes, combined = pd.factorize(combined, sort=True)
+    # Case single column: labels are plain values
+    if len(columns) == 1:
+        return nodes, vocabularies[0][combined]
+    # Decode combined codes into each column codes (last column first)
+    labels = []
+    for vocabulary in reversed(vocabularies):
+        combined, column_codes = np.divmod(combined, len(vocabulary))
+        labels.insert(0, vocabulary[column_codes])
+    # Define labels as tuples of values
+    tuples = np.empty(len(labels[0]), dtype=object)
+    tuples[:] = list(zip(*labels))
+    return nodes, tuples
+
+
 # # Test
 # if __name__ == '__main__':
 #     # load a pandas dataframe
@@ -0,0 +1,157 @@
+# Dependencies
+import numpy as np
+import pandas as pd
+import copy
+from pandas.tseries.frequencies import to_offset
+
+# Local dependencies
+from modules.network import CSRNetwork, page_rank, project_closed, make_index
+from modules.cooccurrence import NetworkBuilder
+from modules.degree import get_degrees
+
+# Constants
+# Window and stride of common series (pandas offsets aliases)
+WINDOWS = {
+    'weekly': ('W-MON', 'W-MON'),  # Calendar weeks, starting on monday
+    'monthly': ('MS', 'MS'),  # Calendar months
+    'rolling': ('30D', '1D')  # Rolling 30 days, moved by one day
+}
+
+
+# Build a series of co-occurrence networks over sliding windows of time, in one pass
+def network_series(
+    entities, tweets, window='MS', stride=None, node_columns=['entity_text'],
+    metrics=True, alpha=0.85, max_iter=100, tol=1e-6
+):
+    """
+    Entities are sorted by their tweet's date once, then each window is
+    obtained from the previous one by adding the co-occurrences of tweets
+    entering it and subtracting the ones of tweets leaving it. PageRank of
+    each window starts from the scores of the previous one.
+
+    Input
+    1. entities: Entities table;
+    2. tweets: Tweets table, defining the date of each tweet;
+    3. window: window length, as pandas offset alias (e.g. 'MS' for calendar
+    months, 'W-MON' for calendar weeks, '30D' for 30 days), or key of WINDOWS;
+    4. stride: distance between windows starts, as pandas offset alias
+    (default: same as window, i.e. no overlap);
+    5. node_columns: list of columns defining a node (e.g. ['entity_text',
+    'entity_tag'] for words);
+    6. metrics: whether degree and PageRank of each window are computed;
+    7. alpha, max_iter, tol: PageRank parameters (see page_rank);
+
+    Output
+    1. generator of (start, end, network, metrics) tuples, one per window
+    [start, end), where network is a CSRNetwork (nodes without edges are left
+    out) and metrics is a DataFrame of degree, unweighted degree and PageRank
+    of each node (None if not computed);
+    """
+    # Define window and stride offsets
+    if window in WINDOWS:
+        window, stride = WINDOWS[window][0], stride or WINDOWS[window][1]
+    window = to_offset(window)
+    stride = to_offset(stride) if stride is not None else window
+    # Retrieve date of each entity (entities of unknown tweets are left out)
+    dates = entities.df.tweet_id.map(tweets.df.drop_duplicates('tweet_id').set_index('tweet_id').tweet_date)
+    is_dated = dates.notnull().values
+    # Sort entities by date, once
+    order = np.argsort(dates.values[is_dated], kind='stable')
+    df = entities.df.loc[is_dated].iloc[order]
+    dates = pd.DatetimeIndex(dates[is_dated].iloc[order])
+    # Case there are no dated entities
+    if not dates.shape[0]:
+        return
+
+    # Initialize running co-occurrences and rows in current window
+    builder = NetworkBuilder(node_columns=node_columns)
+    lo_last, hi_last = 0, 0
+    # Initialize PageRank of each node, by node code
+    scores = np.empty(0)
+    # Define windows starts, the first one containing the first date
+    first = dates[0].normalize()
+    first = stride.rollback(first) if not isinstance(stride, pd.offsets.Tick) else first
+    for start in pd.date_range(first, dates[-1], freq=stride):
+        # Define window rows
+        end = start + window
+        lo, hi = dates.searchsorted(start), dates.searchsorted(end)
+        # Subtract rows leaving window, add rows entering it
+        builder.retract(get_batch(entities, df, lo_last, min(lo, hi_last)))
+        builder.ingest(get_batch(entities, df, max(lo, hi_last), hi))
+        lo_last, hi_last = lo, hi
+
+        # Retrieve window network (rows follow nodes codes), keep only nodes having edges
+        weights, labels = builder.get_weights(sort=False)
+        has_edges = np.diff(weights.indptr) > 0
+        network = CSRNetwork(project_closed(weights, has_edges), labels[has_edges])
+        # Case metrics are not required
+        if not metrics:
+            yield start, end, network, None
+            continue
+
+        # Compute degree of each node
+        weighted, unweighted = get_degrees(network.weights)
+        # Compute PageRank, starting from previous scores (new nodes start from the mean one)
+        nodes = np.flatnonzero(has_edges)
+        x = np.zeros(nodes.shape[0])
+        is_known = nodes < scores.shape[0]
+        x[is_known] = scores[nodes[is_known]]
+        is_new = x == 0
+        x[is_new] = x[~is_new].mean() if not is_new.all() else 1.0
+        rank = page_rank(network.weights, alpha=alpha, max_iter=max_iter, tol=tol, x=x)
+        # Store scores by node code
+        scores = np.zeros(has_edges.shape[0])
+        scores[nodes] = rank
+        yield start, end, network, pd.DataFrame(
+            {'degree': weighted, 'unweighted_degree': unweighted, 'page_rank': rank},
+            index=make_index(network.labels)
+        )
+
+
+# Wrap given rows of sorted entities into an Entities table (like the given one)
+def get_batch(entities, df, lo, hi):
+    batch = copy.copy(entities)
+    batch.df = df.iloc[lo:max(lo, hi)]
+    return batch
+
+
+# Test
+if __name__ == '__main__':
+
+    # Dependencies
+    from modules.network import Network
+    from datetime import datetime
+
+    # Define a minimal table wrapper
+    class Table:
+        def __init__(self, df):
+            self.df = df
+
+    # Define tweets, one per day, and their hashtags
+    rng = np.random.default_rng(0)
+    tweets = Table(pd.DataFrame({
+        'tweet_id': [str(i) for i in range(365)],
+        'tweet_date': pd.date_range('2019-01-01', periods=365, freq='D', tz='UTC')
+    }))
+    entities = Table(pd.DataFrame({
+        'tweet_id': np.repeat(tweets.df.tweet_id.values, 3),
+        'entity_index': np.tile(np.arange(3), 365),
+        'entity_text': ['#h{:d}'.format(i) for i in rng.integers(0, 30, 3 * 365)]
+    }))
+
+    # Build monthly networks, compare each one with the network built from scratch
+    start_time = datetime.now()
+    for start, end, network, metrics in network_series(entities, tweets, window='monthly'):
+        ids = tweets.df.tweet_id[(tweets.df.tweet_date >= start) & (tweets.df.tweet_date < end)]
+        expected = Network.from_entities(Table(entities.df[entities.df.tweet_id.isin(ids)]), node_columns=['entity_text'])
+        same = sorted((*sorted((x, y)), w) for x, y, w in network.to_networkx().edges(data='weight')) == sorted(
+            (*sorted((x, y)), w) for x, y, w in expected.net.edges(data='weight')
+        )
+        # Compare warm started PageRank with the one computed from scratch
+        error = np.absolute(metrics.page_rank - network.get_page_rank()).max()
+        print(start.date(), end.date(), 'nodes:', network.weights.shape[0], 'same as rebuilt:', same, 'PageRank error: {:.1e}'.format(error))
+    print('Monthly series took', datetime.now() - start_time)
+    # Build rolling 30 days networks
+    start_time = datetime.now()
+    n_windows = sum(1 for _ in network_series(entities, tweets, window='rolling'))
+    print('Rolling series of {:d} windows took'.format(n_windows), datetime.now() - start_time)
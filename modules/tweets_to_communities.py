@@ -1,94 +1,392 @@
 # Dependencies
 import sys
 import json
+import os
+import argparse
+import warnings
 import numpy as np
 import pandas as pd
-import networkx as nx
+from scipy import sparse
+from scipy.sparse import csgraph
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Local dependencies
-from dataset.tweets import Tweets
-from dataset.entities import Entities
+from modules.dataset.tweets import Tweets
+from modules.dataset.entities import Entities
 
 # Constants
 alpha = 0.9
-max_iter = 100
+max_iter = 250  # Error shrinks by about alpha per iteration: 0.9^250 is well below tol
+tol = 1e-6
+years = [2017, 2018, 2019]
 out_dir_path = "data/communities/"
+seed_list = ["#climatechange", "#climate", "#sdgs", "#sustainability", "#environment", "#globalwarming"]
 
 
-def get_adjacency_matrix(data):
+def get_adjacency_matrix(data, n_nodes):
     """
     Input:
-        - data: pandas.DataFrame with columns names = ['index_id', 'index_tag']
+        - data    : pandas.DataFrame with columns names = ['index_id', 'index_tag']
+        - n_nodes : int -- number of nodes (tweets and hashtags)
     Output:
-        - numpy.matrix A - Adjacency matrix
+        - scipy.sparse.csr_matrix A - Adjacency matrix (rows and columns follow nodes indices)
     """
-    # Create networkx graph object
-    graph = nx.from_pandas_edgelist(data, source='index_id', target='index_tag')
+    # Define edges in both directions (graph is undirected)
+    rows = np.concatenate([data.index_id.values, data.index_tag.values])
+    cols = np.concatenate([data.index_tag.values, data.index_id.values])
+    # Create adjacency matrix (repeated edges count once)
+    A = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_nodes, n_nodes))
+    A.data[:] = 1.0
     # Check if the graph is connected
-    cc = nx.number_connected_components(graph)
+    cc, _ = csgraph.connected_components(A, directed=False)
     if cc > 1:
         warnings.warn('The bipartite graph is not connected!')
-    # Extract adjacency matrix
-    A = nx.to_numpy_matrix(graph)
 
     return A
 
 
-
-def get_google_matrix(A, e2i, cluster, alpha):
+def get_teleport_matrix(e2i, clusters, n_nodes):
     """
     Input:
-        - A       : numpy.matrix of dimension [n_nodes, n_nodes]
-        - e2i     : dictionary that associates each node name to its number in the graph
-        - cluster : list of strings (node names)
-        - alpha   : float between 0 and 1 -- Dumping factor (which is 1 - teleport probability)
+        - e2i      : pandas.Series that associates each node name to its index in the graph
+        - clusters : list of lists of strings (node names), one list per community
+        - n_nodes  : int -- number of nodes
     Output:
-        - numpy.matrix - Google matrix G = alpha A + (1-alpha) C
+        - numpy.ndarray of dimension [n_nodes, n_clusters] -- teleport distribution of each community
     """
-    # Normalize A (stochastic on columns)
-    A /= A.sum(axis=0)
-    # Mask of indices in the cluster
-    mask = [ e2i[e] for e in cluster ]
-    # Compute google matrix
-    G = alpha*A
-    G[mask, :] += (1-alpha)/len(cluster)
-
-    return G
+    # Initialize teleport distributions
+    T = np.zeros((n_nodes, len(clusters)))
+    # Loop through communities
+    for j, cluster in enumerate(clusters):
+        # Indices of community nodes in the graph (nodes not in graph are ignored)
+        mask = e2i.reindex(cluster).dropna().values.astype(np.int64)
+        # Case no community node is in the graph: scores are undefined
+        if not len(mask):
+            T[:, j] = np.nan
+            continue
+        # Teleport uniformly to community nodes
+        T[mask, j] = 1 / len(mask)
+
+    return T
+
+
+def get_transition_matrix(A):
+    """
+    Input:
+        - A : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- Adjacency matrix
+    Output:
+        - scipy.sparse.csr_matrix P - Transition matrix (stochastic on columns)
+        - numpy.ndarray is_dangling - Boolean mask of nodes without out links
+    """
+    # Normalize A (stochastic on columns), dangling nodes have no out links
+    strength = np.asarray(A.sum(axis=0), dtype=float).ravel()
+    is_dangling = strength == 0
+    P = sparse.csr_matrix(A @ sparse.diags(np.divide(1.0, strength, out=np.zeros_like(strength), where=~is_dangling)))
 
+    return P, is_dangling
 
 
-def power_iteration(G, max_iter: int, tolerance=1e-3):
+def personalized_page_rank(A, T, alpha, max_iter: int, tolerance=tol):
     """
+    Solve personalized PageRank for all the communities at once, by power
+    iteration on the [n_nodes, n_clusters] scores block: teleportation is
+    never added to the transition matrix, which stays sparse.
+
     Input:
-        - G         : squared numpy.matrix -- Google matrix
+        - A         : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- Adjacency matrix
+        - T         : numpy.ndarray of dimension [n_nodes, n_clusters] -- teleport distributions
+        - alpha     : float between 0 and 1 -- Dumping factor (which is 1 - teleport probability)
         - max_iter  : int -- maximum number of iterations
-        - tolerance : float -- maximum accepted error
+        - tolerance : float -- maximum accepted error (l1 norm) of each community scores
     Output:
-        - approximate eigenvector of G (unique if G is a Google matrix)
+        - numpy.ndarray of dimension [n_nodes, n_clusters] -- stationary distribution of each community
     """
-    # Choose a random vector to decrease the chance that our vector is orthogonal to the eigenvector
-    b_k = np.random.rand(G.shape[1])
+    # Compute transition matrix
+    P, is_dangling = get_transition_matrix(A)
 
-    for _ in range(max_iter):
-        # Calculate the matrix-by-vector product Ab
-        b_k1 = G @ np.reshape(b_k, (-1,1))
+    return power_iteration(P, is_dangling, T, alpha, max_iter, tolerance)
 
-        # Calculate the norm
-        b_k1_norm = np.linalg.norm(b_k1)
 
-        # Re-normalize the vector
-        b_k = b_k1 / b_k1_norm
+def power_iteration(P, is_dangling, T, alpha, max_iter: int, tolerance=tol):
+    """
+    Input:
+        - P           : scipy.sparse matrix of dimension [n_nodes, n_nodes] -- Transition matrix
+        - is_dangling : numpy.ndarray of dimension [n_nodes] -- Boolean mask of nodes without out links
+        - T           : numpy.ndarray of dimension [n_nodes, n_clusters] -- teleport distributions
+        - alpha       : float between 0 and 1 -- Dumping factor
+        - max_iter    : int -- maximum number of iterations
+        - tolerance   : float -- maximum accepted error (l1 norm) of each community scores
+    Output:
+        - numpy.ndarray of dimension [n_nodes, n_clusters] -- stationary distribution of each community
+    """
+    # Start from teleport distributions
+    X = T.copy()
+    # Define communities whose scores have not converged yet
+    active = np.flatnonzero(~np.isnan(T).any(axis=0))
 
-        # If the precision increment is uniformly lower than the tolerance, break
-        if np.allclose(b_k, b_k1, atol=tolerance):
+    for _ in range(max_iter):
+        # Case every community has converged
+        if not len(active):
             break
+        # Compute next scores of active communities (dangling nodes teleport)
+        X_k = X[:, active]
+        X_k1 = alpha * (P @ X_k) + T[:, active] * (1 - alpha + alpha * X_k[is_dangling].sum(axis=0))
+        # Compute error of each community
+        err = np.absolute(X_k1 - X_k).sum(axis=0)
+        # Update scores, keep iterating only non converged communities
+        X[:, active] = X_k1
+        active = active[err >= tolerance]
+
+    # Warn about communities which did not converge
+    if len(active):
+        warnings.warn('PageRank did not converge for {:d} communities'.format(len(active)))
 
-    return b_k
+    return X
 
 
+def get_bipartite_graph(hashtags, communities):
+    """
+    Input:
+        - hashtags    : pandas.DataFrame with columns names = ['tweet_id', 'hashtag']
+        - communities : pandas.DataFrame with columns names = ['hashtag', 'community']
+    Output:
+        - scipy.sparse.csr_matrix A - Adjacency matrix, hashtags nodes first, then tweets nodes
+        - pandas.Series e2i - index of each hashtag node in the graph
+        - pandas.Index id_nodes - tweet id of each tweet node (following hashtags nodes)
+    """
+    # Keep only hashtags in a community
+    data = hashtags[hashtags.hashtag.isin(communities.hashtag)]
+
+    # Map entities in index: hashtags first, then tweets
+    tags, tag_nodes = pd.factorize(data.hashtag)
+    ids, id_nodes = pd.factorize(data.tweet_id)
+    n_nodes = len(tag_nodes) + len(id_nodes)
+    e2i = pd.Series(np.arange(len(tag_nodes)), index=tag_nodes)
+    # Add indices to data
+    data = pd.DataFrame({'index_id': ids + len(tag_nodes), 'index_tag': tags})
+
+    # Compute adjacency matrix
+    A = get_adjacency_matrix(data, n_nodes)
+
+    return A, e2i, pd.Index(id_nodes, name='tweet_id')
+
+
+def score_communities(hashtags, communities, alpha=alpha, max_iter=max_iter, tolerance=tol):
+    """
+    Input:
+        - hashtags    : pandas.DataFrame with columns names = ['tweet_id', 'hashtag']
+        - communities : pandas.DataFrame with columns names = ['hashtag', 'community']
+        - alpha       : float between 0 and 1 -- Dumping factor
+        - max_iter    : int -- maximum number of iterations
+        - tolerance   : float -- maximum accepted error
+    Output:
+        - pandas.DataFrame of dimension [n_tweets, n_clusters] -- score of each tweet (rows,
+          indexed by tweet id) in each community (columns), normalized on columns
+    """
+    # Compute bipartite tweets - hashtags graph
+    A, e2i, id_nodes = get_bipartite_graph(hashtags, communities)
+    n_nodes = A.shape[0]
+    # Compute teleport distribution of each community
+    clusters = communities.community.unique()
+    T = get_teleport_matrix(e2i, [communities.hashtag[communities.community == c] for c in clusters], n_nodes)
+    # Compute stationary distribution of each community
+    X = personalized_page_rank(A, T, alpha, max_iter, tolerance)
+
+    # Keep only tweets scores, normalize columns (L1-norm)
+    X = X[len(e2i):]
+    community_similarity = pd.DataFrame(X / X.sum(axis=0), index=id_nodes, columns=clusters)
+
+    return community_similarity
+
+
+class SharedGraph:
+    """
+    Transition matrix (CSR arrays) and dangling nodes mask stored in shared
+    memory blocks: worker processes attach to them by name, hence the graph
+    is never pickled nor copied.
+    """
+    # Arrays stored in shared memory
+    arrays = ['data', 'indices', 'indptr', 'is_dangling']
+
+    def __init__(self, blocks, spec):
+        # Shared memory blocks and their description (names, shapes, dtypes)
+        self.blocks, self.spec = blocks, spec
+        # Define arrays as views over shared memory blocks
+        self.values = {
+            name: np.ndarray(spec[name][1], dtype=spec[name][2], buffer=blocks[name].buf)
+            for name in self.arrays
+        }
+
+    @classmethod
+    def create(cls, P, is_dangling):
+        """
+        Input:
+            - P           : scipy.sparse.csr_matrix -- Transition matrix
+            - is_dangling : numpy.ndarray -- Boolean mask of nodes without out links
+        Output:
+            - SharedGraph holding a copy of the given arrays
+        """
+        # Define arrays to share
+        values = {'data': P.data, 'indices': P.indices, 'indptr': P.indptr, 'is_dangling': is_dangling}
+        # Allocate a shared memory block for each array (empty blocks are not allowed)
+        blocks = {name: shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1)) for name, a in values.items()}
+        spec = {name: (blocks[name].name, a.shape, a.dtype.str) for name, a in values.items()}
+        spec['shape'] = P.shape
+        # Copy arrays into shared memory
+        graph = cls(blocks, spec)
+        for name, a in values.items():
+            graph.values[name][...] = a
+
+        return graph
+
+    @classmethod
+    def attach(cls, spec):
+        # Attach to shared memory blocks already created by another process
+        return cls({name: shared_memory.SharedMemory(name=spec[name][0]) for name in cls.arrays}, spec)
+
+    def get_matrix(self):
+        # Wrap shared arrays into a transition matrix (no copy)
+        P = sparse.csr_matrix(
+            (self.values['data'], self.values['indices'], self.values['indptr']),
+            shape=self.spec['shape'], copy=False
+        )
+
+        return P, self.values['is_dangling']
+
+    def close(self):
+        # Release views, then detach from shared memory blocks
+        self.values = {}
+        for block in self.blocks.values():
+            block.close()
+
+    def unlink(self):
+        # Free shared memory blocks (call once, from the creating process)
+        for block in self.blocks.values():
+            block.unlink()
+
+
+# Graph attached by current worker process
+_graph = None
+
+
+def score_job(spec, teleports, n_tags, alpha, max_iter, tolerance):
+    """
+    Input:
+        - spec      : dict -- SharedGraph.spec of the year graph
+        - teleports : list of numpy.ndarray -- indices of the nodes of each community
+        - n_tags    : int -- number of hashtags nodes (preceding tweets nodes)
+        - alpha     : float between 0 and 1 -- Dumping factor
+        - max_iter  : int -- maximum number of iterations
+        - tolerance : float -- maximum accepted error
+    Output:
+        - numpy.ndarray of dimension [n_tweets, n_clusters] -- normalized tweets scores of each community
+    """
+    global _graph
+    # Attach to year graph, unless already attached
+    if _graph is None or _graph.spec != spec:
+        if _graph is not None:
+            _graph.close()
+        _graph = SharedGraph.attach(spec)
+    P, is_dangling = _graph.get_matrix()
+
+    # Compute teleport distribution of each community
+    T = np.zeros((P.shape[0], len(teleports)))
+    for j, mask in enumerate(teleports):
+        # Case no community node is in the graph: scores are undefined
+        if not len(mask):
+            T[:, j] = np.nan
+            continue
+        # Teleport uniformly to community nodes
+        T[mask, j] = 1 / len(mask)
+    # Compute stationary distribution of each community
+    X = power_iteration(P, is_dangling, T, alpha, max_iter, tolerance)
+
+    # Keep only tweets scores, normalize columns (L1-norm)
+    X = X[n_tags:]
+    return X / X.sum(axis=0)
+
+
+def score_years(data, workers=None, alpha=alpha, max_iter=max_iter, tolerance=tol):
+    """
+    Build each year graph once, in shared memory, then score its communities
+    in a pool of processes (each job scores a block of communities).
+
+    Input:
+        - data      : iterable of (year, hashtags, communities) tuples, see score_communities
+        - workers   : int -- number of processes (default: one per core)
+        - alpha     : float between 0 and 1 -- Dumping factor
+        - max_iter  : int -- maximum number of iterations
+        - tolerance : float -- maximum accepted error
+    Output:
+        - generator of (year, pandas.DataFrame) tuples, see score_communities, yielded as
+          soon as each year has been scored
+    """
+    # Define number of processes (default: one per core)
+    workers = workers or os.cpu_count() or 1
+    # Initialize graph, tweet ids, communities and number of pending jobs of each year
+    graphs, nodes, clusters, pending, results = {}, {}, {}, {}, {}
+    # Build graphs in shared memory before starting processes
+    jobs = []
+    try:
+        for year, hashtags, communities in data:
+            # Compute bipartite tweets - hashtags graph and its transition matrix
+            A, e2i, nodes[year] = get_bipartite_graph(hashtags, communities)
+            graphs[year] = SharedGraph.create(*get_transition_matrix(A))
+            # Define indices of the nodes of each community (nodes not in graph are ignored)
+            clusters[year] = communities.community.unique()
+            teleports = [
+                e2i.reindex(communities.hashtag[communities.community == c]).dropna().values.astype(np.int64)
+                for c in clusters[year]
+            ]
+            # Split communities in blocks, at least one per process (and one per year)
+            size = max(1, -(-len(teleports) // workers))
+            blocks = range(0, max(len(teleports), 1), size)
+            jobs += [
+                (year, j, (graphs[year].spec, teleports[j:j + size], len(e2i), alpha, max_iter, tolerance))
+                for j in blocks
+            ]
+            pending[year], results[year] = len(blocks), {}
+
+        # Score blocks of communities in parallel, yield years once done
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(score_job, *args): (year, j) for year, j, args in jobs}
+            for future in as_completed(futures):
+                year, j = futures[future]
+                results[year][j] = future.result()
+                pending[year] -= 1
+                # Case every block of the year is done: yield year scores, free its graph
+                if not pending[year]:
+                    blocks = results.pop(year)
+                    X = np.hstack([blocks[j] for j in sorted(blocks)])
+                    graph = graphs.pop(year)
+                    graph.close()
+                    graph.unlink()
+                    yield year, pd.DataFrame(X, index=nodes.pop(year), columns=clusters.pop(year))
+    # Free graphs left in shared memory (e.g. on errors)
+    finally:
+        for graph in graphs.values():
+            graph.close()
+            graph.unlink()
+
 
 def main():
 
+    # Define argument parser
+    parser = argparse.ArgumentParser()
+    # Years whose tweets are scored, one output file each
+    parser.add_argument('--years', nargs='+', type=int, default=years)
+    # Number of scoring processes (default: one per core, 1 scores years serially)
+    parser.add_argument('--workers', type=int, required=False)
+    # PageRank damping factor
+    parser.add_argument('--alpha', type=float, default=alpha)
+    # PageRank tolerance (l1 norm of each community scores error)
+    parser.add_argument('--tol', type=float, default=tol)
+    # PageRank maximum number of iterations
+    parser.add_argument('--max_iter', type=int, default=max_iter)
+    # Parse arguments
+    args = parser.parse_args()
+
     # Load communities data
     data_path = "data/communities/"
     communities = pd.read_csv(data_path+"hashtags_community_selected.csv", header=0)
@@ -97,9 +395,8 @@ def main():
     hashtags = Entities()
     hashtags.from_json("data/db/hashtags.json")
     hashtags.df = hashtags.df[['tweet_id','entity_text']].rename(columns={'entity_text': 'hashtag'})
-    hashtags.df.hashtag = hashtags.df.hashtag.apply(lambda x: x.lower())
+    hashtags.df.hashtag = hashtags.df.hashtag.str.lower()
     # Drop rows with search hashtags
-    seed_list = ["#climatechange", "#climate", "#sdgs", "#sustainability", "#environment", "#globalwarming"]
     hashtags.df = hashtags.df[~hashtags.df.hashtag.isin(seed_list)]
 
     # Load tweet data
@@ -107,50 +404,31 @@ def main():
     tweets.from_json("data/db/tweets.json")
 
     # Join with tweet_id
-    for year in years:
+    data = []
+    for year in args.years:
         # Select ids of the year
-        curr_ids = list(tweets.df.tweet_id[tweets.df.tweet_date.dt.year == year].values)
+        curr_ids = tweets.df.tweet_id[tweets.df.tweet_date.dt.year == year].values
         # Select communities of the year
         curr_communities = communities[communities.year == year]
-        # Select hashtags of interest
+        # Select hashtags of the year
         curr_hashtags = hashtags.df[hashtags.df.tweet_id.isin(curr_ids)]
-        # Create edges
-        data = curr_communities.merge(curr_hashtags, on="hashtag", how="outer")
-        # Drop not-in-cluster hashtags
-        data = data.loc[~data.isna().any(axis=1)]
-
-        # Map entities in index
-        nodes = list(data.hashtag.unique())
-        nodes.extend(data.tweet_id.unique())
-        e2i = dict(zip(nodes, range(len(nodes))))
-        # Map index in entities
-        i2e = dict(zip(range(len(nodes)), nodes))
-
-        # Add indices to data
-        data['index_id'] = data.tweet_id.apply(lambda x: e2i[x])
-        data['index_tag'] = data.hashtag.apply(lambda x: e2i[x])
-        data = data[['index_id', 'index_tag']]
-        # Init metrics container for year
-        clusters = curr_communities.community.unique()
-        community_similarity = pd.DataFrame(columns=clusters, dtype=float)
-
-        # Compute adjacency matrix
-        A = get_adjacency_matrix(data)
-
+        data.append((year, curr_hashtags, curr_communities))
+
+    # Case single worker: score each year in this process
+    if args.workers == 1:
+        results = (
+            (year, score_communities(curr_hashtags, curr_communities, args.alpha, args.max_iter, args.tol))
+            for year, curr_hashtags, curr_communities in data
+        )
+    # Otherwise, score communities of every year in parallel
+    else:
+        results = score_years(data, args.workers, args.alpha, args.max_iter, args.tol)
+
+    # Save results of each year, as soon as it has been scored
+    for year, community_similarity in results:
         print("Network {:d}".format(year))
-        # Loop through communities
-        for cluster in clusters:
-            # Compute Google matrix
-            G = get_google_matrix(A, e2i, curr_communities.hashtag[curr_communities.community == cluster], alpha)
-            # Compute eigenvector
-            v = power_iteration(G, 100)
-            # Add eigenvector to metrics container
-            community_similarity[cluster] = np.array(v).squeeze()
-
-        # Save results
         community_similarity.to_csv(out_dir_path+"tweet_communities{}.csv".format(year))
 
 
-
 if __name__ == "__main__":
     main()
@@ -3,10 +3,14 @@ import sys, os; sys.path.insert(1, os.path.join(sys.path[0], '..'))
 # Dependencies
 from modules.dataset.tweets import API_PRODUCT_30DAY, API_PRODUCT_FULL
 from modules.dataset.tweets import Tweets
+from modules.dataset.download import TokenBucket, JsonlWriter, SearchApi
+from modules.dataset.download import DownloadManifest
+from modules.dataset.index import JsonlIndex, INDEX_SUFFIX
+from modules.dataset.download import download_windows
 from datetime import datetime, date, timedelta
 import argparse
 import random
-import time
+import os
 import re
 
 
@@ -96,6 +100,23 @@ if __name__ == '__main__':
     parser.add_argument('--product', type=str, default=API_PRODUCT_30DAY)
     # Sampling seed (allows reproducibility)
     parser.add_argument('--seed', type=int, required=False)
+    # Number of windows requested concurrently
+    parser.add_argument('--workers', type=int, default=4)
+    # Maximum number of requests per second (overall)
+    parser.add_argument('--rate', type=float, default=0.5)
+    # Maximum number of requests sent in a burst
+    parser.add_argument('--burst', type=int, default=1)
+    # Maximum number of pages retrieved for each window
+    parser.add_argument('--max_pages', type=int, default=1)
+    # Download manifest file path (default: <out_path>.manifest.json)
+    parser.add_argument('--manifest_path', type=str, required=False)
+    # Downloaded tweet ids file path (default: <out_path>.ids)
+    parser.add_argument('--ids_path', type=str, required=False)
+    # Must the byte-offset index of output file be built? (T/F)
+    # An already existing index is always updated
+    parser.add_argument('--index', type=bool, default=False)
+    # Search API base url, overrides Twitter's one (e.g. local stand-in server)
+    parser.add_argument('--api_url', type=str, required=False)
     # Parse arguments to dictionary
     args = parser.parse_args()
 
@@ -159,40 +180,77 @@ if __name__ == '__main__':
     # Get authentication credentials files
     auth_path = args.auth_path
 
-    # Get sampled intervals
-    samples = sample_intervals(from_date, to_date, window=window)
+    # Get manifest and downloaded ids file paths
+    manifest_path = args.manifest_path or out_path + '.manifest.json'
+    ids_path = args.ids_path or out_path + '.ids'
 
     # Instantiate new Tweets dataset
     tweets = Tweets()
-    # Authenticate using auth file
-    tweets.auth_from_json(in_path=auth_path)
+    # Case a custom search API url has been set
+    if args.api_url is not None:
+        tweets.api = SearchApi(args.api_url)
+    # Otherwise, authenticate using auth file
+    else:
+        tweets.auth_from_json(in_path=auth_path)
 
     # Check if output file must be overwritten
     if overwrite:
         # Create empty file
         open(out_path, 'w', encoding='utf-8').close()
+        # Discard previous download progress and index
+        for path in [manifest_path, ids_path, out_path + INDEX_SUFFIX]:
+            if os.path.isfile(path):
+                os.remove(path)
 
-    # Log download started
-    print('Downloading samples...')
-    # Loop through each sampling interval
-    for i, (ws_datetime, we_datetime) in enumerate(samples):
-        # Get tweets for the sampled interval
-        tweets.search_tweets(
-            query=query,
-            from_date=ws_datetime,
-            to_date=we_datetime,
-            batch_size=batch_size,
-            label=label,
-            product=product,
-            jsonl_path=out_path
-        )
+    # Load download manifest (if any)
+    manifest = DownloadManifest(manifest_path)
+    # Case requested range has already been sampled: resume its intervals
+    if manifest.has_range(from_date, to_date):
+        print('Resuming download from {0:s}'.format(manifest_path))
+    # Otherwise, add intervals of days not sampled yet (previous ones are kept)
+    else:
+        n_added = manifest.add_windows(sample_intervals(from_date, to_date, window=window), from_date, to_date)
+        print('Added {0:d} new intervals to {1:s} ({2:d} intervals in total)'.format(
+            n_added, manifest_path, len(manifest.windows)
+        ))
+    # Get sampled intervals
+    samples = manifest.get_windows()
+
+    # Define function for showing download progress
+    def show_progress(i, window, n):
+        # Get window start and end times
+        ws_datetime, we_datetime = window
         # Show download progress
-        print('  ({0:d}/{1:d}) first {2:d} tweets from {3:s} to {4:s}'.format(
+        print('  ({0:d}/{1:d}) {2:d} new tweets from {3:s} to {4:s}'.format(
             i + 1,  # Current iteration
             len(samples),  # Total number of iterations
-            args.batch_size,  # Batch size
+            n,  # Number of new tweets
             ws_datetime.strftime('%Y-%m-%d %H:%M:%S'),  # Window start time
             we_datetime.strftime('%Y-%m-%d %H:%M:%S')  # Window end time
         ))
-        # Sleep 2 seconds
-        time.sleep(2)
+
+    # Log download started
+    print('Downloading samples...')
+    # Open single buffered writer on output file (skips already seen tweets)
+    with JsonlWriter(out_path, ids_path=ids_path) as writer:
+        # Download sampled windows concurrently, subject to rate limiting
+        download_windows(
+            tweets=tweets,
+            windows=samples,
+            label=label,
+            query=query,
+            batch_size=batch_size,
+            product=product,
+            writer=writer,
+            workers=args.workers,
+            limiter=TokenBucket(rate=args.rate, capacity=args.burst),
+            manifest=manifest,
+            max_pages=args.max_pages,
+            callback=show_progress
+        )
+
+    # Case output file index must be built or updated
+    if args.index or os.path.isfile(out_path + INDEX_SUFFIX):
+        # Index only tweets appended since last update
+        JsonlIndex(out_path).update()
+        print('Updated index {0:s}'.format(out_path + INDEX_SUFFIX))
@@ -2,9 +2,17 @@
 import sys, os; sys.path.insert(1, os.path.join(sys.path[0], '..'))
 
 # Dependencies
-from modules.dataset.tweets import Tweets
+from modules.dataset.tweets import Tweets, make_stored_filter
+from modules.dataset.index import Watermark, PartsLog, find_lines_end
+from modules.dataset.index import WATERMARK_SUFFIX, COMMITS_SUFFIX
+from modules.dataset.tagger import TaggerPool, TagCache, CachedTagger
+from modules.dataset.tagger import CACHE_SIZE
+from modules.dataset.substitutions import load_substitutions
+from modules.dataset.language import LanguageDetector
+from modules.dataset.pipeline import Pipeline, read_items, get_entities_stages, append_item
 import argparse
-import json
+import shutil
+import os
 
 
 # Main
@@ -22,38 +30,160 @@ if __name__ == '__main__':
     parser.add_argument('--out_hashtags', type=str, required=True)
     # Words formatted table output file (.json format)
     parser.add_argument('--out_words', type=str, required=True)
-    # List of substitutions dictionaries (.json format)
+    # List of substitutions dictionaries (either .json or compiled .pkl format)
     parser.add_argument('--in_subs', nargs='+', type=str, default=[])
+    # Number of tagger processes (default: one per core)
+    parser.add_argument('--tagger_workers', type=int, required=False)
+    # Number of tweets sent to a tagger process at once
+    parser.add_argument('--tagger_chunk_size', type=int, default=1000)
+    # Tagged texts cache file (.sqlite format), only new texts get tagged
+    parser.add_argument('--tag_cache', type=str, required=False)
+    # Maximum number of tagged texts kept in cache
+    parser.add_argument('--tag_cache_size', type=int, default=CACHE_SIZE)
+    # Output tables format: row-oriented .json or year/month partitioned .parquet
+    parser.add_argument('--out_format', type=str, choices=['json', 'parquet'], default='json')
+    # Run as a pipeline of stages over chunks of tweets (.parquet output only)
+    parser.add_argument('--pipeline', type=bool, default=False)
+    # Number of tweets in each chunk flowing through the pipeline
+    parser.add_argument('--chunk_size', type=int, default=10000)
+    # Maximum number of chunks waiting between two pipeline stages
+    parser.add_argument('--queue_size', type=int, default=2)
+    # Number of chunks tagged concurrently by each pipeline tagging stage
+    parser.add_argument('--tag_workers', type=int, default=2)
+    # Clean words table (see Entities.clean_entities) in pipeline mode
+    parser.add_argument('--clean_words', type=bool, default=False)
+    # Number of processes cleaning words in pipeline mode
+    parser.add_argument('--clean_workers', type=int, default=1)
+    # Process only tweets not already stored, appending them to stored tables (.parquet output only)
+    parser.add_argument('--incremental', type=bool, default=False)
+    # Watermark file (.json format), default: next to tweets table
+    parser.add_argument('--watermark_path', type=str, required=False)
+    # Keep only tweets in given language (e.g. en), trusting Twitter's one when set
+    parser.add_argument('--language', type=str, required=False)
+    # Number of language detection processes (default: one per core)
+    parser.add_argument('--language_workers', type=int, required=False)
     # Parse arguments
     args = parser.parse_args()
+    # Check that output tables can be appended to, in pipeline mode
+    if args.pipeline and args.out_format != 'parquet':
+        parser.error('--pipeline requires --out_format parquet')
+    # Check that new tweets can be appended, in incremental mode (.json tables would be rewritten as a whole)
+    if args.incremental and args.out_format != 'parquet':
+        parser.error('--incremental requires --out_format parquet')
+
+    # Define watermark, i.e. bytes of input file already processed
+    watermark = Watermark(args.watermark_path or args.out_tweets.rstrip('/') + WATERMARK_SUFFIX)
+    # Define log of .parquet parts whose writing completed, next to tweets table
+    log = PartsLog(args.out_tweets.rstrip('/') + COMMITS_SUFFIX)
+    # Define bytes range to process: up to last complete line (file may be growing)
+    offset, end = 0, find_lines_end(args.in_tweets)
+    # Define filter keeping only new tweets (none if tables are rebuilt from scratch)
+    is_new = None
+    # Case results are appended to stored .parquet tables: skip stored (and repeated) tweets
+    if args.out_format == 'parquet' and (args.incremental or not args.overwrite):
+        # Remove files left by an interrupted run (their tweets are processed again)
+        removed = log.clean([args.out_tweets, args.out_hashtags, args.out_words])
+        print('Removed {0:d} files of interrupted runs'.format(removed))
+        # Check ids of stored tweets only in the months of the processed ones
+        is_new = make_stored_filter(args.out_tweets)
+    # Case incremental mode: process only bytes after watermark
+    if args.incremental:
+        # Retrieve first byte not processed yet
+        offset = watermark.get_offset(args.in_tweets)
+        # Show incremental state
+        print('Processing bytes {0:d} to {1:d}'.format(offset, end))
+    # Case tables are rebuilt from scratch: remove previously stored .parquet tables
+    if args.overwrite and not args.incremental:
+        for out_path in [args.out_tweets, args.out_hashtags, args.out_words]:
+            if os.path.isdir(out_path):
+                shutil.rmtree(out_path)
+        # Remove log of removed parts
+        if os.path.isfile(log.path):
+            os.remove(log.path)
+
+    # Start language detection processes, if tweets must be filtered by language
+    detector = LanguageDetector(workers=args.language_workers) if args.language is not None else None
+
+    # Case pipeline mode: tables are appended chunk by chunk, as soon as they are ready
+    if args.pipeline:
+        # Load substitution dictionaries, compiled once
+        subs = load_substitutions(args.in_subs)
+        # Start tagger processes once, shared by tagging stages
+        with TaggerPool(workers=args.tagger_workers, chunk_size=args.tagger_chunk_size) as tagger:
+            # Case tagged texts cache is set: tag only texts missing from cache
+            if args.tag_cache is not None:
+                tagger = CachedTagger(TagCache(args.tag_cache, args.tag_cache_size), tagger=tagger)
+            # Define pipeline stages: filter, tag, substitute, re-tag, clean
+            pipeline = Pipeline(get_entities_stages(
+                tagger=tagger, subs=subs, text_filter=is_new,
+                language=args.language, detector=detector, clean=args.clean_words,
+                tag_workers=args.tag_workers, clean_workers=args.clean_workers
+            ), queue_size=args.queue_size)
+            # Initialize counters of stored rows
+            counts = {'tweets': 0, 'hashtags': 0, 'words': 0}
+            # Parse input file chunk by chunk, store each processed chunk
+            items = read_items(
+                args.in_tweets, chunk_size=args.chunk_size, offset=offset, end=end,
+                lang=args.language is not None
+            )
+            for item in pipeline.run(items):
+                append_item(item, args.out_tweets, args.out_hashtags, args.out_words, log=log)
+                # Update and show counters
+                counts = {k: counts[k] + item[k].df.shape[0] for k in counts}
+                print('Stored {tweets:d} tweets, {hashtags:d} hashtags, {words:d} words'.format(**counts))
+            # Close tagged texts cache
+            if args.tag_cache is not None:
+                tagger.cache.close()
+        # Terminate language detection processes
+        if detector is not None:
+            detector.close()
+        # Move watermark after processed bytes
+        watermark.update(args.in_tweets, end)
+        # Exit
+        sys.exit(0)
 
     # Instantiate new tweets table
     tweets = Tweets()
     # Parse tweets from input .jsonl file
-    tweets.from_json_list(in_path=args.in_tweets)
-    # Store tweets table to .json formatted file
-    tweets.to_json(out_path=args.out_tweets)
+    tweets.from_json_list(in_path=args.in_tweets, offset=offset, end=end, lang=args.language is not None)
+    # Keep only tweets not stored yet, if appending
+    if is_new is not None:
+        tweets.df = tweets.df.loc[is_new(tweets.df)]
+    # Keep only tweets in given language
+    if detector is not None:
+        tweets.filter_language(args.language, detector=detector)
+        detector.close()
+
+    # Load substitution dictionaries, compiled once
+    subs = load_substitutions(args.in_subs)
+
+    # Start tagger processes once, for both tagging passes
+    with TaggerPool(workers=args.tagger_workers, chunk_size=args.tagger_chunk_size) as tagger:
+        # Case tagged texts cache is set: tag only texts missing from cache
+        if args.tag_cache is not None:
+            tagger = CachedTagger(TagCache(args.tag_cache, args.tag_cache_size), tagger=tagger)
+        # Retrieve words and hashtags from tweets
+        hashtags, words = tweets.get_entities(subs=subs, tagger=tagger)
+        # Close tagged texts cache
+        if args.tag_cache is not None:
+            tagger.cache.close()
+    # Store hashtags, words and tweets tables to .json formatted files
+    if args.out_format == 'json':
+        hashtags.to_json(out_path=args.out_hashtags)
+        words.to_json(out_path=args.out_words)
+        tweets.to_json(out_path=args.out_tweets)
+    # Store all tables to .parquet partitioned datasets, as a single committed part
+    elif not tweets.df.empty:
+        append_item({'tweets': tweets, 'hashtags': hashtags, 'words': words},
+                    args.out_tweets, args.out_hashtags, args.out_words, log=log)
+    # Move watermark after processed bytes
+    watermark.update(args.in_tweets, end)
 
     # Show tweets DataFrame head
     print('Tweets table:')
     print(tweets.df.head())
     print()
 
-    # Load substitution dictionaries
-    subs = {}
-    # Loop through each substitutions dictionary .json file
-    for subs_path in args.in_subs:
-        # Open substitution dictionary file
-        with open(subs_path, 'r') as subs_file:
-            subs = {**subs, **json.load(subs_file)}
-
-    # Retrieve words and hashtags from tweets
-    hashtags, words = tweets.get_entities(subs=subs)
-    # Store hashtags table to .json formatted file
-    hashtags.to_json(out_path=args.out_hashtags)
-    # Store words table to .json formatted file
-    words.to_json(out_path=args.out_words)
-
     # Show hashtags DataFrame head
     print('Hashtags table:')
     print(hashtags.df.head())
@@ -0,0 +1,45 @@
+# Set root directory
+import sys, os; sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+# Dependencies
+from modules.dataset.tweets import Tweets
+from modules.dataset.normalize import write_levels, CHUNK_SIZE
+import argparse
+
+
+# Main
+if __name__ == '__main__':
+
+    # Define argument parser
+    parser = argparse.ArgumentParser()
+    # Tweets table input file (either .json file or .parquet dataset)
+    parser.add_argument('--in_tweets', type=str, required=True)
+    # Tweets table input format
+    parser.add_argument('--in_format', type=str, choices=['json', 'parquet'], default='json')
+    # Normalization levels (see modules.dataset.normalize.LEVELS)
+    parser.add_argument('--levels', nargs='+', type=int, default=[1, 2, 3])
+    # Normalized tweets output files (.tsv format), one per level
+    parser.add_argument('--out_tweets', nargs='+', type=str, required=True)
+    # Number of tweets normalized and written at once
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE)
+    # Parse arguments
+    args = parser.parse_args()
+    # Check that there is an output file for each level
+    if len(args.levels) != len(args.out_tweets):
+        parser.error('--out_tweets must contain one file per level')
+
+    # Load tweets table, once
+    tweets = Tweets()
+    if args.in_format == 'json':
+        tweets.from_json(args.in_tweets)
+    else:
+        tweets.from_parquet(args.in_tweets)
+
+    # Write tweets normalized at each level, all at once
+    write_levels(tweets, dict(zip(args.levels, args.out_tweets)), chunk_size=args.chunk_size)
+
+    # Show normalized tweets
+    for level in args.levels:
+        print('Tweets normalized at level {0:d}:'.format(level))
+        print(tweets.normalized(level).df.head())
+        print()